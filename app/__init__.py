@@ -1,18 +1,41 @@
 from flask import Flask
 from flask_login import LoginManager
 from flask_mail import Mail
-from .models import db, User
+from .models import db
 from .config import Config
+from .utils.engine import configure_engine_options, install_sqlite_pragmas
+from .utils.query_stats import init_query_stats
+from .utils.metrics import init_metrics
 
 login_manager = LoginManager()
 mail = Mail()
 
+
+def init_db(app):
+    """Engine options, Flask-SQLAlchemy and per-connection settings"""
+    configure_engine_options(app)
+    db.init_app(app)
+    with app.app_context():
+        for engine in db.engines.values():
+            install_sqlite_pragmas(engine, app.config)
+
+
+def create_db_app(config_class=Config):
+    """App with only the database set up: migrations and maintenance scripts, no background threads"""
+    app = Flask(__name__)
+    app.config.from_object(config_class)
+    init_db(app)
+    return app
+
+
 def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
     
     # Initialize extensions
-    db.init_app(app)
+    init_db(app)
+    init_query_stats(app)
+    init_metrics(app)
     login_manager.init_app(app)
     mail.init_app(app)
     
@@ -20,9 +43,9 @@ def create_app(config_class=Config):
     login_manager.login_message = 'Veuillez vous connecter pour accéder à cette page.'
     login_manager.login_message_category = 'warning'
     
-    @login_manager.user_loader
-    def load_user(user_id):
-        return User.query.get(int(user_id))
+    # current_user is rebuilt from a short-lived cache of principals
+    from .utils.identity import load_current_user
+    login_manager.user_loader(load_current_user)
     
     # Register blueprints
     from .routes.auth import auth_bp
@@ -35,21 +58,37 @@ def create_app(config_class=Config):
     app.register_blueprint(teacher_bp)
     app.register_blueprint(student_bp)
     
-    # Create database tables
-    with app.app_context():
-        db.create_all()
-        
-        # Create default admin if not exists
-        admin = User.query.filter_by(email='admin@uir.ac.ma').first()
-        if not admin:
-            admin = User(
-                email='admin@uir.ac.ma',
-                first_name='Super',
-                last_name='Admin',
-                role='admin'
-            )
-            admin.set_password('admin123')
-            db.session.add(admin)
-            db.session.commit()
+    # Compile the email templates once
+    from .utils.email import preload_email_templates
+    preload_email_templates(app)
     
+    # Check the schema version (upgrades it in development, see SCHEMA_AUTO_UPGRADE).
+    # The admin account is created by `flask bootstrap-admin` or init_database.py, not here.
+    from .migrations import check_schema_version
+    with app.app_context():
+        check_schema_version(app, db.engine)
+
+    from .cli import register_commands
+    register_commands(app)
+
+    # Password hashing processes (started by each process on its first hash)
+    from .utils.hashing import start_password_hasher
+    start_password_hasher(app)
+
+    # Auto-close forgotten sessions in the background
+    from .utils.scheduler import start_course_scheduler
+    start_course_scheduler(app)
+
+    # Deliver the email outbox
+    from .utils.outbox import start_email_workers
+    start_email_workers(app)
+
+    # Let the read replica report its lag
+    from .utils.replica import start_replica_heartbeat
+    start_replica_heartbeat(app)
+
+    # Resume imports interrupted by a restart or a dead worker
+    from .utils.import_jobs import start_import_job_watcher
+    start_import_job_watcher(app)
+
     return app
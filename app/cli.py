@@ -0,0 +1,37 @@
+"""Flask CLI commands (`flask --app run bootstrap-admin`)"""
+import click
+from app.models import db, User
+
+DEFAULT_ADMIN_EMAIL = 'admin@uir.ac.ma'
+DEFAULT_ADMIN_PASSWORD = 'admin123'
+
+
+def bootstrap_admin(email=DEFAULT_ADMIN_EMAIL, password=DEFAULT_ADMIN_PASSWORD):
+    """Create the super admin account if missing. Returns (admin, created)."""
+    admin = User.query.filter_by(email=email).first()
+    if admin:
+        return admin, False
+
+    admin = User(
+        email=email,
+        first_name='Super',
+        last_name='Admin',
+        role='admin'
+    )
+    admin.set_password(password)
+    db.session.add(admin)
+    db.session.commit()
+    return admin, True
+
+
+def register_commands(app):
+    @app.cli.command('bootstrap-admin')
+    @click.option('--email', default=DEFAULT_ADMIN_EMAIL, show_default=True)
+    @click.option('--password', default=DEFAULT_ADMIN_PASSWORD, show_default=True)
+    def bootstrap_admin_command(email, password):
+        """Crée le compte administrateur par défaut s'il n'existe pas"""
+        admin, created = bootstrap_admin(email, password)
+        if created:
+            click.echo(f"✓ Administrateur {admin.email} créé")
+        else:
+            click.echo(f"✓ Administrateur {admin.email} déjà présent")
@@ -12,6 +12,46 @@ class Config:
     # Default to sqlite or override in config_local.py for MySQL
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///app.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Engine profile: 'auto' (from the URI), 'sqlite' or 'mysql'; see app/utils/engine.py.
+    # The DB_* settings below override the profile when set.
+    DB_PROFILE = os.environ.get('DB_PROFILE', 'auto')
+    DB_POOL_SIZE = int(os.environ['DB_POOL_SIZE']) if os.environ.get('DB_POOL_SIZE') else None
+    DB_MAX_OVERFLOW = int(os.environ['DB_MAX_OVERFLOW']) if os.environ.get('DB_MAX_OVERFLOW') else None
+    DB_POOL_TIMEOUT = None
+    DB_POOL_RECYCLE = int(os.environ['DB_POOL_RECYCLE']) if os.environ.get('DB_POOL_RECYCLE') else None
+    DB_POOL_PRE_PING = None
+    DB_ISOLATION_LEVEL = os.environ.get('DB_ISOLATION_LEVEL')
+
+    # Read replica for the statistics pages (bind 'replica'); unset = everything on the primary
+    DATABASE_REPLICA_URL = os.environ.get('DATABASE_REPLICA_URL')
+    REPLICA_MAX_LAG_SECONDS = 30  # beyond that the primary is used
+    REPLICA_HEARTBEAT_INTERVAL = 5  # seconds between two heartbeat writes on the primary
+    REPLICA_CHECK_INTERVAL = 5  # seconds a lag verdict is reused
+
+    # Apply pending migrations at startup: on by default only in debug (FLASK_DEBUG=1 or run.py).
+    # In production run migrate.py before starting the workers.
+    SCHEMA_AUTO_UPGRADE = os.environ.get('SCHEMA_AUTO_UPGRADE', os.environ.get('FLASK_DEBUG', '0')) == '1'
+
+    # Per-request SQL statistics: requests above a threshold are logged with their repeated statements
+    QUERY_STATS_ENABLED = os.environ.get('QUERY_STATS_ENABLED', '1') == '1'
+    QUERY_COUNT_WARN_THRESHOLD = 30
+    QUERY_TIME_WARN_MS = 500
+    QUERY_REPEAT_WARN_THRESHOLD = 5  # same statement more often than that = probable N+1 loop
+
+    # Prometheus /metrics endpoint. With several worker processes, point METRICS_DIR to a local
+    # directory they all share so any worker reports the totals of all of them; the files of
+    # exited workers are folded into one at scrape time
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+    METRICS_DIR = os.environ.get('METRICS_DIR')
+    METRICS_FLUSH_INTERVAL = 5  # seconds between two writes of a process's values to METRICS_DIR
+    # Scrapes need "Authorization: Bearer <token>"; without a token /metrics only answers in debug mode
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+    # SQLite only, applied to every new connection
+    SQLITE_JOURNAL_MODE = 'WAL'
+    SQLITE_SYNCHRONOUS = 'NORMAL'  # safe with WAL, far fewer fsyncs
+    SQLITE_BUSY_TIMEOUT_MS = 15000
     
     # Email Configuration
     MAIL_SERVER = 'smtp.gmail.com'
@@ -20,16 +60,59 @@ class Config:
     MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
     MAIL_DEFAULT_SENDER = ('UIR Présence', os.environ.get('MAIL_USERNAME'))
+
+    # Email outbox workers
+    MAIL_WORKERS = int(os.environ.get('MAIL_WORKERS', 2))  # 0 = no worker in this process
+    MAIL_BATCH_SIZE = 50  # messages claimed at once by a worker
+    MAIL_RATE_LIMIT = 5  # messages per second per process (0 = unlimited)
+    MAIL_MAX_ATTEMPTS = 5
+    MAIL_RETRY_BACKOFF = 30  # seconds, doubled after each failed attempt
+    MAIL_OUTBOX_POLL_INTERVAL = 5  # seconds
     
     # Token expiration
     PASSWORD_TOKEN_EXPIRY = timedelta(hours=24)
+
+    # Password links: 'token' (stored on the user) or 'signed' (stateless, nothing stored)
+    PASSWORD_LINK_MODE = os.environ.get('PASSWORD_LINK_MODE', 'token')
     
     # QR Code refresh interval (seconds)
     QR_REFRESH_INTERVAL = 15
     
     # Late threshold (minutes)
     LATE_THRESHOLD_MINUTES = 20
-    
+
+    # Trusted devices: students can scan from a device without an open session
+    TRUSTED_DEVICE_COOKIE = 'uir_device'
+    TRUSTED_DEVICE_MAX_AGE = timedelta(days=30)  # a device unused that long must log in again
+    TRUSTED_DEVICE_ROTATE_AFTER = timedelta(days=1)  # credential re-signed on the next scan after that
+    TRUSTED_DEVICE_REVOCATION_REFRESH = 30  # seconds between two reloads of the revocation list
+
+    # Session scheduler (auto-close forgotten sessions, optional auto-start)
+    COURSE_SCHEDULER_ENABLED = os.environ.get('COURSE_SCHEDULER_ENABLED', '1') == '1'
+    COURSE_SCHEDULER_INTERVAL = 60  # seconds between two ticks
+    COURSE_MAX_DURATION_MINUTES = 240
+    COURSE_AUTO_START = os.environ.get('COURSE_AUTO_START', '0') == '1'
+    COURSE_AUTO_START_WINDOW_MINUTES = 15
+    # Planned dates are wall-clock times as typed by the teachers, compared with the time
+    # of this zone (e.g. 'Africa/Casablanca'); defaults to the server's local time
+    COURSE_SCHEDULE_TIMEZONE = os.environ.get('COURSE_SCHEDULE_TIMEZONE')
+
+    # Excel imports (run as background jobs)
+    IMPORT_JOBS_ASYNC = os.environ.get('IMPORT_JOBS_ASYNC', '1') == '1'
+    IMPORT_UPLOAD_FOLDER = os.environ.get('IMPORT_UPLOAD_FOLDER')  # defaults to instance/imports
+    IMPORT_JOB_STALE_SECONDS = 300  # a running job silent for that long is resumed
+    IMPORT_JOB_RESUME_INTERVAL = 60  # seconds between two checks for such jobs
+
+    # Password hashing (werkzeug method string, e.g. 'scrypt:32768:8:1' or 'pbkdf2:sha256:600000').
+    # Hashes made with another method are upgraded at the next login.
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+    # Hashing processes per app process (per gunicorn worker): keep workers x this near the core count
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))  # 0 = hash in the request thread
+    PASSWORD_HASH_QUEUE_FACTOR = 4  # pending hashes allowed per worker
+
+    # Seconds a user's role/headship snapshot is reused across requests (0 = reload every request)
+    IDENTITY_CACHE_TTL = int(os.environ.get('IDENTITY_CACHE_TTL', 30))
+
     # Rattrapage rules
     RATTRAPAGE_CM_TD_THRESHOLD = 0.5  # 50% absences allowed (aligned with visual warning)
     RATTRAPAGE_TP_THRESHOLD = 2  # 2 absences
@@ -0,0 +1,27 @@
+"""Versioned schema migrations: `python migrate.py` applies them, startup only checks the version"""
+from app.migrations.runner import MIGRATIONS, upgrade, current_version, latest_version
+from app.migrations import versions  # registers the migrations
+
+
+def check_schema_version(app, engine):
+    """
+    One query at boot instead of create_all() introspecting every table.
+    A database behind the code is upgraded when SCHEMA_AUTO_UPGRADE is on
+    (by default only in debug mode); otherwise the app refuses to start until
+    migrate.py has run.
+    """
+    version = current_version(engine)
+    if version >= latest_version():
+        return version
+
+    if not app.config.get('SCHEMA_AUTO_UPGRADE'):
+        raise RuntimeError(
+            f"Database schema is at version {version}, the code expects {latest_version()}: "
+            f"run `python migrate.py` first"
+        )
+
+    # Under the migration lock: with several workers booting, one migrates and the others wait
+    applied = upgrade(engine, log=app.logger.info)
+    if applied:
+        app.logger.info(f"Schema upgraded from version {version} to {applied[-1]}")
+    return current_version(engine)
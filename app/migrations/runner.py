@@ -0,0 +1,167 @@
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime
+import sqlalchemy as sa
+from sqlalchemy.exc import IntegrityError
+
+# Kept out of db.metadata: only the runner creates and reads it
+schema_version = sa.Table(
+    'schema_version', sa.MetaData(),
+    sa.Column('version', sa.Integer, primary_key=True, autoincrement=False),
+    sa.Column('name', sa.String(100), nullable=False),
+    sa.Column('applied_at', sa.DateTime, nullable=False),
+)
+
+# (version, name, function(engine, log)) in version order
+MIGRATIONS = []
+
+
+def migration(version, name):
+    """Register a migration. It must be idempotent: it may run on a database that already has the change"""
+    def register(function):
+        assert not MIGRATIONS or MIGRATIONS[-1][0] < version, 'migrations must be declared in order'
+        MIGRATIONS.append((version, name, function))
+        return function
+    return register
+
+
+def latest_version():
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+def current_version(engine):
+    """Single query; 0 when the database has never been migrated"""
+    try:
+        with engine.connect() as connection:
+            return connection.execute(sa.select(sa.func.max(schema_version.c.version))).scalar() or 0
+    except sa.exc.OperationalError:
+        return 0
+    except sa.exc.ProgrammingError:  # MySQL: table doesn't exist
+        return 0
+
+
+LOCK_NAME = 'presence_schema_migrations'
+
+
+@contextmanager
+def migration_lock(engine, timeout=600):
+    """
+    Only one process migrates at a time; the others wait, then find the
+    schema up to date. MySQL: GET_LOCK, held by a dedicated connection.
+    SQLite: an exclusive lock on a file next to the database (the migrations
+    open their own connections, so it cannot be a SQLite transaction).
+    """
+    if engine.dialect.name == 'mysql':
+        with engine.connect() as connection:
+            if connection.execute(sa.text("SELECT GET_LOCK(:name, :timeout)"),
+                                  {'name': LOCK_NAME, 'timeout': timeout}).scalar() != 1:
+                raise RuntimeError(f"Timed out after {timeout}s waiting for another process to finish migrating")
+            try:
+                yield
+            finally:
+                connection.execute(sa.text("SELECT RELEASE_LOCK(:name)"), {'name': LOCK_NAME})
+        return
+
+    database = engine.url.database if engine.dialect.name == 'sqlite' else None
+    try:
+        import fcntl
+    except ImportError:  # Windows: development only, a single process
+        fcntl = None
+    if not database or database == ':memory:' or fcntl is None:
+        yield
+        return
+
+    with open(f'{os.path.abspath(database)}.migrate.lock', 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def upgrade(engine, target=None, log=print):
+    """Apply the pending migrations up to `target` (default: all). Returns the versions applied."""
+    with migration_lock(engine):
+        schema_version.create(engine, checkfirst=True)
+        applied = []
+        # Read under the lock: a process that waited sees what the previous one applied
+        version = current_version(engine)
+        for number, name, function in MIGRATIONS:
+            if number <= version or (target is not None and number > target):
+                continue
+            log(f"→ {number:03d} {name}")
+            function(engine, log)
+            try:
+                with engine.begin() as connection:
+                    connection.execute(schema_version.insert().values(
+                        version=number, name=name, applied_at=datetime.utcnow()
+                    ))
+            except IntegrityError:
+                pass  # recorded by a process not using the lock (older code)
+            applied.append(number)
+        return applied
+
+
+# ---- Idempotent schema helpers (SQLite and MySQL) -------------------------
+
+def has_table(connection, table_name):
+    return sa.inspect(connection).has_table(table_name)
+
+
+def has_column(connection, table_name, column_name):
+    return column_name in {column['name'] for column in sa.inspect(connection).get_columns(table_name)}
+
+
+def create_tables(engine, metadata, *table_names):
+    """Create the tables (with their indexes) as declared on the models, if missing"""
+    with engine.begin() as connection:
+        metadata.create_all(connection, tables=[metadata.tables[name] for name in table_names], checkfirst=True)
+
+
+def add_column(engine, table_name, column, log=print):
+    """ALTER TABLE ... ADD COLUMN unless it exists; NOT NULL columns need a server_default"""
+    with engine.begin() as connection:
+        if has_column(connection, table_name, column.name):
+            return False
+        compiler = connection.dialect.ddl_compiler(connection.dialect, None)
+        connection.execute(sa.text(
+            f"ALTER TABLE {table_name} ADD COLUMN {compiler.get_column_specification(column)}"
+        ))
+    log(f"  ✓ {table_name}.{column.name} ajoutée")
+    return True
+
+
+def create_index(engine, index, log=print):
+    with engine.begin() as connection:
+        existing = {item['name'] for item in sa.inspect(connection).get_indexes(index.table.name)}
+        if index.name in existing:
+            return False
+        index.create(connection)
+    log(f"  ✓ index {index.name} créé")
+    return True
+
+
+def backfill_in_batches(engine, table, key_column, update, batch_size=1000, pause=0, log=print):
+    """
+    Run `update(connection, first_key, last_key)` over the table by ranges of
+    `batch_size` keys, one short transaction per range, so the application
+    keeps writing to the table while a large backfill runs.
+    """
+    last_key = None
+    batches = 0
+    while True:
+        with engine.begin() as connection:
+            query = sa.select(key_column).order_by(key_column).limit(batch_size)
+            if last_key is not None:
+                query = query.where(key_column > last_key)
+            keys = connection.execute(query).scalars().all()
+            if not keys:
+                break
+            update(connection, keys[0], keys[-1])
+        last_key = keys[-1]
+        batches += 1
+        if pause:
+            time.sleep(pause)
+    log(f"  ✓ {table.name} : {batches} lot(s) de {batch_size} traités")
+    return batches
@@ -0,0 +1,138 @@
+"""
+Schema history, oldest first. Never edit or renumber a released migration:
+add a new one at the end. Each step checks what is already there, so a
+database built by the old create_all() at any point converges to the same schema.
+"""
+import sqlalchemy as sa
+from app.models import db, Course, Attendance, ImportJob, AttendanceToken, User
+from app.migrations.runner import migration, create_tables, add_column, create_index, backfill_in_batches
+
+BACKFILL_BATCH_SIZE = 500
+
+
+def _index(table, name):
+    return next(index for index in table.indexes if index.name == name)
+
+
+@migration(1, 'initial_schema')
+def initial_schema(engine, log):
+    create_tables(engine, db.metadata,
+                  'departments', 'tracks', 'academic_years', 'semesters', 'subjects', 'users',
+                  'teacher_tracks', 'student_tracks', 'teacher_subject_assignments',
+                  'courses', 'attendances', 'attendance_tokens')
+
+
+@migration(2, 'legacy_track_level_and_current_year')
+def legacy_columns(engine, log):
+    """What migrate.py and manual_migrate.py used to do by hand"""
+    add_column(engine, 'tracks', sa.Column('level', sa.String(20), nullable=False, server_default='licence'), log)
+    add_column(engine, 'users', sa.Column('current_year_id', sa.Integer), log)
+
+    if engine.dialect.name == 'mysql':
+        with engine.begin() as connection:
+            foreign_keys = sa.inspect(connection).get_foreign_keys('users')
+            if not any(fk['constrained_columns'] == ['current_year_id'] for fk in foreign_keys):
+                connection.execute(sa.text(
+                    "ALTER TABLE users ADD CONSTRAINT fk_users_current_year "
+                    "FOREIGN KEY (current_year_id) REFERENCES academic_years(id)"
+                ))
+                log("  ✓ clé étrangère users.current_year_id ajoutée")
+
+
+@migration(3, 'course_attendance_counters')
+def course_attendance_counters(engine, log):
+    added = [
+        add_column(engine, 'courses', sa.Column(name, sa.Integer, nullable=False, server_default='0'), log)
+        for name in ('present_count', 'late_count', 'absent_count')
+    ]
+    if not any(added):
+        return  # the counters are already maintained by the application
+
+    courses, attendances = Course.__table__, Attendance.__table__
+
+    def status_count(status):
+        return sa.select(sa.func.count(attendances.c.id)).where(
+            attendances.c.course_id == courses.c.id, attendances.c.status == status
+        ).scalar_subquery()
+
+    def fill(connection, first_id, last_id):
+        connection.execute(courses.update().where(courses.c.id.between(first_id, last_id)).values(
+            present_count=status_count('present'),
+            late_count=status_count('late'),
+            absent_count=status_count('absent'),
+        ))
+
+    backfill_in_batches(engine, courses, courses.c.id, fill, BACKFILL_BATCH_SIZE, log=log)
+
+
+@migration(4, 'cascade_course_children')
+def cascade_course_children(engine, log):
+    """ON DELETE CASCADE from courses to attendances and tokens (MySQL; SQLite does not enforce them)"""
+    if engine.dialect.name != 'mysql':
+        return
+    for table_name in ('attendances', 'attendance_tokens'):
+        with engine.begin() as connection:
+            for fk in sa.inspect(connection).get_foreign_keys(table_name):
+                if fk['constrained_columns'] != ['course_id']:
+                    continue
+                if (fk.get('options') or {}).get('ondelete', '').upper() == 'CASCADE':
+                    break
+                connection.execute(sa.text(f"ALTER TABLE {table_name} DROP FOREIGN KEY {fk['name']}"))
+                connection.execute(sa.text(
+                    f"ALTER TABLE {table_name} ADD CONSTRAINT fk_{table_name}_course "
+                    f"FOREIGN KEY (course_id) REFERENCES courses(id) ON DELETE CASCADE"
+                ))
+                log(f"  ✓ {table_name}.course_id en ON DELETE CASCADE")
+
+
+@migration(5, 'course_scheduler_index')
+def course_scheduler_index(engine, log):
+    create_index(engine, _index(Course.__table__, 'ix_courses_status_scheduled_date'), log)
+
+
+@migration(6, 'import_jobs')
+def import_jobs(engine, log):
+    create_tables(engine, db.metadata, 'import_jobs')
+    # Sync mode columns, for tables created before it existed
+    for name in ('mode', 'updated_count', 'unchanged_count', 'removed_count'):
+        add_column(engine, 'import_jobs', ImportJob.__table__.c[name], log)
+
+
+@migration(7, 'email_outbox')
+def email_outbox(engine, log):
+    create_tables(engine, db.metadata, 'email_outbox')
+
+
+@migration(8, 'subject_code_sequences')
+def subject_code_sequences(engine, log):
+    create_tables(engine, db.metadata, 'subject_code_sequences')
+
+
+@migration(9, 'revoked_devices')
+def revoked_devices(engine, log):
+    create_tables(engine, db.metadata, 'revoked_devices')
+
+
+@migration(10, 'replica_heartbeat')
+def replica_heartbeat(engine, log):
+    create_tables(engine, db.metadata, 'replica_heartbeat')
+
+
+@migration(11, 'hot_query_indexes')
+def hot_query_indexes(engine, log):
+    """What migrate_indexes.py used to do"""
+    for table, name in [
+        (Course.__table__, 'ix_courses_subject_status'),
+        (Course.__table__, 'ix_courses_teacher_subject_type'),
+        (Attendance.__table__, 'ix_attendances_course_status'),
+        (Attendance.__table__, 'ix_attendances_student'),
+        (AttendanceToken.__table__, 'ix_attendance_tokens_course_created'),
+        (User.__table__, 'ix_users_role'),
+    ]:
+        create_index(engine, _index(table, name), log)
+
+
+@migration(12, 'course_started_at_index')
+def course_started_at_index(engine, log):
+    """Used by the scheduler to close the sessions running for too long"""
+    create_index(engine, _index(Course.__table__, 'ix_courses_status_started_at'), log)
@@ -1,10 +1,13 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+from app.utils.hashing import hash_password, verify_password, needs_rehash
+from app.utils.replica import RoutingSession
+from app.utils.metrics import inc
 from datetime import datetime, timedelta
 import secrets
+import uuid
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 # Association tables
 teacher_tracks = db.Table('teacher_tracks',
@@ -29,7 +32,7 @@ class User(UserMixin, db.Model):
     matricule = db.Column(db.String(50), unique=True)  # Student/Teacher ID
     
     # Role: admin, teacher, student
-    role = db.Column(db.String(20), nullable=False, default='teacher')
+    role = db.Column(db.String(20), nullable=False, default='teacher', index=True)
     
     # Extension roles (for teachers)
     is_dept_head = db.Column(db.Boolean, default=False)
@@ -72,10 +75,13 @@ class User(UserMixin, db.Model):
     attendances = db.relationship('Attendance', back_populates='student')
     
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
     
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return verify_password(self.password_hash, password)
+    
+    def password_needs_rehash(self):
+        return needs_rehash(self.password_hash)
     
     def generate_token(self, expiry_hours=24):
         self.token = secrets.token_urlsafe(32)
@@ -99,12 +105,16 @@ class User(UserMixin, db.Model):
     def dashboard_tabs(self):
         """Return list of dashboard tabs based on roles."""
         tabs = ['mes_cours']
-        if self.is_dept_head and self.headed_department:
+        if self.is_dept_head and self.headed_department_id:
             tabs.append('gestion_departement')
-        if self.is_track_head and self.headed_track:
+        if self.is_track_head and self.headed_track_id:
             tabs.append('gestion_filiere')
         return tabs
     
+    @property
+    def enrolled_track_ids(self):
+        return frozenset(track.id for track in self.enrolled_tracks)
+    
     def __repr__(self):
         return f'<User {self.email}>'
 
@@ -258,6 +268,18 @@ class Subject(db.Model):
         return f'<Subject {self.name}>'
 
 
+class SubjectCodeSequence(db.Model):
+    """Dernier numéro de code matière attribué par année (ex: INFO-L1-07 -> 7)"""
+    __tablename__ = 'subject_code_sequences'
+
+    track_id = db.Column(db.Integer, db.ForeignKey('tracks.id', ondelete='CASCADE'), primary_key=True)
+    academic_year_id = db.Column(db.Integer, db.ForeignKey('academic_years.id', ondelete='CASCADE'), primary_key=True)
+    last_value = db.Column(db.Integer, default=0, nullable=False)
+
+    def __repr__(self):
+        return f'<SubjectCodeSequence {self.academic_year_id} {self.last_value}>'
+
+
 class TeacherSubjectAssignment(db.Model):
     """Links teachers to subjects they teach"""
     __tablename__ = 'teacher_subject_assignments'
@@ -306,11 +328,23 @@ class Course(db.Model):
     started_at = db.Column(db.DateTime)
     ended_at = db.Column(db.DateTime)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    
+
+    # Attendance counters (kept in sync with the attendances rows)
+    present_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    late_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    absent_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
     subject = db.relationship('Subject', back_populates='courses')
     teacher = db.relationship('User')
     attendances = db.relationship('Attendance', back_populates='course', cascade='all, delete-orphan')
     
+    __table_args__ = (
+        db.Index('ix_courses_status_scheduled_date', 'status', 'scheduled_date'),
+        db.Index('ix_courses_status_started_at', 'status', 'started_at'),
+        db.Index('ix_courses_subject_status', 'subject_id', 'status'),
+        db.Index('ix_courses_teacher_subject_type', 'teacher_id', 'subject_id', 'course_type'),
+    )
+    
     def generate_qr_token(self):
         """Generate new QR token"""
         self.qr_token = secrets.token_urlsafe(16)
@@ -325,7 +359,11 @@ class Course(db.Model):
             return False
         # Token is valid for 20 seconds (15s + 5s grace period)
         return (datetime.utcnow() - self.qr_generated_at).total_seconds() <= 20
-    
+
+    @property
+    def attendance_total(self):
+        return self.present_count + self.late_count + self.absent_count
+
     def __repr__(self):
         return f'<Course {self.subject.name} - {self.course_type}>'
 
@@ -334,7 +372,7 @@ class Attendance(db.Model):
     __tablename__ = 'attendances'
     
     id = db.Column(db.Integer, primary_key=True)
-    course_id = db.Column(db.Integer, db.ForeignKey('courses.id'), nullable=False)
+    course_id = db.Column(db.Integer, db.ForeignKey('courses.id', ondelete='CASCADE'), nullable=False)
     student_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     
     # Status: present, absent
@@ -348,7 +386,11 @@ class Attendance(db.Model):
     course = db.relationship('Course', back_populates='attendances')
     student = db.relationship('User', back_populates='attendances')
     
-    __table_args__ = (db.UniqueConstraint('course_id', 'student_id'),)
+    __table_args__ = (
+        db.UniqueConstraint('course_id', 'student_id'),
+        db.Index('ix_attendances_course_status', 'course_id', 'status'),
+        db.Index('ix_attendances_student', 'student_id'),
+    )
     
     def __repr__(self):
         return f'<Attendance {self.student.email} - {self.status}>'
@@ -360,16 +402,300 @@ class AttendanceToken(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     token = db.Column(db.String(36), unique=True, nullable=False)  # UUID
-    course_id = db.Column(db.Integer, db.ForeignKey('courses.id'), nullable=False)
+    course_id = db.Column(db.Integer, db.ForeignKey('courses.id', ondelete='CASCADE'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     expires_at = db.Column(db.DateTime, nullable=False)
     
     course = db.relationship('Course', backref=db.backref('qr_tokens', cascade='all, delete-orphan'))
     
+    __table_args__ = (db.Index('ix_attendance_tokens_course_created', 'course_id', 'created_at'),)
+    
     def is_valid(self):
         return datetime.utcnow() < self.expires_at
 
 
+class RevokedDevice(db.Model):
+    """Appareil de confiance révoqué (scan sans session)"""
+    __tablename__ = 'revoked_devices'
+
+    id = db.Column(db.Integer, primary_key=True)
+    # No foreign key: the revocation must outlive a deleted student
+    student_id = db.Column(db.Integer, nullable=False, index=True)
+    # NULL revokes every device the student trusted before revoked_at
+    device_id = db.Column(db.String(36))
+    revoked_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f'<RevokedDevice {self.student_id} {self.device_id or "*"}>'
+
+
+class ImportJob(db.Model):
+    """Import Excel exécuté en arrière-plan"""
+    __tablename__ = 'import_jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    created_by_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+
+    # Role of the imported users: student, teacher
+    role = db.Column(db.String(20), nullable=False)
+
+    # Mode: add (new users only), sync (roster synchronisation, students only)
+    mode = db.Column(db.String(10), default='add', nullable=False, server_default='add')
+
+    # Status: pending, running, completed, failed
+    status = db.Column(db.String(20), default='pending', nullable=False)
+
+    # Uploaded workbook, kept on disk until the job is completed
+    filename = db.Column(db.String(255))
+    file_path = db.Column(db.String(500), nullable=False)
+
+    # Import destination
+    track_id = db.Column(db.Integer, db.ForeignKey('tracks.id'))
+    department_id = db.Column(db.Integer, db.ForeignKey('departments.id'))
+    current_year_id = db.Column(db.Integer, db.ForeignKey('academic_years.id'))
+    read_matricule = db.Column(db.Boolean, default=True, nullable=False)
+
+    # Progress (last_row is the last spreadsheet row committed, 1 = header)
+    total_rows = db.Column(db.Integer)
+    last_row = db.Column(db.Integer, default=1, nullable=False)
+    imported_count = db.Column(db.Integer, default=0, nullable=False)
+    error_count = db.Column(db.Integer, default=0, nullable=False)
+    updated_count = db.Column(db.Integer, default=0, nullable=False, server_default='0')
+    unchanged_count = db.Column(db.Integer, default=0, nullable=False, server_default='0')
+    removed_count = db.Column(db.Integer, default=0, nullable=False, server_default='0')
+    errors = db.Column(db.Text)
+    message = db.Column(db.Text)
+
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    created_by = db.relationship('User')
+    track = db.relationship('Track')
+
+    @property
+    def processed_rows(self):
+        return self.last_row - 1
+
+    @property
+    def is_finished(self):
+        return self.status in ('completed', 'failed')
+
+    def error_list(self):
+        return self.errors.split('\n') if self.errors else []
+
+    def throughput(self):
+        """Rows processed per second since the job started"""
+        if not self.started_at:
+            return 0
+        end = self.finished_at or datetime.utcnow()
+        elapsed = (end - self.started_at).total_seconds()
+        return round(self.processed_rows / elapsed, 1) if elapsed > 0 else 0
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'mode': self.mode,
+            'status': self.status,
+            'total_rows': self.total_rows,
+            'processed_rows': self.processed_rows,
+            'imported': self.imported_count,
+            'updated': self.updated_count,
+            'unchanged': self.unchanged_count,
+            'removed': self.removed_count,
+            'error_count': self.error_count,
+            'errors': self.error_list()[:20],
+            'message': self.message,
+            'rows_per_second': self.throughput()
+        }
+
+    def __repr__(self):
+        return f'<ImportJob {self.id} {self.status}>'
+
+
+class EmailOutbox(db.Model):
+    """Email en attente d'envoi (vidé par les workers SMTP)"""
+    __tablename__ = 'email_outbox'
+
+    id = db.Column(db.Integer, primary_key=True)
+    recipient = db.Column(db.String(120), nullable=False)
+    subject = db.Column(db.String(255), nullable=False)
+    html_body = db.Column(db.Text, nullable=False)
+    text_body = db.Column(db.Text)
+
+    # Status: pending, sending, sent, failed
+    status = db.Column(db.String(20), default='pending', nullable=False)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    last_error = db.Column(db.Text)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    # Worker currently holding the message
+    claimed_by = db.Column(db.String(32))
+    claimed_at = db.Column(db.DateTime)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+
+    __table_args__ = (db.Index('ix_email_outbox_status_next_attempt', 'status', 'next_attempt_at'),)
+
+    def __repr__(self):
+        return f'<EmailOutbox {self.recipient} {self.status}>'
+
+
+
+class ReplicaHeartbeat(db.Model):
+    """Horodatage écrit sur la base principale pour mesurer le retard de la réplique"""
+    __tablename__ = 'replica_heartbeat'
+
+    id = db.Column(db.Integer, primary_key=True)
+    beat_at = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f'<ReplicaHeartbeat {self.beat_at}>'
+
+
+COURSE_COUNTER_COLUMNS = {
+    'present': Course.present_count,
+    'late': Course.late_count,
+    'absent': Course.absent_count
+}
+
+
+def update_course_counters(course_id, old_status=None, new_status=None, amount=1):
+    """
+    Move `amount` attendances from old_status to new_status on the course row.
+    Uses a single increment-style UPDATE so concurrent scans never lose counts.
+    """
+    if old_status == new_status:
+        return
+
+    values = {}
+    if old_status in COURSE_COUNTER_COLUMNS:
+        column = COURSE_COUNTER_COLUMNS[old_status]
+        values[column] = column - amount
+    if new_status in COURSE_COUNTER_COLUMNS:
+        column = COURSE_COUNTER_COLUMNS[new_status]
+        values[column] = column + amount
+
+    if values:
+        Course.query.filter_by(id=course_id).update(values, synchronize_session=False)
+
+
+def change_attendance_status(attendance, new_status, **values):
+    """
+    Move the attendance from the status read earlier to new_status with a
+    conditional UPDATE, and the course counters with it. Returns False (and
+    changes nothing) when a concurrent request changed the status first.
+    """
+    old_status = attendance.status
+    result = db.session.execute(
+        db.update(Attendance)
+        .where(Attendance.id == attendance.id, Attendance.status == old_status)
+        .values(status=new_status, **values)
+    )
+    if result.rowcount != 1:
+        return False
+    update_course_counters(attendance.course_id, old_status, new_status)
+    return True
+
+
+def get_course_track_id(course):
+    """Return the id of the track a course belongs to"""
+    return db.session.query(AcademicYear.track_id).join(
+        Semester, Semester.academic_year_id == AcademicYear.id
+    ).join(
+        Subject, Subject.semester_id == Semester.id
+    ).filter(Subject.id == course.subject_id).scalar()
+
+
+def populate_course_attendances(course_id, track_id):
+    """
+    Create an 'absent' attendance for every enrolled student that has none yet,
+    with a single INSERT ... SELECT. Returns the number of rows created.
+    """
+    already_recorded = db.select(Attendance.id).where(
+        Attendance.course_id == course_id,
+        Attendance.student_id == student_tracks.c.student_id
+    ).exists()
+
+    students = db.select(
+        db.literal(course_id),
+        student_tracks.c.student_id,
+        db.literal('absent'),
+        db.literal(datetime.utcnow())
+    ).where(
+        student_tracks.c.track_id == track_id,
+        ~already_recorded
+    )
+
+    result = db.session.execute(
+        db.insert(Attendance).from_select(
+            ['course_id', 'student_id', 'status', 'created_at'], students
+        )
+    )
+    created = result.rowcount or 0
+    update_course_counters(course_id, new_status='absent', amount=created)
+    return created
+
+
+def start_course_session(course_id, track_id, now=None):
+    """
+    Open a pending session: conditional UPDATE pending -> active, then the
+    absent attendances and the first QR token. Returns False (and does
+    nothing) when another request or scheduler process opened it first.
+    """
+    now = now or datetime.utcnow()
+    started = Course.query.filter(
+        Course.id == course_id,
+        Course.status == 'pending'
+    ).update({
+        Course.status: 'active',
+        Course.started_at: now
+    }, synchronize_session='fetch')
+    if started != 1:
+        return False
+    populate_course_attendances(course_id, track_id)
+    issue_attendance_token(course_id)
+    return True
+
+
+def issue_attendance_token(course_id, lifetime_seconds=15):
+    """Add a fresh QR attendance token for the course to the session"""
+    token = AttendanceToken(
+        token=str(uuid.uuid4()),
+        course_id=course_id,
+        expires_at=datetime.utcnow() + timedelta(seconds=lifetime_seconds)
+    )
+    db.session.add(token)
+    inc('presence_attendance_tokens_total')
+    return token
+
+
+def recalculate_course_counters(course_ids=None):
+    """
+    Re-derive the attendance counters from the attendances table.
+    Returns the number of courses updated.
+    """
+    def status_count(status):
+        return db.select(db.func.count(Attendance.id)).where(
+            Attendance.course_id == Course.id,
+            Attendance.status == status
+        ).scalar_subquery()
+
+    query = Course.query
+    if course_ids is not None:
+        query = query.filter(Course.id.in_(course_ids))
+
+    updated = query.update({
+        Course.present_count: status_count('present'),
+        Course.late_count: status_count('late'),
+        Course.absent_count: status_count('absent')
+    }, synchronize_session=False)
+    db.session.commit()
+    return updated
+
+
 def calculate_rattrapage_status(student_id, subject_id):
     """
     Calculate if a student is in rattrapage for a subject.
@@ -469,3 +795,45 @@ def calculate_attendance_grade(student_id, subject_id):
         
     rate = cm_td_points / cm_td_total
     return round(rate * 20, 2)
+
+
+def summarize_attendance(counts, totals):
+    """
+    Compute the attendance figures of one student for one subject from aggregates.
+
+    Args:
+        counts: {course_type: {'present': n, 'late': n, 'absent': n}} for the
+                attendance rows recorded on completed sessions
+        totals: {course_type: number of completed sessions}
+
+    Applies the same rules as calculate_rattrapage_status and
+    calculate_attendance_grade. Sessions without an attendance row count as
+    absent in the totals but are not penalized for rattrapage.
+    """
+    def count(course_type, status):
+        return counts.get(course_type, {}).get(status, 0)
+
+    present = sum(count(t, 'present') for t in totals)
+    late = sum(count(t, 'late') for t in totals)
+    absent = sum(totals.values()) - present - late
+
+    cm_td_total = totals.get('CM', 0) + totals.get('TD', 0)
+    cm_td_points = sum(count(t, 'present') + count(t, 'late') * 0.5 for t in ('CM', 'TD'))
+    cm_td_absent = sum(count(t, 'absent') + count(t, 'late') * 0.5 for t in ('CM', 'TD'))
+    tp_absent = count('TP', 'absent') + count('TP', 'late') * 0.5
+
+    if cm_td_total > 0:
+        rate = cm_td_points / cm_td_total
+        presence_rate = (cm_td_total - cm_td_absent) / cm_td_total
+    else:
+        rate = 1.0
+        presence_rate = 1.0
+
+    return {
+        'present': present,
+        'late': late,
+        'absent': absent,
+        'rate': round(rate * 100, 1),
+        'grade': round(rate * 20, 2),
+        'is_rattrapage': presence_rate < 0.25 or tp_absent >= 2
+    }
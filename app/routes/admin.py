@@ -1,12 +1,17 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, current_app
 from flask_login import login_required, current_user
 from app.models import (db, User, Department, Track, AcademicYear, Semester, Subject,
-                        TeacherSubjectAssignment, Course, Attendance,
+                        TeacherSubjectAssignment, Course, Attendance, ImportJob,
                         calculate_rattrapage_status, calculate_attendance_grade)
 from app.utils.decorators import admin_required
+from app.utils.devices import revoke_devices
 from app.utils.email import send_password_creation_email
-import openpyxl
-from io import BytesIO
+from app.utils.exports import EXPORT_FORMATS, stream_table, subject_statistics_table
+from app.utils.import_jobs import create_import_job, start_import_job
+from app.utils.importer import is_import_file
+from app.utils.replica import read_replica
+from app.utils.structure import generate_academic_structure, clone_track_structure
+from app.utils import subject_codes
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
 
@@ -315,7 +320,7 @@ def delete_teacher(id):
 @login_required
 @admin_required
 def import_teachers():
-    """Import teachers from Excel file"""
+    """Import teachers from an Excel or CSV file"""
     departments = Department.query.order_by(Department.name).all()
     
     if request.method == 'POST':
@@ -330,69 +335,30 @@ def import_teachers():
             flash('Aucun fichier sélectionné.', 'danger')
             return render_template('admin/import_teachers.html', departments=departments)
         
-        if not file.filename.endswith(('.xlsx', '.xls')):
-            flash('Format de fichier invalide. Utilisez un fichier Excel (.xlsx).', 'danger')
+        if not is_import_file(file.filename):
+            flash('Format de fichier invalide. Utilisez un fichier Excel (.xlsx) ou CSV.', 'danger')
             return render_template('admin/import_teachers.html', departments=departments)
         
         try:
-            wb = openpyxl.load_workbook(BytesIO(file.read()))
-            ws = wb.active
-            
-            imported = 0
-            errors = []
-            
-            for row_num, row in enumerate(ws.iter_rows(min_row=2, values_only=True), start=2):
-                if not row[0]:  # Skip empty rows
-                    continue
-                
-                email = str(row[0]).strip().lower() if row[0] else None
-                first_name = str(row[1]).strip() if row[1] else None
-                last_name = str(row[2]).strip() if row[2] else None
-                matricule = str(row[3]).strip() if len(row) > 3 and row[3] else None
-                
-                if not email or not first_name or not last_name:
-                    errors.append(f"Ligne {row_num}: données manquantes")
-                    continue
-                
-                if User.query.filter_by(email=email).first():
-                    errors.append(f"Ligne {row_num}: email déjà existant ({email})")
-                    continue
-
-                if matricule and User.query.filter_by(matricule=matricule).first():
-                    errors.append(f"Ligne {row_num}: matricule déjà existant ({matricule})")
-                    continue
-                
-                teacher = User(
-                    email=email,
-                    first_name=first_name,
-                    last_name=last_name,
-                    matricule=matricule,
-                    role='teacher',
-                    department_id=department_id
-                )
-                db.session.add(teacher)
-                
-                try:
-                    send_password_creation_email(teacher)
-                except:
-                    pass
-                
-                imported += 1
-            
-            db.session.commit()
-            
-            if imported > 0:
-                flash(f'{imported} enseignant(s) importé(s) avec succès!', 'success')
-            if errors:
-                flash(f'{len(errors)} erreur(s): ' + '; '.join(errors[:3]), 'warning')
-            
-            return redirect(url_for('admin.teachers'))
-            
+            job = create_import_job(file, current_user, role='teacher', department_id=department_id)
         except Exception as e:
             flash(f'Erreur lors de l\'import: {str(e)}', 'danger')
             return render_template('admin/import_teachers.html', departments=departments)
+        
+        start_import_job(current_app._get_current_object(), job.id)
+        return redirect(url_for('admin.import_teachers', job_id=job.id))
     
-    return render_template('admin/import_teachers.html', departments=departments)
+    job = ImportJob.query.get(request.args.get('job_id', type=int) or 0)
+    return render_template('admin/import_teachers.html', departments=departments, job=job)
+
+
+@admin_bp.route('/import/jobs/<int:id>')
+@login_required
+@admin_required
+def import_job_status(id):
+    """Progress of a background import (polled by the import pages)"""
+    job = ImportJob.query.get_or_404(id)
+    return jsonify(job.to_dict())
 
 
 # ==================== DEPARTMENT HEAD MANAGEMENT ====================
@@ -521,21 +487,12 @@ def create_track():
         
         track = Track(name=name, level=level, description=description, department_id=department_id)
         db.session.add(track)
-        db.session.commit()
+        db.session.flush()
         
-        # Auto-generate academic structure if requested
+        # Auto-generate academic structure if requested (same transaction)
         if auto_generate:
-            structure = Track.get_academic_structure(level)
-            for i, (code, year_name) in enumerate(structure['years'], 1):
-                year = AcademicYear(name=year_name, order=i, track_id=track.id)
-                db.session.add(year)
-                db.session.commit()
-                
-                for j in range(1, structure['semesters_per_year'] + 1):
-                    sem_num = (i - 1) * structure['semesters_per_year'] + j
-                    semester = Semester(name=f'Semestre {sem_num}', order=j, academic_year_id=year.id)
-                    db.session.add(semester)
-            db.session.commit()
+            generate_academic_structure(track)
+        db.session.commit()
         
         flash(f'Filière "{name}" créée avec succès!', 'success')
         return redirect(url_for('admin.tracks'))
@@ -543,6 +500,41 @@ def create_track():
     return render_template('admin/track_form.html', departments=departments)
 
 
+@admin_bp.route('/tracks/<int:id>/clone', methods=['GET', 'POST'])
+@login_required
+@admin_required
+def clone_track(id):
+    """Create a new track with a copy of another track's structure"""
+    source = Track.query.get_or_404(id)
+    departments = Department.query.order_by(Department.name).all()
+    
+    if request.method == 'POST':
+        name = request.form.get('name', '').strip()
+        description = request.form.get('description', '').strip()
+        department_id = request.form.get('department_id', type=int) or source.department_id
+        
+        if not name:
+            flash('Le nom est obligatoire.', 'danger')
+            return render_template('admin/track_form.html', source=source, departments=departments)
+        
+        if Track.query.filter_by(name=name, department_id=department_id).first():
+            flash('Une filière avec ce nom existe déjà dans ce département.', 'danger')
+            return render_template('admin/track_form.html', source=source, departments=departments)
+        
+        track = Track(name=name, level=source.level, description=description, department_id=department_id)
+        db.session.add(track)
+        db.session.flush()
+        
+        years, semesters, subjects = clone_track_structure(source, track)
+        db.session.commit()
+        
+        flash(f'Filière "{name}" créée à partir de "{source.name}" : {years} année(s), '
+              f'{semesters} semestre(s), {subjects} matière(s).', 'success')
+        return redirect(url_for('admin.tracks'))
+    
+    return render_template('admin/track_form.html', source=source, departments=departments)
+
+
 @admin_bp.route('/tracks/<int:id>/edit', methods=['GET', 'POST'])
 @login_required
 @admin_required
@@ -828,30 +820,10 @@ def create_subject(semester_id):
             flash('Le nom est obligatoire.', 'danger')
             return render_template('admin/subject_form.html', semester=semester, track=track)
         
-        # Auto-generate code if empty
-        if not code:
-            # 1. Track Abbreviation (First 4 chars of valid word, or INFO default)
-            track_words = track.name.upper().split()
-            abbrev = track_words[0][:4] if track_words else 'GENI'
-            for word in track_words:
-                if word not in ['GENIE', 'MASTER', 'LICENCE', 'DOCTORAT']:
-                    abbrev = word[:4]
-                    break
-            
-            # 2. Level (L1, L2, M1...) from Academic Year name
-            # Assuming simplified year names or fallback logic
-            level_initial = track.level[0].upper() if track.level else 'L'
-            year_order = semester.academic_year.order
-            level_code = f"{level_initial}{year_order}"
-            
-            # 3. Number (Count + 1)
-            # Count subjects in the same academic year to maintain sequence
-            existing_count = 0
-            for sem in semester.academic_year.semesters:
-                existing_count += len(sem.subjects)
-            number = existing_count + 1
-            
-            code = f"{abbrev}-{level_code}-{number:02d}"
+        # Auto-generate code if empty or if the pre-filled suggestion was kept
+        # (it is only a preview: another admin may have taken it meanwhile)
+        if not code or code == request.form.get('suggested_code', '').strip().upper():
+            code = subject_codes.allocate_subject_code(track, semester.academic_year)
 
         subject = Subject(
             name=name, code=code, description=description,
@@ -864,31 +836,8 @@ def create_subject(semester_id):
         flash(f'Matière "{name}" créée avec succès!', 'success')
         return redirect(url_for('admin.tracks'))
     
-    # Pre-generate code for display in form
-    pre_filled_code = ''
-    try:
-        # 1. Track Abbreviation
-        track_words = track.name.upper().split()
-        abbrev = track_words[0][:4] if track_words else 'GENI'
-        for word in track_words:
-            if word not in ['GENIE', 'MASTER', 'LICENCE', 'DOCTORAT']:
-                abbrev = word[:4]
-                break
-        
-        # 2. Level Code
-        level_initial = track.level[0].upper() if track.level else 'L'
-        year_order = semester.academic_year.order
-        level_code = f"{level_initial}{year_order}"
-        
-        # 3. Number
-        existing_count = 0
-        for sem in semester.academic_year.semesters:
-            existing_count += len(sem.subjects)
-        number = existing_count + 1
-        
-        pre_filled_code = f"{abbrev}-{level_code}-{number:02d}"
-    except Exception as e:
-        print(f"Error generating code: {e}")
+    # Pre-generate code for display in form (not reserved until the subject is saved)
+    pre_filled_code = subject_codes.peek_subject_code(track, semester.academic_year)
 
     return render_template('admin/subject_form.html', semester=semester, track=track, pre_filled_code=pre_filled_code)
 
@@ -991,6 +940,7 @@ def assign_subject_teacher(id):
 @admin_bp.route('/statistics')
 @login_required
 @admin_required
+@read_replica
 def global_statistics():
     """Global establishment statistics"""
     # Get all tracks with their statistics
@@ -1015,10 +965,8 @@ def global_statistics():
                     courses = Course.query.filter_by(subject_id=subject.id, status='completed').all()
                     track_stats['courses_count'] += len(courses)
                     for course in courses:
-                        for att in course.attendances:
-                            total_attendance += 1
-                            if att.status == 'present':
-                                total_present += 1
+                        total_attendance += course.attendance_total
+                        total_present += course.present_count
         
         if total_attendance > 0:
             track_stats['attendance_rate'] = round(total_present / total_attendance * 100, 1)
@@ -1040,10 +988,8 @@ def global_statistics():
         total_attendance = 0
         
         for course in courses:
-            for att in course.attendances:
-                total_attendance += 1
-                if att.status == 'present':
-                    total_present += 1
+            total_attendance += course.attendance_total
+            total_present += course.present_count
         
         attendance_rate = 0
         if total_attendance > 0:
@@ -1076,6 +1022,7 @@ def global_statistics():
 @admin_bp.route('/statistics/subject/<int:id>')
 @login_required
 @admin_required
+@read_replica
 def subject_statistics(id):
     """Detailed statistics for a specific subject"""
     subject = Subject.query.get_or_404(id)
@@ -1143,6 +1090,22 @@ def subject_statistics(id):
                          total_sessions=total_sessions,
                          students_data=students_data)
 
+
+@admin_bp.route('/statistics/subject/<int:id>/export/<fmt>')
+@login_required
+@admin_required
+def export_subject_statistics(id, fmt):
+    """Download the statistics of a subject as CSV or Excel"""
+    subject = Subject.query.get_or_404(id)
+    
+    if fmt not in EXPORT_FORMATS:
+        flash('Format d\'export invalide.', 'danger')
+        return redirect(url_for('admin.subject_statistics', id=id))
+    
+    header, rows = subject_statistics_table(subject)
+    return stream_table(header, rows, fmt, f"statistiques_{subject.code}")
+
+
 # ==================== STUDENT MANAGEMENT ====================
 
 @admin_bp.route('/students/create', methods=['GET', 'POST'])
@@ -1271,6 +1234,7 @@ def delete_student(id):
         return redirect(url_for('admin.students'))
     
     name = student.full_name
+    revoke_devices(student.id)
     db.session.delete(student)
     db.session.commit()
     
@@ -1282,7 +1246,7 @@ def delete_student(id):
 @login_required
 @admin_required
 def import_students():
-    """Import students from Excel"""
+    """Import students from Excel or CSV"""
     departments = Department.query.order_by(Department.name).all()
     
     if request.method == 'POST':
@@ -1308,71 +1272,25 @@ def import_students():
             flash('Aucun fichier sélectionné.', 'danger')
             return render_template('admin/import_students.html', departments=departments)
         
-        if not file.filename.endswith(('.xlsx', '.xls')):
-            flash('Format de fichier invalide. Utilisez un fichier Excel (.xlsx).', 'danger')
+        if not is_import_file(file.filename):
+            flash('Format de fichier invalide. Utilisez un fichier Excel (.xlsx) ou CSV.', 'danger')
             return render_template('admin/import_students.html', departments=departments)
         
         try:
-            wb = openpyxl.load_workbook(BytesIO(file.read()))
-            ws = wb.active
-            
-            imported = 0
-            errors = []
-            
-            for row_num, row in enumerate(ws.iter_rows(min_row=2, values_only=True), start=2):
-                if not row[0]:  # Skip if email is missing
-                    continue
-                
-                email = str(row[0]).strip().lower() if row[0] else None
-                first_name = str(row[1]).strip() if len(row) > 1 and row[1] else None
-                last_name = str(row[2]).strip() if len(row) > 2 and row[2] else None
-                matricule = str(row[3]).strip() if len(row) > 3 and row[3] else None
-                
-                if not email or not first_name or not last_name:
-                    errors.append(f"Ligne {row_num}: données manquantes (Email, Prénom, Nom requis)")
-                    continue
-                
-                if User.query.filter_by(email=email).first():
-                    errors.append(f"Ligne {row_num}: email déjà existant ({email})")
-                    continue
-
-                if matricule and User.query.filter_by(matricule=matricule).first():
-                    errors.append(f"Ligne {row_num}: matricule déjà existant ({matricule})")
-                    continue
-                
-                student = User(
-                    email=email,
-                    first_name=first_name,
-                    last_name=last_name,
-                    matricule=matricule,
-                    role='student',
-                    current_year_id=academic_year_id,
-                    department_id=track.department_id
-                )
-                
-                # Assign to selected track
-                student.enrolled_tracks.append(track)
-                
-                db.session.add(student)
-                
-                try:
-                    send_password_creation_email(student)
-                except:
-                    pass
-                
-                imported += 1
-            
-            db.session.commit()
-            
-            if imported > 0:
-                flash(f'{imported} étudiant(s) importé(s) dans {track.name} (Année ID: {academic_year_id}) !', 'success')
-            if errors:
-                flash(f'{len(errors)} erreur(s): ' + '; '.join(errors[:3]), 'warning')
-            
-            return redirect(url_for('admin.students'))
-            
+            job = create_import_job(
+                file, current_user,
+                role='student',
+                track_id=track.id,
+                department_id=track.department_id,
+                current_year_id=academic_year_id,
+                mode='sync' if request.form.get('mode') == 'sync' else 'add'
+            )
         except Exception as e:
             flash(f'Erreur lors de l\'import: {str(e)}', 'danger')
             return render_template('admin/import_students.html', departments=departments)
+        
+        start_import_job(current_app._get_current_object(), job.id)
+        return redirect(url_for('admin.import_students', job_id=job.id))
     
-    return render_template('admin/import_students.html', departments=departments)
+    job = ImportJob.query.get(request.args.get('job_id', type=int) or 0)
+    return render_template('admin/import_students.html', departments=departments, job=job)
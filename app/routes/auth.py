@@ -1,6 +1,8 @@
 from flask import Blueprint, render_template, redirect, url_for, flash, request
 from flask_login import login_user, logout_user, login_required, current_user
 from app.models import db, User, Course
+from app.utils.password_links import CREATE, RESET, verify_password_token
+from app.utils.devices import revoke_devices
 from datetime import datetime
 
 auth_bp = Blueprint('auth', __name__)
@@ -47,6 +49,11 @@ def login():
             flash('Votre compte a été désactivé.', 'danger')
             return render_template('auth/login.html')
         
+        # Upgrade the hash if PASSWORD_HASH_METHOD changed since it was made
+        if user.password_needs_rehash():
+            user.set_password(password)
+            db.session.commit()
+        
         login_user(user, remember=remember)
         flash(f'Bienvenue, {user.first_name}!', 'success')
         
@@ -86,9 +93,9 @@ def logout():
 @auth_bp.route('/create-password/<token>', methods=['GET', 'POST'])
 def create_password(token):
     """Create password for new account"""
-    user = User.query.filter_by(token=token).first()
+    user = verify_password_token(token, CREATE)
     
-    if not user or not user.verify_token():
+    if not user:
         flash('Le lien est invalide ou a expiré.', 'danger')
         return redirect(url_for('auth.login'))
     
@@ -143,9 +150,9 @@ def reset_password(token):
     if current_user.is_authenticated:
         return redirect(url_for('auth.index'))
     
-    user = User.query.filter_by(token=token).first()
+    user = verify_password_token(token, RESET)
     
-    if not user or not user.verify_token():
+    if not user:
         flash('Le lien est invalide ou a expiré.', 'danger')
         return redirect(url_for('auth.forgot_password'))
     
@@ -163,6 +170,9 @@ def reset_password(token):
         
         user.set_password(password)
         user.clear_token()
+        # A reset may follow a lost phone: it no longer scans for the student
+        if user.role == 'student':
+            revoke_devices(user.id)
         db.session.commit()
         
         flash('Mot de passe réinitialisé avec succès!', 'success')
@@ -1,10 +1,12 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, current_app
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, make_response
 from flask_login import login_required, current_user
-from app.models import (db, User, Subject, Course, Attendance, AttendanceToken,
+from app.models import (db, User, Subject, Course, Attendance,
                         calculate_rattrapage_status, calculate_attendance_grade)
 from app.utils.decorators import student_required
-from app.utils.qr_generator import parse_qr_data
-from datetime import datetime
+from app.utils.attendance import record_scan
+from app.utils.devices import (issue_device_credential, read_device_credential, set_device_cookie,
+                               rotate_device_cookie, clear_device_cookie, revoke_devices)
+from app.utils.replica import read_replica
 
 student_bp = Blueprint('student', __name__, url_prefix='/student')
 
@@ -12,6 +14,7 @@ student_bp = Blueprint('student', __name__, url_prefix='/student')
 @student_bp.route('/dashboard')
 @login_required
 @student_required
+@read_replica
 def dashboard():
     """Student dashboard with subjects by semester"""
     # Get student's enrolled tracks
@@ -78,7 +81,7 @@ def subject_detail(id):
     
     # Verify student is enrolled in this track
     track = subject.semester.academic_year.track
-    if track not in current_user.enrolled_tracks:
+    if track.id not in current_user.enrolled_track_ids:
         flash('Vous n\'êtes pas inscrit à cette filière.', 'danger')
         return redirect(url_for('student.dashboard'))
     
@@ -159,11 +162,19 @@ def subject_detail(id):
 
 
 @student_bp.route('/scan')
-@login_required
-@student_required
 def scan():
-    """QR code scanner page"""
-    return render_template('student/scan.html')
+    """QR code scanner page (logged-in student or trusted device)"""
+    if current_user.is_authenticated and current_user.role == 'student':
+        return render_template('student/scan.html',
+                               scan_url=url_for('student.record_attendance'),
+                               device_trusted=read_device_credential() is not None)
+
+    if read_device_credential():
+        return render_template('student/scan.html',
+                               scan_url=url_for('student.record_device_attendance'),
+                               device_mode=True)
+
+    return redirect(url_for('auth.login', next=url_for('student.scan')))
 
 
 @student_bp.route('/attendance', methods=['POST'])
@@ -171,86 +182,44 @@ def scan():
 @student_required
 def record_attendance():
     """Record attendance from QR code scan"""
-    qr_data = request.json.get('qr_data', '')
-    
-    if not qr_data:
-        return jsonify({'success': False, 'message': 'Données QR invalides'}), 400
-    
-    # Parse QR data
-    parsed = parse_qr_data(qr_data)
-    if not parsed:
-        return jsonify({'success': False, 'message': 'Format QR invalide'}), 400
-    
-    course_id, token, timestamp = parsed
-    
-    # Get course
-    course = Course.query.get(course_id)
-    if not course:
-        return jsonify({'success': False, 'message': 'Séance non trouvée'}), 404
-    
-    # Check if course is active
-    if course.status != 'active':
-        return jsonify({'success': False, 'message': 'Cette séance n\'est pas active'}), 400
-    
-    # Verify token using AttendanceToken table
-    attendance_token = AttendanceToken.query.filter_by(
-        course_id=course_id,
-        token=token
-    ).first()
-    
-    if not attendance_token or not attendance_token.is_valid():
-        return jsonify({'success': False, 'message': 'QR code expiré. Veuillez rescanner.'}), 400
-    
-    # Check if student is enrolled in the track
-    track = course.subject.semester.academic_year.track
-    if track not in current_user.enrolled_tracks:
-        return jsonify({'success': False, 'message': 'Vous n\'êtes pas inscrit à cette filière'}), 403
-    
-    # Get or create attendance record
-    attendance = Attendance.query.filter_by(
-        course_id=course_id,
-        student_id=current_user.id
-    ).first()
-    
-    if not attendance:
-        attendance = Attendance(
-            course_id=course_id,
-            student_id=current_user.id
-        )
-        db.session.add(attendance)
-    
-    if attendance.status == 'present':
-        return jsonify({
-            'success': True, 
-            'message': 'Présence déjà enregistrée!',
-            'already_recorded': True
-        })
-    
-    attendance.scanned_at = datetime.utcnow()
-    
-    # Calculate status based on time (Late if > threshold)
-    if course.started_at:
-        delta = (attendance.scanned_at - course.started_at).total_seconds()
-        threshold_seconds = current_app.config.get('LATE_THRESHOLD_MINUTES', 20) * 60
-        
-        if delta > threshold_seconds:
-            attendance.status = 'late'
-        else:
-            attendance.status = 'present'
-    else:
-        attendance.status = 'present'
-        
+    body, status = record_scan(request.json.get('qr_data', ''), current_user.id,
+                               current_user.enrolled_track_ids)
+    return jsonify(body), status
+
+
+@student_bp.route('/device/attendance', methods=['POST'])
+def record_device_attendance():
+    """Record attendance from a trusted device: no session, no user row loaded"""
+    credential = read_device_credential()
+    if not credential:
+        response = jsonify({'success': False, 'message': 'Appareil non reconnu. Veuillez vous reconnecter.'})
+        return clear_device_cookie(response), 401
+
+    body, status = record_scan(request.json.get('qr_data', ''), credential.student_id)
+    return rotate_device_cookie(jsonify(body), credential), status
+
+
+@student_bp.route('/device/trust', methods=['POST'])
+@login_required
+@student_required
+def trust_device():
+    """Let this device scan without logging in"""
+    response = make_response(redirect(url_for('student.scan')))
+    set_device_cookie(response, issue_device_credential(current_user.id))
+    flash('Cet appareil est maintenant reconnu pour le scan.', 'success')
+    return response
+
+
+@student_bp.route('/device/revoke', methods=['POST'])
+@login_required
+@student_required
+def revoke_trusted_devices():
+    """Revoke every trusted device of the student, this one included"""
+    revoke_devices(current_user.id)
     db.session.commit()
-    
-    return jsonify({
-        'success': True,
-        'message': 'Présence enregistrée avec succès!',
-        'course': {
-            'subject': course.subject.name,
-            'type': course.course_type,
-            'title': course.title
-        }
-    })
+
+    flash('Tous vos appareils de confiance ont été révoqués.', 'success')
+    return clear_device_cookie(make_response(redirect(url_for('student.profile'))))
 
 
 @student_bp.route('/profile')
@@ -1,15 +1,19 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, current_app
 from flask_login import login_required, current_user
 from app.models import (db, User, Department, Track, AcademicYear, Semester, 
-                        Subject, TeacherSubjectAssignment, Course, Attendance, AttendanceToken,
-                        calculate_rattrapage_status, calculate_attendance_grade)
+                        Subject, TeacherSubjectAssignment, Course, Attendance, AttendanceToken, ImportJob,
+                        calculate_rattrapage_status, calculate_attendance_grade,
+                        update_course_counters, change_attendance_status, get_course_track_id,
+                        issue_attendance_token, start_course_session)
 from app.utils.decorators import teacher_required, dept_head_required, track_head_required
 from app.utils.email import send_password_creation_email
+from app.utils.exports import EXPORT_FORMATS, stream_table, subject_attendance_table, track_statistics_table
 from app.utils.qr_generator import generate_attendance_qr
 from datetime import datetime, timedelta
-import uuid
-import openpyxl
-from io import BytesIO
+from app.utils.import_jobs import create_import_job, start_import_job
+from app.utils.importer import is_import_file
+from app.utils.replica import read_replica
+from sqlalchemy.exc import IntegrityError
 
 teacher_bp = Blueprint('teacher', __name__, url_prefix='/teacher')
 
@@ -152,9 +156,6 @@ def courses():
     subject_id = request.args.get('subject_id', type=int)
     status = request.args.get('status')
     
-    # Debugging logs
-    print(f"DEBUG FILTERS: Track={track_id}, Year={year_id}, Semester={semester_id}, Subject={subject_id}, Status={status}")
-
     # Base query
     query = Course.query.filter_by(teacher_id=current_user.id)
 
@@ -175,7 +176,6 @@ def courses():
         query = query.filter(Course.status == status)
 
     courses = query.order_by(Course.created_at.desc()).all()
-    print(f"DEBUG: Found {len(courses)} courses")
 
     # Get available filter options (reuse logic for consistency)
     assignments = TeacherSubjectAssignment.query.filter_by(teacher_id=current_user.id).all()
@@ -272,6 +272,113 @@ def create_course(subject_id):
     return render_template('teacher/course_form.html', subject=subject, assignment=assignment)
 
 
+def get_outstanding_sessions(subject, assignment, teacher_id):
+    """Return {type: (already_created, remaining)} for the types the teacher handles"""
+    created = dict(
+        db.session.query(Course.course_type, db.func.count(Course.id))
+        .filter(Course.subject_id == subject.id, Course.teacher_id == teacher_id)
+        .group_by(Course.course_type)
+        .all()
+    )
+    planned = {
+        'CM': (assignment.teaches_cm, subject.total_cm or 0),
+        'TD': (assignment.teaches_td, subject.total_td or 0),
+        'TP': (assignment.teaches_tp, subject.total_tp or 0)
+    }
+
+    outstanding = {}
+    for course_type, (teaches, total) in planned.items():
+        if teaches:
+            already = created.get(course_type, 0)
+            outstanding[course_type] = (already, max(0, total - already))
+    return outstanding
+
+
+def iter_weekly_slots(start_date, weekdays, start_time):
+    """Yield datetimes on the given weekdays (0=Monday) starting from start_date"""
+    day = start_date
+    while True:
+        if day.weekday() in weekdays:
+            yield datetime.combine(day, start_time)
+        day += timedelta(days=1)
+
+
+@teacher_bp.route('/course/plan/<int:subject_id>', methods=['GET', 'POST'])
+@login_required
+@teacher_required
+def plan_courses(subject_id):
+    """Generate all outstanding sessions of a subject in one go"""
+    subject = Subject.query.get_or_404(subject_id)
+
+    assignment = TeacherSubjectAssignment.query.filter_by(
+        teacher_id=current_user.id,
+        subject_id=subject_id
+    ).first()
+
+    if not assignment:
+        flash('Vous n\'êtes pas assigné à cette matière.', 'danger')
+        return redirect(url_for('teacher.dashboard'))
+
+    outstanding = get_outstanding_sessions(subject, assignment, current_user.id)
+
+    if request.method == 'POST':
+        selected_types = [t for t in request.form.getlist('course_types') if t in outstanding]
+        start_date = request.form.get('start_date', '').strip()
+        start_time = request.form.get('start_time', '').strip()
+        weekdays = {d for d in request.form.getlist('weekdays', type=int) if 0 <= d <= 6}
+
+        if not selected_types:
+            flash('Sélectionnez au moins un type de séance.', 'danger')
+            return render_template('teacher/course_plan.html', subject=subject, outstanding=outstanding)
+
+        slots = None
+        if start_date:
+            try:
+                start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
+                start_time = datetime.strptime(start_time or '08:00', '%H:%M').time()
+            except ValueError:
+                flash('Date ou heure invalide.', 'danger')
+                return render_template('teacher/course_plan.html', subject=subject, outstanding=outstanding)
+
+            if not weekdays:
+                flash('Sélectionnez au moins un jour de la semaine.', 'danger')
+                return render_template('teacher/course_plan.html', subject=subject, outstanding=outstanding)
+
+            slots = iter_weekly_slots(start_date, weekdays, start_time)
+
+        # Interleave the types so the weekly pattern alternates CM/TD/TP
+        queues = {t: list(range(outstanding[t][0] + 1, outstanding[t][0] + outstanding[t][1] + 1))
+                  for t in selected_types}
+        now = datetime.utcnow()
+        rows = []
+        while any(queues.values()):
+            for course_type in selected_types:
+                if not queues[course_type]:
+                    continue
+                number = queues[course_type].pop(0)
+                rows.append({
+                    'subject_id': subject.id,
+                    'teacher_id': current_user.id,
+                    'course_type': course_type,
+                    'status': 'pending',
+                    'title': f"{subject.name} - {course_type} {number}",
+                    'scheduled_date': next(slots) if slots else None,
+                    'created_at': now
+                })
+
+        if not rows:
+            flash('Toutes les séances prévues ont déjà été créées.', 'info')
+            return redirect(url_for('teacher.dashboard'))
+
+        db.session.execute(db.insert(Course), rows)
+        db.session.commit()
+
+        flash(f'{len(rows)} séance(s) générée(s) avec succès!', 'success')
+        return redirect(url_for('teacher.courses', subject_id=subject.id))
+
+    return render_template('teacher/course_plan.html', subject=subject, outstanding=outstanding)
+
+
 @teacher_bp.route('/course/<int:id>')
 @login_required
 @teacher_required
@@ -330,36 +437,12 @@ def start_course(id):
         flash('Cette séance a déjà été démarrée ou terminée.', 'warning')
         return redirect(url_for('teacher.course_detail', id=id))
     
-    # Create attendance records for all students
-    track = course.subject.semester.academic_year.track
-    for student in track.students:
-        # Check if record already exists to avoid IntegrityError (e.g. if manually marked before start)
-        existing_attendance = Attendance.query.filter_by(
-            course_id=course.id,
-            student_id=student.id
-        ).first()
-        
-        if not existing_attendance:
-            attendance = Attendance(
-                course_id=course.id,
-                student_id=student.id,
-                status='absent'
-            )
-            db.session.add(attendance)
-    
-    course.status = 'active'
-    course.started_at = datetime.utcnow()
-    
-    # Generate initial token using AttendanceToken
-    token_str = str(uuid.uuid4())
-    expires_at = datetime.utcnow() + timedelta(seconds=15)
-    
-    new_token = AttendanceToken(
-        token=token_str,
-        course_id=course.id,
-        expires_at=expires_at
-    )
-    db.session.add(new_token)
+    # Opens it, creates the attendance records for the students not already marked
+    # (e.g. manually before start) and the initial token, unless it was started meanwhile
+    if not start_course_session(course.id, get_course_track_id(course)):
+        db.session.rollback()
+        flash('Cette séance a déjà été démarrée ou terminée.', 'warning')
+        return redirect(url_for('teacher.course_detail', id=id))
     db.session.commit()
     
     return redirect(url_for('teacher.qr_display', id=id))
@@ -384,14 +467,7 @@ def qr_display(id):
     latest_token = AttendanceToken.query.filter_by(course_id=id).order_by(AttendanceToken.created_at.desc()).first()
     
     if not latest_token or not latest_token.is_valid():
-        token_str = str(uuid.uuid4())
-        expires_at = datetime.utcnow() + timedelta(seconds=15)
-        latest_token = AttendanceToken(
-            token=token_str,
-            course_id=id,
-            expires_at=expires_at
-        )
-        db.session.add(latest_token)
+        latest_token = issue_attendance_token(id)
         db.session.commit()
     
     qr_image = generate_attendance_qr(course.id, latest_token.token)
@@ -399,10 +475,7 @@ def qr_display(id):
     # Count students: total and present
     track = course.subject.semester.academic_year.track
     total_students = len(track.students)
-    present_students = Attendance.query.filter_by(
-        course_id=course.id,
-        status='present'
-    ).count()
+    present_students = course.present_count
     
     return render_template('teacher/qr_display.html', 
                          course=course, 
@@ -422,15 +495,7 @@ def refresh_qr(id):
         return jsonify({'error': 'Unauthorized'}), 403
     
     # Generate new token
-    token_str = str(uuid.uuid4())
-    expires_at = datetime.utcnow() + timedelta(seconds=15)
-    
-    new_token = AttendanceToken(
-        token=token_str,
-        course_id=course.id,
-        expires_at=expires_at
-    )
-    db.session.add(new_token)
+    new_token = issue_attendance_token(course.id)
     
     # Clean up old tokens (optional, keeping last 5 mins for safety)
     # db.session.query(AttendanceToken).filter(AttendanceToken.expires_at < datetime.utcnow() - timedelta(minutes=5)).delete()
@@ -442,10 +507,7 @@ def refresh_qr(id):
     # Count students: total and present
     track = course.subject.semester.academic_year.track
     total_students = len(track.students)
-    present_students = Attendance.query.filter_by(
-        course_id=course.id,
-        status='present'
-    ).count()
+    present_students = course.present_count
     
     return jsonify({
         'qr_image': qr_image,
@@ -561,19 +623,28 @@ def delete_course(id):
 @teacher_required
 def bulk_delete_courses():
     """Delete multiple course sessions"""
-    course_ids = request.form.getlist('course_ids')
+    course_ids = request.form.getlist('course_ids', type=int)
     
     if not course_ids:
         flash('Aucune séance sélectionnée.', 'warning')
         return redirect(url_for('teacher.courses'))
-        
-    deleted_count = 0
-    for course_id in course_ids:
-        course = Course.query.get(course_id)
-        if course and course.teacher_id == current_user.id and course.status == 'pending':
-            db.session.delete(course)
-            deleted_count += 1
-            
+    
+    # Only pending sessions owned by the teacher can be deleted
+    deletable_ids = db.select(Course.id).where(
+        Course.id.in_(course_ids),
+        Course.teacher_id == current_user.id,
+        Course.status == 'pending'
+    )
+    
+    # Remove dependent rows first so no course graph is loaded through the ORM
+    Attendance.query.filter(Attendance.course_id.in_(deletable_ids)).delete(synchronize_session=False)
+    AttendanceToken.query.filter(AttendanceToken.course_id.in_(deletable_ids)).delete(synchronize_session=False)
+    deleted_count = Course.query.filter(
+        Course.id.in_(course_ids),
+        Course.teacher_id == current_user.id,
+        Course.status == 'pending'
+    ).delete(synchronize_session=False)
+    
     db.session.commit()
     
     if deleted_count > 0:
@@ -604,22 +675,28 @@ def update_course_attendance(course_id, student_id):
     ).first()
     
     if not attendance:
-        attendance = Attendance(
+        db.session.add(Attendance(
             course_id=course_id,
             student_id=student_id,
             status=status
-        )
-        db.session.add(attendance)
+        ))
+        update_course_counters(course_id, new_status=status)
     else:
-        attendance.status = status
-        # If manually marked, maybe update scanned_at? 
-        # If marking present/late manualy, we could set scanned_at to now if None
-        if (status == 'present' or status == 'late') and not attendance.scanned_at:
-            attendance.scanned_at = datetime.utcnow()
+        scanned_at = attendance.scanned_at
+        # If manually marked present/late, set scanned_at to now if None
+        if (status == 'present' or status == 'late') and not scanned_at:
+            scanned_at = datetime.utcnow()
         elif status == 'absent':
-             attendance.scanned_at = None
-        
-    db.session.commit()
+            scanned_at = None
+        if not change_attendance_status(attendance, status, scanned_at=scanned_at):
+            db.session.rollback()
+            return jsonify({'success': False, 'message': 'La présence a changé entre-temps, rechargez la page'}), 409
+    
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': 'La présence a changé entre-temps, rechargez la page'}), 409
     return jsonify({'success': True})
 
 
@@ -628,6 +705,7 @@ def update_course_attendance(course_id, student_id):
 @teacher_bp.route('/subject/<int:id>/attendance')
 @login_required
 @teacher_required
+@read_replica
 def subject_attendance(id):
     """View attendance for a subject"""
     subject = Subject.query.get_or_404(id)
@@ -707,6 +785,30 @@ def subject_attendance(id):
                           students_data=students_data)
 
 
+@teacher_bp.route('/subject/<int:id>/attendance/export/<fmt>')
+@login_required
+@teacher_required
+def export_subject_attendance(id, fmt):
+    """Download the attendance sheet of a subject as CSV or Excel"""
+    subject = Subject.query.get_or_404(id)
+    
+    assignment = TeacherSubjectAssignment.query.filter_by(
+        teacher_id=current_user.id,
+        subject_id=id
+    ).first()
+    
+    if not assignment:
+        flash('Vous n\'êtes pas assigné à cette matière.', 'danger')
+        return redirect(url_for('teacher.dashboard'))
+    
+    if fmt not in EXPORT_FORMATS:
+        flash('Format d\'export invalide.', 'danger')
+        return redirect(url_for('teacher.subject_attendance', id=id))
+    
+    header, rows = subject_attendance_table(subject)
+    return stream_table(header, rows, fmt, f"presences_{subject.code}")
+
+
 # ==================== DEPARTMENT HEAD ROUTES ====================
 
 @teacher_bp.route('/department')
@@ -1223,7 +1325,7 @@ def create_student():
 @login_required
 @track_head_required
 def import_students():
-    """Import students from Excel"""
+    """Import students from Excel or CSV"""
     track = current_user.headed_track
     
     if request.method == 'POST':
@@ -1237,63 +1339,51 @@ def import_students():
             flash('Aucun fichier sélectionné.', 'danger')
             return render_template('teacher/import_students.html', track=track)
         
-        if not file.filename.endswith(('.xlsx', '.xls')):
-            flash('Format de fichier invalide. Utilisez un fichier Excel (.xlsx).', 'danger')
+        if not is_import_file(file.filename):
+            flash('Format de fichier invalide. Utilisez un fichier Excel (.xlsx) ou CSV.', 'danger')
+            return render_template('teacher/import_students.html', track=track)
+
+        mode = 'sync' if request.form.get('mode') == 'sync' else 'add'
+        academic_year_id = request.form.get('academic_year_id', type=int)
+        if academic_year_id and not AcademicYear.query.filter_by(id=academic_year_id, track_id=track.id).first():
+            flash('Année invalide.', 'danger')
+            return render_template('teacher/import_students.html', track=track)
+
+        # A file lists one year: without it, the students of the other years would be removed
+        if mode == 'sync' and not academic_year_id:
+            flash('Sélectionnez l\'année à synchroniser.', 'danger')
             return render_template('teacher/import_students.html', track=track)
         
         try:
-            wb = openpyxl.load_workbook(BytesIO(file.read()))
-            ws = wb.active
-            
-            imported = 0
-            errors = []
-            
-            for row_num, row in enumerate(ws.iter_rows(min_row=2, values_only=True), start=2):
-                if not row[0]:
-                    continue
-                
-                email = str(row[0]).strip().lower() if row[0] else None
-                first_name = str(row[1]).strip() if row[1] else None
-                last_name = str(row[2]).strip() if row[2] else None
-                
-                if not email or not first_name or not last_name:
-                    errors.append(f"Ligne {row_num}: données manquantes")
-                    continue
-                
-                if User.query.filter_by(email=email).first():
-                    errors.append(f"Ligne {row_num}: email déjà existant ({email})")
-                    continue
-                
-                student = User(
-                    email=email,
-                    first_name=first_name,
-                    last_name=last_name,
-                    role='student'
-                )
-                student.enrolled_tracks.append(track)
-                db.session.add(student)
-                
-                try:
-                    send_password_creation_email(student)
-                except:
-                    pass
-                
-                imported += 1
-            
-            db.session.commit()
-            
-            if imported > 0:
-                flash(f'{imported} étudiant(s) importé(s) avec succès!', 'success')
-            if errors:
-                flash(f'{len(errors)} erreur(s): ' + '; '.join(errors[:3]), 'warning')
-            
-            return redirect(url_for('teacher.track_students'))
-            
+            job = create_import_job(
+                file, current_user,
+                role='student',
+                track_id=track.id,
+                current_year_id=academic_year_id,
+                read_matricule=False,
+                mode=mode
+            )
         except Exception as e:
             flash(f'Erreur lors de l\'import: {str(e)}', 'danger')
             return render_template('teacher/import_students.html', track=track)
+        
+        start_import_job(current_app._get_current_object(), job.id)
+        return redirect(url_for('teacher.import_students', job_id=job.id))
     
-    return render_template('teacher/import_students.html', track=track)
+    job = ImportJob.query.filter_by(
+        id=request.args.get('job_id', type=int),
+        created_by_id=current_user.id
+    ).first()
+    return render_template('teacher/import_students.html', track=track, job=job)
+
+
+@teacher_bp.route('/track/import/jobs/<int:id>')
+@login_required
+@track_head_required
+def import_job_status(id):
+    """Progress of a background import (polled by the import page)"""
+    job = ImportJob.query.filter_by(id=id, created_by_id=current_user.id).first_or_404()
+    return jsonify(job.to_dict())
 
 
 # ==================== TRACK STATISTICS ====================
@@ -1301,6 +1391,7 @@ def import_students():
 @teacher_bp.route('/track/statistics')
 @login_required
 @track_head_required
+@read_replica
 def track_statistics():
     """View track-wide statistics"""
     track = current_user.headed_track
@@ -1348,3 +1439,18 @@ def track_statistics():
                           track=track,
                           subjects=subjects,
                           students_stats=students_stats)
+
+
+@teacher_bp.route('/track/statistics/export/<fmt>')
+@login_required
+@track_head_required
+def export_track_statistics(fmt):
+    """Download the track statistics as CSV or Excel"""
+    track = current_user.headed_track
+    
+    if fmt not in EXPORT_FORMATS:
+        flash('Format d\'export invalide.', 'danger')
+        return redirect(url_for('teacher.track_statistics'))
+    
+    header, rows = track_statistics_table(track)
+    return stream_table(header, rows, fmt, f"statistiques_{track.name}")
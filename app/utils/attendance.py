@@ -0,0 +1,131 @@
+from datetime import datetime
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+from app.models import (db, Course, Subject, Semester, AcademicYear, Attendance, AttendanceToken,
+                        student_tracks, update_course_counters, change_attendance_status)
+from app.utils.qr_generator import parse_qr_data
+from app.utils.metrics import inc
+
+
+def _course_state(course_id):
+    """What a scan needs to know about the course, in one joined SELECT"""
+    return db.session.execute(
+        db.select(
+            Course.id, Course.status, Course.started_at, Course.course_type, Course.title,
+            Subject.name.label('subject_name'), AcademicYear.track_id
+        ).join(Subject, Course.subject_id == Subject.id)
+        .join(Semester, Subject.semester_id == Semester.id)
+        .join(AcademicYear, Semester.academic_year_id == AcademicYear.id)
+        .where(Course.id == course_id)
+    ).first()
+
+
+def _is_enrolled(student_id, track_id):
+    return db.session.scalar(db.select(db.exists().where(
+        student_tracks.c.student_id == student_id,
+        student_tracks.c.track_id == track_id
+    )))
+
+
+def _rejected(reason, message, status):
+    inc('presence_scans_total', result='rejected', reason=reason)
+    return {'success': False, 'message': message}, status
+
+
+def record_scan(qr_data, student_id, enrolled_track_ids=None):
+    """
+    Record a QR scan for the student, from a session or a trusted device.
+    `enrolled_track_ids` saves the enrollment query when the caller already
+    knows them. Returns (json body, http status).
+    """
+    if not qr_data:
+        return _rejected('missing_data', 'Données QR invalides', 400)
+
+    # Parse QR data
+    parsed = parse_qr_data(qr_data)
+    if not parsed:
+        return _rejected('bad_format', 'Format QR invalide', 400)
+
+    course_id, token, timestamp = parsed
+
+    course = _course_state(course_id)
+    if not course:
+        return _rejected('course_not_found', 'Séance non trouvée', 404)
+
+    # Check if course is active
+    if course.status != 'active':
+        return _rejected('course_inactive', 'Cette séance n\'est pas active', 400)
+
+    # Verify token using AttendanceToken table
+    attendance_token = AttendanceToken.query.filter_by(
+        course_id=course_id,
+        token=token
+    ).first()
+
+    if not attendance_token or not attendance_token.is_valid():
+        return _rejected('token_expired', 'QR code expiré. Veuillez rescanner.', 400)
+
+    # Check if student is enrolled in the track
+    if enrolled_track_ids is not None:
+        enrolled = course.track_id in enrolled_track_ids
+    else:
+        enrolled = _is_enrolled(student_id, course.track_id)
+    if not enrolled:
+        return _rejected('not_enrolled', 'Vous n\'êtes pas inscrit à cette filière', 403)
+
+    # Calculate status based on time (Late if > threshold)
+    scanned_at = datetime.utcnow()
+    new_status = 'present'
+    if course.started_at:
+        delta = (scanned_at - course.started_at).total_seconds()
+        threshold_seconds = current_app.config.get('LATE_THRESHOLD_MINUTES', 20) * 60
+        if delta > threshold_seconds:
+            new_status = 'late'
+
+    attendance = Attendance.query.filter_by(
+        course_id=course_id,
+        student_id=student_id
+    ).first()
+
+    recorded = False
+    if not attendance:
+        try:
+            with db.session.begin_nested():
+                db.session.add(Attendance(
+                    course_id=course_id,
+                    student_id=student_id,
+                    status=new_status,
+                    scanned_at=scanned_at
+                ))
+            update_course_counters(course_id, new_status=new_status)
+            recorded = True
+        except IntegrityError:
+            # A concurrent scan of the same student created the row first
+            attendance = Attendance.query.filter_by(course_id=course_id, student_id=student_id).first()
+
+    if attendance:
+        # The status only moves (and the counters with it) if no concurrent scan moved it first
+        recorded = (attendance.status != 'present'
+                    and change_attendance_status(attendance, new_status, scanned_at=scanned_at))
+
+    if not recorded:
+        db.session.rollback()
+        inc('presence_scans_total', result='accepted', reason='already_recorded')
+        return {
+            'success': True,
+            'message': 'Présence déjà enregistrée!',
+            'already_recorded': True
+        }, 200
+
+    db.session.commit()
+    inc('presence_scans_total', result='accepted', reason=new_status)
+
+    return {
+        'success': True,
+        'message': 'Présence enregistrée avec succès!',
+        'course': {
+            'subject': course.subject_name,
+            'type': course.course_type,
+            'title': course.title
+        }
+    }, 200
@@ -38,7 +38,7 @@ def dept_head_required(f):
         if not current_user.is_authenticated:
             flash('Veuillez vous connecter.', 'warning')
             return redirect(url_for('auth.login'))
-        if not current_user.is_dept_head or not current_user.headed_department:
+        if not current_user.is_dept_head or not current_user.headed_department_id:
             flash('Accès réservé aux chefs de département.', 'danger')
             return redirect(url_for('teacher.dashboard'))
         return f(*args, **kwargs)
@@ -52,7 +52,7 @@ def track_head_required(f):
         if not current_user.is_authenticated:
             flash('Veuillez vous connecter.', 'warning')
             return redirect(url_for('auth.login'))
-        if not current_user.is_track_head or not current_user.headed_track:
+        if not current_user.is_track_head or not current_user.headed_track_id:
             flash('Accès réservé aux chefs de filière.', 'danger')
             return redirect(url_for('teacher.dashboard'))
         return f(*args, **kwargs)
@@ -0,0 +1,132 @@
+import time
+import uuid
+from collections import namedtuple
+from datetime import datetime, timezone
+from threading import Lock
+from flask import current_app, request
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+from app.models import db, RevokedDevice
+
+# What a valid device cookie tells us; trusted_at survives rotations
+DeviceCredential = namedtuple('DeviceCredential', ['student_id', 'device_id', 'trusted_at', 'issued_at'])
+
+
+class RevocationList:
+    """The revoked_devices table, reloaded every few seconds (per process)"""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.loaded_at = 0
+        self.devices = set()
+        self.students = {}  # student_id -> latest "revoke all" timestamp
+
+    def _load(self):
+        devices, students = set(), {}
+        for student_id, device_id, revoked_at in db.session.execute(
+            db.select(RevokedDevice.student_id, RevokedDevice.device_id, RevokedDevice.revoked_at)
+        ):
+            if device_id:
+                devices.add(device_id)
+            else:
+                students[student_id] = max(students.get(student_id, 0), _epoch(revoked_at))
+        return devices, students
+
+    def refresh(self, interval):
+        if time.monotonic() - self.loaded_at < interval:
+            return
+        devices, students = self._load()
+        with self.lock:
+            self.devices, self.students = devices, students
+            self.loaded_at = time.monotonic()
+
+    def add(self, student_id, device_id, revoked_at):
+        with self.lock:
+            if device_id:
+                self.devices.add(device_id)
+            else:
+                self.students[student_id] = max(self.students.get(student_id, 0), revoked_at)
+
+    def is_revoked(self, credential):
+        with self.lock:
+            if credential.device_id in self.devices:
+                return True
+            return credential.trusted_at <= self.students.get(credential.student_id, 0)
+
+
+revocations = RevocationList()
+
+
+def _epoch(moment):
+    """Seconds since the epoch of a naive UTC datetime (as stored by the models)"""
+    return moment.replace(tzinfo=timezone.utc).timestamp()
+
+
+def _serializer():
+    return URLSafeTimedSerializer(current_app.config['SECRET_KEY'], salt='trusted-device')
+
+
+def issue_device_credential(student_id, device_id=None, trusted_at=None):
+    """Signed [student_id, device_id, trusted_at]; nothing is stored server-side"""
+    return _serializer().dumps([
+        student_id, device_id or str(uuid.uuid4()), trusted_at or round(time.time(), 3)
+    ])
+
+
+def read_device_credential():
+    """The credential of the device making the request, or None if absent, expired or revoked"""
+    token = request.cookies.get(current_app.config['TRUSTED_DEVICE_COOKIE'])
+    if not token:
+        return None
+
+    max_age = current_app.config['TRUSTED_DEVICE_MAX_AGE'].total_seconds()
+    try:
+        (student_id, device_id, trusted_at), issued_at = _serializer().loads(
+            token, max_age=max_age, return_timestamp=True
+        )
+    except (BadSignature, ValueError, TypeError):
+        return None
+
+    credential = DeviceCredential(student_id, device_id, trusted_at, issued_at.timestamp())
+    revocations.refresh(current_app.config['TRUSTED_DEVICE_REVOCATION_REFRESH'])
+    if revocations.is_revoked(credential):
+        return None
+    return credential
+
+
+def needs_rotation(credential):
+    rotate_after = current_app.config['TRUSTED_DEVICE_ROTATE_AFTER'].total_seconds()
+    return time.time() - credential.issued_at > rotate_after
+
+
+def set_device_cookie(response, token):
+    response.set_cookie(
+        current_app.config['TRUSTED_DEVICE_COOKIE'], token,
+        max_age=int(current_app.config['TRUSTED_DEVICE_MAX_AGE'].total_seconds()),
+        httponly=True, secure=request.is_secure, samesite='Strict'
+    )
+    return response
+
+
+def rotate_device_cookie(response, credential):
+    """Re-sign a credential that is getting old, keeping its device id and trust date"""
+    if needs_rotation(credential):
+        set_device_cookie(response, issue_device_credential(
+            credential.student_id, credential.device_id, credential.trusted_at
+        ))
+    return response
+
+
+def clear_device_cookie(response):
+    response.delete_cookie(current_app.config['TRUSTED_DEVICE_COOKIE'])
+    return response
+
+
+def revoke_devices(student_id, device_id=None):
+    """
+    Revoke one device, or (device_id=None) every device the student trusted so far.
+    Takes effect at once in this process, within TRUSTED_DEVICE_REVOCATION_REFRESH
+    seconds in the others (caller commits).
+    """
+    revoked_at = datetime.utcnow()
+    db.session.add(RevokedDevice(student_id=student_id, device_id=device_id, revoked_at=revoked_at))
+    revocations.add(student_id, device_id, _epoch(revoked_at))
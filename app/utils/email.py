@@ -1,116 +1,134 @@
+import secrets
+from datetime import datetime
 from flask import current_app, url_for
-from flask_mail import Message
-from app import mail
-from threading import Thread
+from app.models import db, User, EmailOutbox
+from app.utils.outbox import notify_email_workers
+from app.utils.metrics import inc
+from app.utils.password_links import (CREATE, RESET, generate_password_token,
+                                      make_signed_token, uses_signed_links)
 
+PASSWORD_CREATION_SUBJECT = "[UIR] Créez votre mot de passe"
+PASSWORD_RESET_SUBJECT = "[UIR] Réinitialisation de votre mot de passe"
 
-def send_async_email(app, msg):
-    with app.app_context():
-        try:
-            mail.send(msg)
-        except Exception as e:
-            print(f"Error sending email: {e}")
+PASSWORD_CREATION_TEMPLATE = 'email/password_creation.html'
+PASSWORD_RESET_TEMPLATE = 'email/password_reset.html'
+EMAIL_TEMPLATES = (PASSWORD_CREATION_TEMPLATE, PASSWORD_RESET_TEMPLATE)
 
 
-def send_email(subject, recipient, html_body, text_body=None):
-    """Send email asynchronously"""
-    msg = Message(
+def send_email(subject, recipient, html_body, text_body=None, commit=True):
+    """
+    Queue an email in the outbox; the SMTP workers deliver it.
+    With commit=False the message is only added to the session, so it is
+    sent if and only if the caller's transaction commits.
+    """
+    message = EmailOutbox(
+        recipient=recipient,
         subject=subject,
-        recipients=[recipient],
-        html=html_body,
-        body=text_body or html_body
+        html_body=html_body,
+        text_body=text_body
     )
-    # Send async
-    Thread(
-        target=send_async_email,
-        args=(current_app._get_current_object(), msg)
-    ).start()
+    db.session.add(message)
+    inc('presence_emails_total', event='queued')
+
+    if commit:
+        db.session.commit()
+        notify_email_workers()
+    return message
+
+
+def preload_email_templates(app):
+    """Compile the email templates once at startup; they stay in the Jinja cache"""
+    for name in EMAIL_TEMPLATES:
+        app.jinja_env.get_template(name)
+
+
+def render_email_batch(template_name, contexts):
+    """
+    Render many recipients against one compiled template.
+    Template.render is used directly: render_template would also run the
+    context processors and signals for every single recipient.
+    """
+    template = current_app.jinja_env.get_template(template_name)
+    return [template.render(**context) for context in contexts]
+
+
+def build_outbox_rows(subject, template_name, recipients):
+    """
+    Build the email_outbox rows for a batch, ready for a bulk INSERT.
+    `recipients` is a list of (email, template context) pairs.
+    """
+    html_bodies = render_email_batch(template_name, [context for _, context in recipients])
+    return [
+        {'recipient': email, 'subject': subject, 'html_body': html_body}
+        for (email, _), html_body in zip(recipients, html_bodies)
+    ]
 
 
 def send_password_creation_email(user):
     """Send email with link to create password"""
-    from app.models import db  # Import db here to avoid circular import
-    
-    token = user.generate_token()
-    
-    # IMPORTANT: Save the token to database
-    db.session.commit()
+    # The token (if stored) is saved in the same commit as the queued email
+    token = generate_password_token(user, CREATE)
     
     reset_url = url_for('auth.create_password', token=token, _external=True)
     
-    html_body = f"""
-    <html>
-    <body style="font-family: Arial, sans-serif; background-color: #F2F2F2; padding: 20px;">
-        <div style="max-width: 600px; margin: 0 auto; background: white; border-radius: 10px; padding: 30px;">
-            <div style="text-align: center; margin-bottom: 20px;">
-                <h1 style="color: #163A59;">UIR - Système de Présence</h1>
-            </div>
-            <h2 style="color: #5F7340;">Bienvenue {user.first_name} {user.last_name}!</h2>
-            <p>Votre compte a été créé sur la plateforme de gestion de présence de l'UIR.</p>
-            <p>Cliquez sur le bouton ci-dessous pour créer votre mot de passe :</p>
-            <div style="text-align: center; margin: 30px 0;">
-                <a href="{reset_url}" 
-                   style="background-color: #163A59; color: white; padding: 15px 30px; 
-                          text-decoration: none; border-radius: 5px; font-weight: bold;">
-                    Créer mon mot de passe
-                </a>
-            </div>
-            <p style="color: #666; font-size: 12px;">
-                Ce lien expire dans 24 heures.<br>
-                Si vous n'avez pas demandé ce compte, ignorez cet email.
-            </p>
-        </div>
-    </body>
-    </html>
-    """
+    html_body, = render_email_batch(PASSWORD_CREATION_TEMPLATE, [{'user': user, 'url': reset_url}])
     
     send_email(
-        subject="[UIR] Créez votre mot de passe",
+        subject=PASSWORD_CREATION_SUBJECT,
         recipient=user.email,
         html_body=html_body
     )
 
 
-def send_password_reset_email(user):
-    """Send password reset email"""
-    from app.models import db  # Import db here to avoid circular import
+def send_password_creation_emails(users, commit=True):
+    """
+    Bulk version of send_password_creation_email.
+    Tokens are written with a single executemany UPDATE (skipped with signed
+    links) and the messages are queued with a single INSERT, in one transaction.
+    Returns the number of emails queued.
+    """
+    signed = uses_signed_links()
+    expiry = datetime.utcnow() + current_app.config['PASSWORD_TOKEN_EXPIRY']
+    tokens = []
+    recipients = []
+    
+    for user in users:
+        if signed:
+            token = make_signed_token(user, CREATE)
+        else:
+            token = secrets.token_urlsafe(32)
+            tokens.append({'id': user.id, 'token': token, 'token_expiry': expiry})
+        reset_url = url_for('auth.create_password', token=token, _external=True)
+        recipients.append((user.email, {'user': user, 'url': reset_url}))
     
-    token = user.generate_token()
+    if not recipients:
+        return 0
     
-    # IMPORTANT: Save the token to database
-    db.session.commit()
+    if tokens:
+        db.session.execute(db.update(User), tokens)
+    db.session.execute(
+        db.insert(EmailOutbox),
+        build_outbox_rows(PASSWORD_CREATION_SUBJECT, PASSWORD_CREATION_TEMPLATE, recipients)
+    )
+    inc('presence_emails_total', len(recipients), event='queued')
+    
+    if commit:
+        db.session.commit()
+        notify_email_workers()
+    return len(recipients)
+
+
+def send_password_reset_email(user):
+    """Send password reset email"""
+    # The token (if stored) is saved in the same commit as the queued email
+    token = generate_password_token(user, RESET)
     
     reset_url = url_for('auth.reset_password', token=token, _external=True)
     
-    html_body = f"""
-    <html>
-    <body style="font-family: Arial, sans-serif; background-color: #F2F2F2; padding: 20px;">
-        <div style="max-width: 600px; margin: 0 auto; background: white; border-radius: 10px; padding: 30px;">
-            <div style="text-align: center; margin-bottom: 20px;">
-                <h1 style="color: #163A59;">UIR - Système de Présence</h1>
-            </div>
-            <h2 style="color: #5F7340;">Réinitialisation du mot de passe</h2>
-            <p>Bonjour {user.first_name},</p>
-            <p>Vous avez demandé la réinitialisation de votre mot de passe.</p>
-            <p>Cliquez sur le bouton ci-dessous pour définir un nouveau mot de passe :</p>
-            <div style="text-align: center; margin: 30px 0;">
-                <a href="{reset_url}" 
-                   style="background-color: #163A59; color: white; padding: 15px 30px; 
-                          text-decoration: none; border-radius: 5px; font-weight: bold;">
-                    Réinitialiser mon mot de passe
-                </a>
-            </div>
-            <p style="color: #666; font-size: 12px;">
-                Ce lien expire dans 24 heures.<br>
-                Si vous n'avez pas demandé cette réinitialisation, ignorez cet email.
-            </p>
-        </div>
-    </body>
-    </html>
-    """
+    html_body, = render_email_batch(PASSWORD_RESET_TEMPLATE, [{'user': user, 'url': reset_url}])
     
     send_email(
-        subject="[UIR] Réinitialisation de votre mot de passe",
+        subject=PASSWORD_RESET_SUBJECT,
         recipient=user.email,
         html_body=html_body
     )
@@ -0,0 +1,92 @@
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+# Engine defaults per database. Any DB_* key set in the config overrides them.
+ENGINE_PROFILES = {
+    # Development: one file, a few threads (requests, scheduler, outbox, imports)
+    'sqlite': {
+        'pool_pre_ping': False,
+    },
+    # Production: MySQL drops connections idle longer than wait_timeout
+    # (often a few minutes on shared hosts), e.g. between two lecture slots
+    'mysql': {
+        'pool_size': 10,
+        'max_overflow': 20,
+        'pool_timeout': 30,
+        'pool_recycle': 280,
+        'pool_pre_ping': True,
+        'isolation_level': 'READ COMMITTED',
+    },
+}
+
+# Config key -> create_engine() argument
+ENGINE_SETTINGS = {
+    'DB_POOL_SIZE': 'pool_size',
+    'DB_MAX_OVERFLOW': 'max_overflow',
+    'DB_POOL_TIMEOUT': 'pool_timeout',
+    'DB_POOL_RECYCLE': 'pool_recycle',
+    'DB_POOL_PRE_PING': 'pool_pre_ping',
+    'DB_ISOLATION_LEVEL': 'isolation_level',
+}
+
+
+def engine_profile(uri, config):
+    profile = config.get('DB_PROFILE') or 'auto'
+    if profile == 'auto':
+        profile = make_url(uri).get_backend_name()
+    return profile if profile in ENGINE_PROFILES else None
+
+
+def engine_options(uri, config):
+    """create_engine() keyword arguments for the database `uri`"""
+    profile = engine_profile(uri, config)
+    options = dict(ENGINE_PROFILES.get(profile, {}))
+    for key, argument in ENGINE_SETTINGS.items():
+        if config.get(key) is not None:
+            options[argument] = config[key]
+
+    if profile == 'sqlite':
+        # Pool sizing has no meaning for a file opened by each thread
+        for argument in ('pool_size', 'max_overflow', 'pool_timeout'):
+            options.pop(argument, None)
+    return options
+
+
+def configure_engine_options(app):
+    """
+    Fill SQLALCHEMY_ENGINE_OPTIONS from the profile (explicit options set in
+    the config win) and declare the read replica bind, if any, with its own profile.
+    """
+    options = engine_options(app.config['SQLALCHEMY_DATABASE_URI'], app.config)
+    options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+    replica_url = app.config.get('DATABASE_REPLICA_URL')
+    if replica_url:
+        binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+        binds.setdefault('replica', {'url': replica_url, **engine_options(replica_url, app.config)})
+        app.config['SQLALCHEMY_BINDS'] = binds
+
+
+def install_sqlite_pragmas(engine, config):
+    """
+    Set journaling and lock waiting on every new SQLite connection.
+    WAL lets the scan requests read while another one writes; busy_timeout
+    makes a writer wait for the lock instead of failing with "database is locked".
+    """
+    if engine.dialect.name != 'sqlite':
+        return
+
+    journal_mode = config.get('SQLITE_JOURNAL_MODE')
+    in_memory = engine.url.database in (None, '', ':memory:')
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if journal_mode and not in_memory:
+            cursor.execute(f'PRAGMA journal_mode={journal_mode}')
+        if config.get('SQLITE_SYNCHRONOUS'):
+            cursor.execute(f"PRAGMA synchronous={config['SQLITE_SYNCHRONOUS']}")
+        if config.get('SQLITE_BUSY_TIMEOUT_MS') is not None:
+            cursor.execute(f"PRAGMA busy_timeout={int(config['SQLITE_BUSY_TIMEOUT_MS'])}")
+        cursor.close()
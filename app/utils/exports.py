@@ -0,0 +1,292 @@
+import csv
+import os
+import tempfile
+from io import StringIO
+from flask import Response, stream_with_context
+from werkzeug.utils import secure_filename
+from app.models import (db, User, AcademicYear, Semester, Subject, Course, Attendance,
+                        student_tracks, summarize_attendance)
+
+EXPORT_FORMATS = ('csv', 'xlsx')
+
+# Rows fetched per round-trip when streaming large result sets
+STREAM_BATCH_SIZE = 2000
+
+# Rows buffered before a CSV chunk is sent to the client
+CSV_CHUNK_ROWS = 500
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+STATUS_LABELS = {'present': 'Présent', 'late': 'Retard', 'absent': 'Absent'}
+
+
+def _iter_csv(header, rows):
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+
+    # BOM so that Excel opens accented names correctly
+    buffer.write('\ufeff')
+    writer.writerow(header)
+
+    for count, row in enumerate(rows, start=1):
+        writer.writerow(row)
+        if count % CSV_CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+
+    yield buffer.getvalue()
+
+
+def _iter_xlsx(header, rows, sheet_title, chunk_size=64 * 1024):
+    import openpyxl
+
+    # Write-only workbooks spill rows to disk instead of keeping cells in memory
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet(title=sheet_title[:31] or 'Export')
+    sheet.append(header)
+    for row in rows:
+        sheet.append(row)
+
+    fd, path = tempfile.mkstemp(suffix='.xlsx')
+    os.close(fd)
+    try:
+        workbook.save(path)
+        with open(path, 'rb') as handle:
+            while True:
+                chunk = handle.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        os.remove(path)
+
+
+def stream_table(header, rows, fmt, filename):
+    """
+    Build a chunked download response for a table.
+
+    Args:
+        header: list of column titles
+        rows: iterable (ideally a generator) of row lists
+        fmt: 'csv' or 'xlsx'
+        filename: download name without extension
+    """
+    name = secure_filename(filename) or 'export'
+
+    if fmt == 'xlsx':
+        body = _iter_xlsx(header, rows, name)
+        mimetype = XLSX_MIMETYPE
+    else:
+        fmt = 'csv'
+        body = _iter_csv(header, rows)
+        mimetype = 'text/csv; charset=utf-8'
+
+    return Response(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="{name}.{fmt}"'}
+    )
+
+
+def _stream(statement):
+    return db.session.execute(statement.execution_options(yield_per=STREAM_BATCH_SIZE))
+
+
+def _track_students(track_id):
+    """Select the students of a track"""
+    return db.select(
+        User.id, User.matricule, User.last_name, User.first_name
+    ).select_from(student_tracks).join(
+        User, User.id == student_tracks.c.student_id
+    ).where(
+        student_tracks.c.track_id == track_id
+    )
+
+
+def _completed_totals(subject_ids):
+    """Return {subject_id: {course_type: completed sessions}}"""
+    totals = {subject_id: {} for subject_id in subject_ids}
+    rows = db.session.query(
+        Course.subject_id, Course.course_type, db.func.count(Course.id)
+    ).filter(
+        Course.subject_id.in_(subject_ids),
+        Course.status == 'completed'
+    ).group_by(Course.subject_id, Course.course_type).all()
+
+    for subject_id, course_type, count in rows:
+        totals[subject_id][course_type] = count
+    return totals
+
+
+def _status_counts(subject_ids):
+    """Aggregate attendances on completed sessions per (student, subject, type)"""
+    def status_sum(status):
+        return db.func.sum(db.case((Attendance.status == status, 1), else_=0))
+
+    return db.select(
+        Attendance.student_id.label('student_id'),
+        Course.subject_id.label('subject_id'),
+        Course.course_type.label('course_type'),
+        status_sum('present').label('present'),
+        status_sum('late').label('late'),
+        status_sum('absent').label('absent')
+    ).join(
+        Course, Course.id == Attendance.course_id
+    ).where(
+        Course.subject_id.in_(subject_ids),
+        Course.status == 'completed'
+    ).group_by(
+        Attendance.student_id, Course.subject_id, Course.course_type
+    ).subquery()
+
+
+def _iter_student_counts(track_id, subject_ids):
+    """
+    Yield (student_row, {subject_id: counts}) for every student of the track,
+    from a single aggregated query streamed in batches.
+    """
+    students = _track_students(track_id).subquery()
+    counts = _status_counts(subject_ids)
+
+    statement = db.select(
+        students.c.id, students.c.matricule, students.c.last_name, students.c.first_name,
+        counts.c.subject_id, counts.c.course_type,
+        counts.c.present, counts.c.late, counts.c.absent
+    ).select_from(students).outerjoin(
+        counts, counts.c.student_id == students.c.id
+    ).order_by(
+        students.c.last_name, students.c.first_name, students.c.id
+    )
+
+    current = None
+    current_counts = {}
+    for row in _stream(statement):
+        if current is None or row.id != current.id:
+            if current is not None:
+                yield current, current_counts
+            current = row
+            current_counts = {}
+        if row.subject_id is not None:
+            current_counts.setdefault(row.subject_id, {})[row.course_type] = {
+                'present': row.present or 0,
+                'late': row.late or 0,
+                'absent': row.absent or 0
+            }
+
+    if current is not None:
+        yield current, current_counts
+
+
+def subject_attendance_table(subject):
+    """Attendance sheet of a subject: one row per student, one column per completed session"""
+    track_id = subject.semester.academic_year.track_id
+    courses = Course.query.filter_by(
+        subject_id=subject.id,
+        status='completed'
+    ).order_by(Course.started_at).all()
+
+    course_index = {course.id: i for i, course in enumerate(courses)}
+    course_types = [course.course_type for course in courses]
+    totals = {}
+    for course_type in course_types:
+        totals[course_type] = totals.get(course_type, 0) + 1
+
+    header = ['Matricule', 'Nom', 'Prénom']
+    for course in courses:
+        date = course.started_at.strftime('%d/%m/%Y') if course.started_at else ''
+        header.append(f"{course.course_type} {date}".strip())
+    header += ['Présences', 'Taux (%)', 'Note /20', 'Rattrapage']
+
+    students = _track_students(track_id).subquery()
+    statement = db.select(
+        students.c.id, students.c.matricule, students.c.last_name, students.c.first_name,
+        Attendance.course_id, Attendance.status
+    ).select_from(students).outerjoin(
+        Attendance, db.and_(
+            Attendance.student_id == students.c.id,
+            Attendance.course_id.in_(list(course_index))
+        )
+    ).order_by(
+        students.c.last_name, students.c.first_name, students.c.id
+    )
+
+    def build_row(student, statuses):
+        counts = {}
+        for i, status in enumerate(statuses):
+            if status:
+                by_status = counts.setdefault(course_types[i], {})
+                by_status[status] = by_status.get(status, 0) + 1
+        summary = summarize_attendance(counts, totals)
+        return ([student.matricule or '', student.last_name, student.first_name]
+                + [STATUS_LABELS.get(status, 'Absent') for status in statuses]
+                + [summary['present'], summary['rate'], summary['grade'],
+                   'Oui' if summary['is_rattrapage'] else 'Non'])
+
+    def rows():
+        current = None
+        statuses = []
+        for row in _stream(statement):
+            if current is None or row.id != current.id:
+                if current is not None:
+                    yield build_row(current, statuses)
+                current = row
+                statuses = [None] * len(courses)
+            if row.course_id is not None:
+                statuses[course_index[row.course_id]] = row.status
+        if current is not None:
+            yield build_row(current, statuses)
+
+    return header, rows()
+
+
+def subject_statistics_table(subject):
+    """Per-student totals for a subject"""
+    track_id = subject.semester.academic_year.track_id
+    totals = _completed_totals([subject.id])[subject.id]
+
+    header = ['Matricule', 'Nom', 'Prénom', 'Présent', 'Retard', 'Absent',
+              'Taux (%)', 'Note /20', 'Rattrapage']
+
+    def rows():
+        for student, counts in _iter_student_counts(track_id, [subject.id]):
+            summary = summarize_attendance(counts.get(subject.id, {}), totals)
+            yield [student.matricule or '', student.last_name, student.first_name,
+                   summary['present'], summary['late'], summary['absent'],
+                   summary['rate'], summary['grade'],
+                   'Oui' if summary['is_rattrapage'] else 'Non']
+
+    return header, rows()
+
+
+def track_statistics_table(track):
+    """Attendance grade of every student in every subject of a track"""
+    subjects = db.session.query(Subject.id, Subject.code, Subject.name).join(
+        Semester, Semester.id == Subject.semester_id
+    ).join(
+        AcademicYear, AcademicYear.id == Semester.academic_year_id
+    ).filter(
+        AcademicYear.track_id == track.id
+    ).order_by(AcademicYear.order, Semester.order, Subject.id).all()
+
+    subject_ids = [subject.id for subject in subjects]
+    totals = _completed_totals(subject_ids)
+
+    header = ['Matricule', 'Nom', 'Prénom']
+    header += [f"{subject.code} - {subject.name}" for subject in subjects]
+    header += ['Note Globale /20', 'Rattrapages']
+
+    def rows():
+        for student, counts in _iter_student_counts(track.id, subject_ids):
+            grades = []
+            rattrapage_count = 0
+            for subject_id in subject_ids:
+                summary = summarize_attendance(counts.get(subject_id, {}), totals[subject_id])
+                grades.append(summary['grade'])
+                if summary['is_rattrapage']:
+                    rattrapage_count += 1
+            average = round(sum(grades) / len(grades), 2) if grades else 20
+            yield ([student.matricule or '', student.last_name, student.first_name]
+                   + grades + [average, rattrapage_count])
+
+    return header, rows()
@@ -0,0 +1,115 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from threading import BoundedSemaphore, Lock
+from flask import current_app, has_app_context
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, generate_password_hash, check_password_hash
+
+# Werkzeug's own default, so existing hashes are not all upgraded at once
+DEFAULT_HASH_METHOD = 'scrypt:32768:8:1'
+
+# Set by start_password_hasher, shared by every process forked from this one
+_workers = 0
+_queue_size = 0
+
+
+def _reset():
+    # A forked process (gunicorn --preload) must not use the pool of its parent:
+    # the executor's threads do not exist in the child. It starts its own on the first hash.
+    global _lock, _pool, _slots
+    _lock = Lock()
+    _pool = None
+    _slots = None
+
+
+_reset()
+os.register_at_fork(after_in_child=_reset)
+
+
+def hash_method():
+    if has_app_context():
+        return current_app.config.get('PASSWORD_HASH_METHOD', DEFAULT_HASH_METHOD)
+    return DEFAULT_HASH_METHOD
+
+
+def start_password_hasher(app):
+    """
+    Enable the hashing processes. Nothing is forked here: each process of the
+    app (every gunicorn worker, with or without --preload) starts its own pool
+    on its first hash.
+    """
+    global _workers, _queue_size
+    workers = app.config.get('PASSWORD_HASH_WORKERS')
+    if app.config.get('TESTING') or not workers or workers < 1:
+        return
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        return  # Windows: development only, hashes in the request thread
+
+    _workers = workers
+    # At most this many hashes waiting or running; extra logins block in their thread
+    _queue_size = workers * app.config.get('PASSWORD_HASH_QUEUE_FACTOR', 4)
+    app.logger.info('Password hashing: %d worker process(es) per app process', workers)
+
+
+def stop_password_hasher():
+    """Stop this process's hashing processes (they are started again on the next hash)"""
+    global _pool
+    with _lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
+
+
+def _get_pool():
+    global _pool, _slots
+    if not _workers:
+        return None
+    with _lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=_workers, mp_context=multiprocessing.get_context('fork'))
+            _slots = BoundedSemaphore(_queue_size)
+        return _pool
+
+
+def _run(function, *args):
+    pool = _get_pool()
+    if pool is None:
+        return function(*args)
+    with _slots:
+        return pool.submit(function, *args).result()
+
+
+def hash_password(password):
+    return _run(generate_password_hash, password, hash_method())
+
+
+def verify_password(password_hash, password):
+    if not password_hash:
+        return False
+    return _run(check_password_hash, password_hash, password)
+
+
+def _method_parameters(method):
+    """
+    ('scrypt', n, r, p) or ('pbkdf2', hash name, iterations), with werkzeug's
+    defaults for the omitted ones: 'pbkdf2:sha256' is stored as
+    'pbkdf2:sha256:<default iterations>' in the hashes it makes.
+    """
+    name, *args = method.split(':')
+    if name == 'scrypt':
+        return ('scrypt', *(int(arg) for arg in args)) if args else ('scrypt', 2 ** 15, 8, 1)
+    if name == 'pbkdf2':
+        hash_name = args[0] if args else 'sha256'
+        iterations = int(args[1]) if len(args) > 1 else DEFAULT_PBKDF2_ITERATIONS
+        return ('pbkdf2', hash_name, iterations)
+    return (name, *args)
+
+
+def needs_rehash(password_hash):
+    """True when the hash was made with another method or cost than the configured one"""
+    if not password_hash or '$' not in password_hash:
+        return False
+    try:
+        return _method_parameters(password_hash.split('$', 1)[0]) != _method_parameters(hash_method())
+    except ValueError:
+        return True  # unreadable parameters: the next login stores a clean hash
@@ -0,0 +1,197 @@
+import time
+from collections import namedtuple
+from threading import Lock
+from flask import current_app
+from flask_login import UserMixin
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from app.models import db, User, Track, Department, student_tracks
+
+# Immutable snapshot of what authorization checks and the sidebars need
+Principal = namedtuple('Principal', [
+    'id', 'email', 'first_name', 'last_name', 'matricule', 'role', 'is_active',
+    'is_dept_head', 'is_track_head', 'department_id',
+    'headed_department_id', 'headed_track_id', 'enrolled_track_ids'
+])
+
+# Writes to these tables may change someone's principal
+IDENTITY_TABLES = {'users', 'student_tracks', 'tracks', 'departments'}
+
+# Marker meaning "forget every cached principal"
+ALL = object()
+
+
+class IdentityCache:
+    """Principals by user id, kept `ttl` seconds (per process)"""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.entries = {}
+        # Bumped on every invalidation so a load that raced with it is not cached
+        self.generation = 0
+
+    def get(self, user_id):
+        with self.lock:
+            entry = self.entries.get(user_id)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+        return None
+
+    def put(self, principal, ttl, generation):
+        with self.lock:
+            if generation == self.generation:
+                self.entries[principal.id] = (time.monotonic() + ttl, principal)
+
+    def invalidate(self, user_ids):
+        with self.lock:
+            self.generation += 1
+            if user_ids is ALL:
+                self.entries.clear()
+            else:
+                for user_id in user_ids:
+                    self.entries.pop(user_id, None)
+
+
+identity_cache = IdentityCache()
+
+
+def build_principal(user_id):
+    """Two small SELECTs: the user's columns and their enrolled track ids"""
+    row = db.session.execute(db.select(
+        User.id, User.email, User.first_name, User.last_name, User.matricule, User.role,
+        User.is_active, User.is_dept_head, User.is_track_head, User.department_id,
+        User.headed_department_id, User.headed_track_id
+    ).where(User.id == user_id)).first()
+    if row is None:
+        return None
+
+    track_ids = db.session.scalars(
+        db.select(student_tracks.c.track_id).where(student_tracks.c.student_id == user_id)
+    ).all()
+    return Principal(*row, enrolled_track_ids=frozenset(track_ids))
+
+
+def load_principal(user_id):
+    ttl = current_app.config.get('IDENTITY_CACHE_TTL', 0)
+    if ttl > 0:
+        principal = identity_cache.get(user_id)
+        if principal is not None:
+            return principal
+
+    generation = identity_cache.generation
+    principal = build_principal(user_id)
+    if principal is not None and ttl > 0:
+        identity_cache.put(principal, ttl, generation)
+    return principal
+
+
+class CurrentUser(UserMixin):
+    """
+    What `current_user` is for the duration of a request.
+    Identity, role and headship answer from the cached principal; any other
+    attribute (relationships, methods) loads the real User row on first use.
+    """
+
+    def __init__(self, principal):
+        self.principal = principal
+        self._user = None
+
+    @property
+    def user(self):
+        if self._user is None:
+            self._user = db.session.get(User, self.principal.id)
+        return self._user
+
+    def __getattr__(self, name):
+        # Only reached when normal lookup fails
+        if name in Principal._fields:
+            return getattr(self.principal, name)
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.user, name)
+
+    @property
+    def is_active(self):
+        return self.principal.is_active
+
+    @property
+    def full_name(self):
+        return f"{self.principal.first_name} {self.principal.last_name}"
+
+    @property
+    def dashboard_tabs(self):
+        tabs = ['mes_cours']
+        if self.principal.is_dept_head and self.principal.headed_department_id:
+            tabs.append('gestion_departement')
+        if self.principal.is_track_head and self.principal.headed_track_id:
+            tabs.append('gestion_filiere')
+        return tabs
+
+    @property
+    def headed_department(self):
+        if not self.principal.headed_department_id:
+            return None
+        return db.session.get(Department, self.principal.headed_department_id)
+
+    @property
+    def headed_track(self):
+        if not self.principal.headed_track_id:
+            return None
+        return db.session.get(Track, self.principal.headed_track_id)
+
+    def __repr__(self):
+        return f'<CurrentUser {self.principal.email}>'
+
+
+def load_current_user(user_id):
+    principal = load_principal(int(user_id))
+    return CurrentUser(principal) if principal else None
+
+
+# ---- Invalidation ----------------------------------------------------------
+# Changes are collected while the transaction runs and applied when it ends,
+# so another request cannot re-cache the old values between flush and commit.
+
+def _mark(session, user_ids):
+    pending = session.info.get('identity_invalidations')
+    if pending is ALL:
+        return
+    if user_ids is ALL:
+        session.info['identity_invalidations'] = ALL
+    else:
+        session.info.setdefault('identity_invalidations', set()).update(user_ids)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changed_users(session, flush_context):
+    user_ids = set()
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, User):
+            user_ids.add(obj.id)
+        elif isinstance(obj, (Track, Department)):
+            # Headships and enrollments hang off these rows too
+            _mark(session, ALL)
+            return
+    if user_ids:
+        _mark(session, user_ids)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _collect_bulk_writes(orm_execute_state):
+    if orm_execute_state.is_select:
+        return
+    table = getattr(orm_execute_state.statement, 'table', None)
+    if table is None or table.name not in IDENTITY_TABLES:
+        return
+    if orm_execute_state.is_insert and table.name == 'users':
+        return  # brand new users have nothing cached
+    _mark(orm_execute_state.session, ALL)
+
+
+@event.listens_for(Session, 'after_transaction_end')
+def _apply_invalidations(session, transaction):
+    if transaction.parent is not None:
+        return
+    pending = session.info.pop('identity_invalidations', None)
+    if pending:
+        identity_cache.invalidate(pending)
@@ -0,0 +1,255 @@
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+from threading import Event, Thread
+from flask import current_app
+from app.models import db, ImportJob
+from app.utils.email import send_password_creation_emails
+from app.utils.outbox import notify_email_workers
+from app.utils.importer import (import_users, sync_students, iter_import_rows, count_import_rows,
+                                iter_imported_users)
+
+# Seconds between two progress reports of a running sync
+SYNC_HEARTBEAT_INTERVAL = 10
+
+
+def _upload_folder(app):
+    folder = app.config.get('IMPORT_UPLOAD_FOLDER') or os.path.join(app.instance_path, 'imports')
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+def create_import_job(file, created_by, role, track_id=None, department_id=None,
+                      current_year_id=None, read_matricule=True, mode='add'):
+    """Save the uploaded file (Excel or CSV) and register a pending job (committed)"""
+    app = current_app._get_current_object()
+    extension = os.path.splitext(file.filename)[1].lower()
+    path = os.path.join(_upload_folder(app), f"{uuid.uuid4().hex}{extension}")
+    file.save(path)
+
+    job = ImportJob(
+        created_by_id=created_by.id,
+        role=role,
+        mode=mode,
+        filename=file.filename,
+        file_path=path,
+        track_id=track_id,
+        department_id=department_id,
+        current_year_id=current_year_id,
+        read_matricule=read_matricule
+    )
+    try:
+        with open(path, 'rb') as stream:
+            job.total_rows = count_import_rows(stream, path)
+    except Exception:
+        os.remove(path)
+        raise
+
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+
+def _claim_job(job_id, stale_seconds):
+    """
+    Atomically mark the job as running. A job left 'running' by a dead
+    process is reclaimed once it has not reported progress for stale_seconds.
+    """
+    now = datetime.utcnow()
+    claimed = ImportJob.query.filter(
+        ImportJob.id == job_id,
+        db.or_(
+            ImportJob.status == 'pending',
+            db.and_(
+                ImportJob.status == 'running',
+                ImportJob.updated_at < now - timedelta(seconds=stale_seconds)
+            )
+        )
+    ).update({
+        ImportJob.status: 'running',
+        ImportJob.updated_at: now
+    }, synchronize_session=False)
+    db.session.commit()
+    return claimed == 1
+
+
+def _report_sync_progress(job_id, row_num):
+    """
+    Commit the progress of a sync on a connection of its own: the sync
+    transaction stays open, but the page shows the progress and the job does
+    not look stale to resume_import_jobs.
+    """
+    with db.engine.begin() as connection:
+        connection.execute(db.update(ImportJob).where(ImportJob.id == job_id).values(
+            last_row=row_num, updated_at=datetime.utcnow()
+        ))
+
+
+def _run_sync(job, rows):
+    """
+    Roster synchronisation needs the whole file to know who was removed, so it
+    is applied in a single transaction; an interrupted sync is simply re-run.
+    The job row is not written by that transaction before its end (MySQL would
+    lock it against the progress reports).
+    """
+    job_id = job.id
+    last_row = [job.last_row]
+
+    def tracked(rows):
+        reported_at = time.monotonic()
+        for row_num, row in rows:
+            last_row[0] = row_num
+            if time.monotonic() - reported_at >= SYNC_HEARTBEAT_INTERVAL:
+                _report_sync_progress(job_id, row_num)
+                reported_at = time.monotonic()
+            yield row_num, row
+        # The file is read, the writes follow
+        _report_sync_progress(job_id, last_row[0])
+
+    result = sync_students(
+        tracked(rows),
+        track_id=job.track_id,
+        department_id=job.department_id,
+        current_year_id=job.current_year_id,
+        read_matricule=job.read_matricule
+    )
+    send_password_creation_emails(list(iter_imported_users(result.user_ids)), commit=False)
+
+    job.last_row = last_row[0]
+    job.imported_count = result.imported
+    job.updated_count = result.updated
+    job.unchanged_count = result.unchanged
+    job.removed_count = result.removed
+    job.error_count = len(result.errors)
+    job.errors = '\n'.join(result.errors) or None
+    db.session.commit()
+    notify_email_workers()
+
+
+def run_import_job(job_id, stale_seconds=0):
+    """
+    Process a job from its last committed row. Every chunk is committed
+    together with the job progress, so an interrupted job resumes where it stopped.
+    """
+    if not _claim_job(job_id, stale_seconds):
+        return None
+
+    job = ImportJob.query.get(job_id)
+    if not job.started_at:
+        job.started_at = datetime.utcnow()
+        db.session.commit()
+
+    start_row = job.last_row
+    imported_before = job.imported_count
+    errors_before = job.error_list()
+    sent = [0]
+
+    def checkpoint(result, row_num):
+        # Activation emails are queued in the same transaction as the chunk
+        new_users = list(iter_imported_users(result.user_ids[sent[0]:]))
+        send_password_creation_emails(new_users, commit=False)
+        sent[0] = len(result.user_ids)
+
+        job.last_row = row_num
+        job.imported_count = imported_before + result.imported
+        job.error_count = len(errors_before) + len(result.errors)
+        job.errors = '\n'.join(errors_before + result.errors) or None
+        job.updated_at = datetime.utcnow()
+        db.session.commit()
+        notify_email_workers()
+
+    try:
+        with open(job.file_path, 'rb') as stream:
+            if job.mode == 'sync':
+                _run_sync(job, iter_import_rows(stream, job.file_path))
+            else:
+                rows = ((row_num, row) for row_num, row in iter_import_rows(stream, job.file_path)
+                        if row_num > start_row)
+                import_users(
+                    rows,
+                    role=job.role,
+                    track_id=job.track_id,
+                    department_id=job.department_id,
+                    current_year_id=job.current_year_id,
+                    read_matricule=job.read_matricule,
+                    on_chunk=checkpoint
+                )
+
+        job.status = 'completed'
+        job.finished_at = datetime.utcnow()
+        job.updated_at = job.finished_at
+        db.session.commit()
+
+        if os.path.exists(job.file_path):
+            os.remove(job.file_path)
+    except Exception as e:
+        db.session.rollback()
+        job = ImportJob.query.get(job_id)
+        job.status = 'failed'
+        job.message = str(e)
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+
+    return job
+
+
+def start_import_job(app, job_id):
+    """Run the job in a background thread (inline when IMPORT_JOBS_ASYNC is off)"""
+    if not app.config.get('IMPORT_JOBS_ASYNC'):
+        run_import_job(job_id)
+        return None
+
+    def run():
+        with app.app_context():
+            try:
+                run_import_job(job_id, app.config['IMPORT_JOB_STALE_SECONDS'])
+            except Exception:
+                db.session.rollback()
+                app.logger.exception(f"Import job {job_id} failed")
+            finally:
+                db.session.remove()
+
+    thread = Thread(target=run, name=f'import-job-{job_id}', daemon=True)
+    thread.start()
+    return thread
+
+
+def resume_import_jobs(app):
+    """Restart the jobs interrupted by a previous shutdown"""
+    if app.config.get('TESTING') or not app.config.get('IMPORT_JOBS_ASYNC'):
+        return 0
+
+    with app.app_context():
+        stale = datetime.utcnow() - timedelta(seconds=app.config['IMPORT_JOB_STALE_SECONDS'])
+        job_ids = [job_id for (job_id,) in db.session.query(ImportJob.id).filter(
+            db.or_(
+                ImportJob.status == 'pending',
+                db.and_(ImportJob.status == 'running', ImportJob.updated_at < stale)
+            )
+        ).all()]
+        db.session.remove()
+
+    for job_id in job_ids:
+        start_import_job(app, job_id)
+    return len(job_ids)
+
+
+def start_import_job_watcher(app):
+    """Background thread resuming, now and then periodically, the jobs whose process died"""
+    if app.config.get('TESTING') or not app.config.get('IMPORT_JOBS_ASYNC'):
+        return None
+
+    stop_event = Event()
+
+    def run():
+        while True:
+            try:
+                resume_import_jobs(app)
+            except Exception:
+                app.logger.exception("Import job resume failed")
+            if stop_event.wait(app.config['IMPORT_JOB_RESUME_INTERVAL']):
+                break
+
+    Thread(target=run, name='import-job-watcher', daemon=True).start()
+    return stop_event
@@ -0,0 +1,518 @@
+import codecs
+import csv
+from app.models import db, User, student_tracks
+
+# Users inserted per bulk INSERT statement
+IMPORT_CHUNK_SIZE = 500
+
+# Accepted upload formats
+CSV_EXTENSIONS = ('.csv', '.tsv', '.txt')
+IMPORT_EXTENSIONS = ('.xlsx', '.xls') + CSV_EXTENSIONS
+
+# Bytes read at a time from CSV uploads
+CSV_READ_SIZE = 64 * 1024
+
+
+class ImportResult:
+    """Outcome of an import: counters plus the human readable errors"""
+
+    def __init__(self):
+        self.imported = 0
+        self.errors = []
+        self.user_ids = []
+
+    def add_error(self, row_num, message):
+        self.errors.append(f"Ligne {row_num}: {message}")
+
+
+def iter_xlsx_rows(stream):
+    """
+    Yield (row_number, values) for every data row of the active sheet.
+    The workbook is opened in read-only mode so rows are streamed from the
+    archive instead of being loaded into memory all at once.
+    """
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(stream, read_only=True, data_only=True)
+    try:
+        sheet = workbook.active
+        for row_num, row in enumerate(sheet.iter_rows(min_row=2, values_only=True), start=2):
+            yield row_num, row
+    finally:
+        workbook.close()
+
+
+def count_xlsx_rows(stream):
+    """Number of data rows announced by the sheet dimensions (None if unknown)"""
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(stream, read_only=True)
+    try:
+        max_row = workbook.active.max_row
+        return max_row - 1 if max_row else None
+    finally:
+        workbook.close()
+
+
+def is_import_file(filename):
+    return filename.lower().endswith(IMPORT_EXTENSIONS)
+
+
+def _is_csv(filename):
+    return filename.lower().endswith(CSV_EXTENSIONS)
+
+
+class _TextDecoder:
+    """
+    Incremental decoder that detects the encoding while reading.
+    A BOM selects UTF-8/UTF-16; otherwise UTF-8 is assumed and, if an invalid
+    sequence shows up before any non-ASCII text was decoded, the decoder
+    switches to cp1252 (Excel's "CSV" export on Windows). Later invalid bytes
+    in a UTF-8 file are replaced.
+    """
+
+    def __init__(self):
+        self.decoder = None
+        self.pending = b''
+        self.seen_non_ascii = False
+
+    def _start(self, data):
+        for bom, encoding in ((codecs.BOM_UTF8, 'utf-8'),
+                              (codecs.BOM_UTF16_LE, 'utf-16-le'),
+                              (codecs.BOM_UTF16_BE, 'utf-16-be')):
+            if data.startswith(bom):
+                self.decoder = codecs.getincrementaldecoder(encoding)()
+                self.seen_non_ascii = True  # trust the BOM
+                return data[len(bom):]
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        return data
+
+    def decode(self, data, final=False):
+        if self.decoder is None:
+            # Wait for enough bytes to recognise a BOM
+            data = self.pending + data
+            if len(data) < 3 and not final:
+                self.pending = data
+                return ''
+            self.pending = b''
+            data = self._start(data)
+
+        try:
+            text = self.decoder.decode(data, final)
+        except UnicodeDecodeError:
+            if self.seen_non_ascii:
+                # Genuine UTF-8 with a few corrupted bytes
+                self.decoder.errors = 'replace'
+                return self.decoder.decode(data, final)
+            buffered, _ = self.decoder.getstate()
+            self.decoder = codecs.getincrementaldecoder('cp1252')(errors='replace')
+            self.seen_non_ascii = True
+            return self.decoder.decode(buffered + data, final)
+
+        if not self.seen_non_ascii and not text.isascii():
+            self.seen_non_ascii = True
+        return text
+
+
+def _iter_lines(stream):
+    """Decode a binary stream chunk by chunk and yield its lines (line endings kept)"""
+    decoder = _TextDecoder()
+    remainder = ''
+    while True:
+        data = stream.read(CSV_READ_SIZE)
+        text = remainder + decoder.decode(data, final=not data)
+        lines = text.split('\n')
+        remainder = lines.pop()
+        for line in lines:
+            yield line + '\n'
+        if not data:
+            break
+    if remainder:
+        yield remainder
+
+
+def _sniff_delimiter(sample, filename):
+    try:
+        return csv.Sniffer().sniff(sample, delimiters=',;\t').delimiter
+    except csv.Error:
+        if filename.lower().endswith('.tsv'):
+            return '\t'
+        # Excel in French locales exports with semicolons
+        header = sample.split('\n', 1)[0]
+        return ';' if header.count(';') > header.count(',') else ','
+
+
+def iter_csv_rows(stream, filename=''):
+    """
+    Yield (row_number, values) for every data row of a CSV/TSV file, with the
+    same numbering as iter_xlsx_rows. The file is read incrementally; only a
+    sample of the first lines is used to detect the delimiter.
+    """
+    lines = _iter_lines(stream)
+
+    sample_lines = []
+    for line in lines:
+        sample_lines.append(line)
+        if len(sample_lines) >= 20:
+            break
+    delimiter = _sniff_delimiter(''.join(sample_lines), filename)
+
+    def all_lines():
+        yield from sample_lines
+        yield from lines
+
+    reader = csv.reader(all_lines(), delimiter=delimiter)
+    for row_num, row in enumerate(reader, start=1):
+        if row_num > 1:
+            yield row_num, row
+
+
+def iter_import_rows(stream, filename):
+    """Rows of an uploaded file, whatever its format"""
+    if _is_csv(filename):
+        return iter_csv_rows(stream, filename)
+    return iter_xlsx_rows(stream)
+
+
+def count_import_rows(stream, filename):
+    """Approximate number of data rows, used for the progress bar"""
+    if not _is_csv(filename):
+        return count_xlsx_rows(stream)
+
+    lines = 0
+    last = b''
+    while True:
+        data = stream.read(CSV_READ_SIZE)
+        if not data:
+            break
+        lines += data.count(b'\n')
+        last = data
+    if last and not last.endswith(b'\n'):
+        lines += 1
+    return max(lines - 1, 0)
+
+
+def _cell_text(row, index):
+    if len(row) <= index or row[index] is None:
+        return None
+    value = row[index]
+    # Excel stores numeric matricules as floats (12345.0)
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip() or None
+
+
+def parse_user_row(row, read_matricule=True):
+    """Return (email, first_name, last_name, matricule) from the Email, Prénom, Nom, Matricule columns"""
+    email = _cell_text(row, 0)
+    return (
+        email.lower() if email else None,
+        _cell_text(row, 1),
+        _cell_text(row, 2),
+        _cell_text(row, 3) if read_matricule else None
+    )
+
+
+def load_existing_identifiers():
+    """Fetch every known email and matricule in a single query"""
+    emails = set()
+    matricules = set()
+    for email, matricule in db.session.execute(db.select(User.email, User.matricule)):
+        emails.add(email.lower())
+        if matricule:
+            matricules.add(matricule)
+    return emails, matricules
+
+
+def _insert_chunk(chunk, track_id, result):
+    """Bulk insert a chunk of users, then their track enrollments"""
+    db.session.execute(db.insert(User), chunk)
+
+    emails = [row['email'] for row in chunk]
+    user_ids = [user_id for (user_id,) in db.session.execute(
+        db.select(User.id).where(User.email.in_(emails))
+    )]
+
+    if track_id:
+        db.session.execute(
+            db.insert(student_tracks),
+            [{'student_id': user_id, 'track_id': track_id} for user_id in user_ids]
+        )
+
+    result.imported += len(chunk)
+    result.user_ids.extend(user_ids)
+
+
+def import_users(rows, role, track_id=None, department_id=None, current_year_id=None,
+                 read_matricule=True, chunk_size=IMPORT_CHUNK_SIZE, on_chunk=None):
+    """
+    Validate and insert users from parsed spreadsheet rows.
+
+    Args:
+        rows: iterable of (row_number, values) as produced by iter_xlsx_rows
+        role: 'student' or 'teacher'
+        track_id: track the imported students are enrolled in
+        department_id / current_year_id: copied on every imported user
+        read_matricule: whether the fourth column holds the matricule
+        on_chunk: optional callback(result, row_num) called after every
+            inserted chunk and once at the end, with the last row handled
+
+    Duplicates are checked against the emails and matricules already in the
+    database (fetched once) and against the previous rows of the file.
+    The caller is responsible for committing.
+    """
+    result = ImportResult()
+    existing_emails, existing_matricules = load_existing_identifiers()
+
+    chunk = []
+    row_num = None
+    for row_num, row in rows:
+        if not row or not row[0]:  # Skip empty rows
+            continue
+
+        email, first_name, last_name, matricule = parse_user_row(row, read_matricule)
+
+        if not email or not first_name or not last_name:
+            result.add_error(row_num, "données manquantes (Email, Prénom, Nom requis)")
+            continue
+
+        if email in existing_emails:
+            result.add_error(row_num, f"email déjà existant ({email})")
+            continue
+
+        if matricule and matricule in existing_matricules:
+            result.add_error(row_num, f"matricule déjà existant ({matricule})")
+            continue
+
+        existing_emails.add(email)
+        if matricule:
+            existing_matricules.add(matricule)
+
+        chunk.append({
+            'email': email,
+            'first_name': first_name,
+            'last_name': last_name,
+            'matricule': matricule,
+            'role': role,
+            'department_id': department_id,
+            'current_year_id': current_year_id
+        })
+
+        if len(chunk) >= chunk_size:
+            _insert_chunk(chunk, track_id, result)
+            chunk = []
+            if on_chunk:
+                on_chunk(result, row_num)
+
+    if chunk:
+        _insert_chunk(chunk, track_id, result)
+    if on_chunk and row_num is not None:
+        on_chunk(result, row_num)
+
+    return result
+
+
+def iter_imported_users(user_ids, chunk_size=IMPORT_CHUNK_SIZE):
+    """Load the imported users back, one chunk of ids at a time"""
+    for start in range(0, len(user_ids), chunk_size):
+        ids = user_ids[start:start + chunk_size]
+        for user in User.query.filter(User.id.in_(ids)).all():
+            yield user
+
+
+class SyncResult(ImportResult):
+    """Outcome of a roster synchronisation (imported = new students)"""
+
+    def __init__(self):
+        super().__init__()
+        self.updated = 0
+        self.unchanged = 0
+        self.removed = 0
+
+
+def _chunks(items, chunk_size):
+    for start in range(0, len(items), chunk_size):
+        yield items[start:start + chunk_size]
+
+
+def sync_students(rows, track_id, department_id=None, current_year_id=None,
+                  read_matricule=True, chunk_size=IMPORT_CHUNK_SIZE):
+    """
+    Synchronise the roster of a track year with a file, in one pass.
+
+    Every row is classified against the database:
+        new: unknown email, the student is created and enrolled
+        changed: names, matricule or year differ, or not enrolled in the
+            track yet; bulk updated and enrolled (other tracks are kept)
+        unchanged: nothing is written
+        removed: enrolled in the track and in the year but absent from the
+            file, the enrollment is deleted (the account and its history are
+            kept). Only with a year: without one nothing is removed.
+
+    Only the deltas are written. The caller is responsible for committing.
+    """
+    result = SyncResult()
+
+    users_by_email = {}
+    matricule_owners = {}
+    for user in db.session.execute(db.select(
+        User.id, User.email, User.first_name, User.last_name, User.matricule,
+        User.role, User.current_year_id, User.department_id
+    )):
+        users_by_email[user.email.lower()] = user
+        if user.matricule:
+            matricule_owners[user.matricule] = user.id
+
+    enrollments = {}
+    for student_id, enrolled_track_id in db.session.execute(
+        db.select(student_tracks.c.student_id, student_tracks.c.track_id)
+    ):
+        enrollments.setdefault(student_id, set()).add(enrolled_track_id)
+
+    seen_emails = set()
+    seen_matricules = set()
+    new_rows = []
+    updates = []
+    kept_ids = set()
+
+    for row_num, row in rows:
+        if not row or not row[0]:  # Skip empty rows
+            continue
+
+        email, first_name, last_name, matricule = parse_user_row(row, read_matricule)
+
+        if not email or not first_name or not last_name:
+            result.add_error(row_num, "données manquantes (Email, Prénom, Nom requis)")
+            continue
+
+        if email in seen_emails:
+            result.add_error(row_num, f"email en double dans le fichier ({email})")
+            continue
+
+        if matricule and matricule in seen_matricules:
+            result.add_error(row_num, f"matricule en double dans le fichier ({matricule})")
+            continue
+
+        existing = users_by_email.get(email)
+        if existing is not None and existing.role != 'student':
+            result.add_error(row_num, f"email déjà utilisé par un compte non étudiant ({email})")
+            continue
+
+        owner_id = matricule_owners.get(matricule) if matricule else None
+        if owner_id is not None and existing is None:
+            result.add_error(row_num, f"matricule déjà existant ({matricule})")
+            continue
+
+        seen_emails.add(email)
+        if matricule:
+            seen_matricules.add(matricule)
+
+        if existing is None:
+            new_rows.append({
+                'email': email,
+                'first_name': first_name,
+                'last_name': last_name,
+                'matricule': matricule,
+                'role': 'student',
+                'department_id': department_id,
+                'current_year_id': current_year_id
+            })
+            continue
+
+        kept_ids.add(existing.id)
+
+        # An empty matricule cell keeps the known one
+        values = {
+            'first_name': first_name,
+            'last_name': last_name,
+            'matricule': matricule or existing.matricule
+        }
+        if department_id is not None:
+            values['department_id'] = department_id
+        if current_year_id is not None:
+            values['current_year_id'] = current_year_id
+
+        same_fields = all(getattr(existing, key) == value for key, value in values.items())
+        if same_fields and track_id in enrollments.get(existing.id, set()):
+            result.unchanged += 1
+        else:
+            updates.append({'id': existing.id, 'row_num': row_num, **values})
+
+    updates = _drop_taken_matricules(updates, users_by_email, matricule_owners, result)
+
+    # New students
+    for chunk in _chunks(new_rows, chunk_size):
+        _insert_chunk(chunk, track_id, result)
+
+    # Matricules that change are cleared first, so that two students swapping
+    # theirs never hold the same one between two rows of the executemany
+    current_matricules = {user.id: user.matricule for user in users_by_email.values()}
+    moving_ids = [values['id'] for values in updates
+                  if current_matricules[values['id']] and values['matricule'] != current_matricules[values['id']]]
+    for ids in _chunks(moving_ids, chunk_size):
+        db.session.execute(
+            db.update(User).where(User.id.in_(ids)).values(matricule=None),
+            execution_options={'synchronize_session': False}
+        )
+
+    # Changed students: one executemany UPDATE per chunk, then the enrollments they miss
+    for chunk in _chunks(updates, chunk_size):
+        db.session.execute(db.update(User), [
+            {key: value for key, value in values.items() if key != 'row_num'} for values in chunk
+        ])
+
+        missing = [values['id'] for values in chunk if track_id not in enrollments.get(values['id'], set())]
+        if missing:
+            db.session.execute(
+                db.insert(student_tracks),
+                [{'student_id': user_id, 'track_id': track_id} for user_id in missing]
+            )
+    result.updated = len(updates)
+
+    # Removed students: only within the imported year (never empty the roster
+    # because of an unreadable file)
+    if current_year_id is None or not seen_emails:
+        return result
+
+    removed_ids = [
+        user.id for user in users_by_email.values()
+        if user.role == 'student'
+        and track_id in enrollments.get(user.id, set())
+        and user.current_year_id == current_year_id
+        and user.id not in kept_ids
+    ]
+    for ids in _chunks(removed_ids, chunk_size):
+        db.session.execute(db.delete(student_tracks).where(
+            student_tracks.c.track_id == track_id,
+            student_tracks.c.student_id.in_(ids)
+        ))
+        db.session.execute(
+            db.update(User).where(User.id.in_(ids)).values(current_year_id=None),
+            execution_options={'synchronize_session': False}
+        )
+    result.removed = len(removed_ids)
+
+    return result
+
+
+def _drop_taken_matricules(updates, users_by_email, matricule_owners, result):
+    """
+    Refuse the updates giving a student a matricule another student keeps.
+    A matricule is free when its owner gets another one in the same file
+    (swaps); refusing an update keeps that student's matricule, which may in
+    turn be wanted by another row, hence the loop.
+    """
+    current_matricules = {user.id: user.matricule for user in users_by_email.values()}
+    while True:
+        changing = {values['id'] for values in updates if values['matricule'] != current_matricules[values['id']]}
+        refused = [
+            values for values in updates
+            if matricule_owners.get(values['matricule']) not in (None, values['id'])
+            and matricule_owners[values['matricule']] not in changing
+        ]
+        if not refused:
+            return updates
+        for values in refused:
+            result.add_error(values['row_num'], f"matricule déjà existant ({values['matricule']})")
+        refused_ids = {values['id'] for values in refused}
+        updates = [values for values in updates if values['id'] not in refused_ids]
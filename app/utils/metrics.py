@@ -0,0 +1,323 @@
+import atexit
+import hmac
+import json
+import math
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from threading import Event, Lock, Thread
+from flask import Response, current_app, g, request, abort
+
+try:
+    import fcntl
+except ImportError:  # Windows: development only, a single process
+    fcntl = None
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# In METRICS_DIR, the summed values of the workers that have exited
+ARCHIVE_FILE = 'exited-workers.json'
+
+# name: (type, help, histogram buckets)
+METRICS = {
+    'presence_http_requests_total': ('counter', 'HTTP requests handled', None),
+    'presence_http_request_duration_seconds': ('histogram', 'Request latency', LATENCY_BUCKETS),
+    'presence_http_request_db_seconds': ('histogram', 'SQL time per request', LATENCY_BUCKETS),
+    'presence_http_request_queries_total': ('counter', 'SQL statements run by requests', None),
+    'presence_http_response_size_bytes': ('histogram', 'Response body size', SIZE_BUCKETS),
+    'presence_scans_total': ('counter', 'QR scans by result and reason', None),
+    'presence_attendance_tokens_total': ('counter', 'QR attendance tokens minted', None),
+    'presence_emails_total': ('counter', 'Outbox emails by event (queued, sent, retry, failed)', None),
+}
+
+
+class MetricsRegistry:
+    """
+    Counters and histograms of this process. With a directory configured,
+    each process writes its values to its own file there and /metrics sums
+    the files, so any worker answers for the whole deployment.
+    """
+
+    def __init__(self):
+        self.directory = None
+        self.flush_interval = 5
+        self._reset()
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        # A forked worker starts from zero with its own file and flusher
+        self.lock = Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.dirty = False
+        self.filename = f'{os.getpid()}-{uuid.uuid4().hex[:8]}.json'
+        self.flusher = None
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+            self.dirty = True
+        self._ensure_flusher()
+
+    def observe(self, name, value, **labels):
+        buckets = METRICS[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {'buckets': [0] * (len(buckets) + 1), 'sum': 0.0, 'count': 0}
+            index = next((i for i, bound in enumerate(buckets) if value <= bound), len(buckets))
+            histogram['buckets'][index] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+            self.dirty = True
+        self._ensure_flusher()
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'counters': [[name, list(labels), value] for (name, labels), value in self.counters.items()],
+                'histograms': [[name, list(labels), dict(h, buckets=list(h['buckets']))]
+                               for (name, labels), h in self.histograms.items()],
+            }
+
+    # ---- Multi-process files ----------------------------------------------
+
+    def _ensure_flusher(self):
+        if self.directory is None or self.flusher is not None:
+            return
+        with self.lock:
+            if self.flusher is not None:
+                return
+            self.flusher = Event()
+
+        def run(stop_event):
+            while not stop_event.wait(self.flush_interval):
+                self.flush()
+
+        Thread(target=run, args=(self.flusher,), name='metrics-flusher', daemon=True).start()
+
+    def flush(self):
+        """Write this process's values to its file"""
+        if self.directory is None or not self.dirty:
+            return
+        self.dirty = False
+        _write_snapshot(os.path.join(self.directory, self.filename), self.snapshot())
+
+    def collect(self):
+        """Values of every process sharing the directory, or of this one alone"""
+        if self.directory is None:
+            return [self.snapshot()]
+        self.flush()
+        with _directory_lock(self.directory):
+            # Under one lock, no scrape counts a file twice (itself and folded into the archive).
+            # Never on Windows, where os.kill(pid, 0) would end the process
+            if fcntl is not None:
+                self._compact()
+            snapshots = [_read_snapshot(os.path.join(self.directory, name))
+                         for name in os.listdir(self.directory) if name.endswith('.json')]
+        return [snapshot for snapshot in snapshots if snapshot is not None]
+
+    def _compact(self):
+        """
+        Fold the files of the workers that exited (recycled by gunicorn, restarted)
+        into ARCHIVE_FILE, so the directory keeps one file per live worker plus one
+        """
+        dead = [name for name in os.listdir(self.directory)
+                if name.endswith('.json') and name != ARCHIVE_FILE and not _is_alive(name)]
+        if not dead:
+            return
+        archive_path = os.path.join(self.directory, ARCHIVE_FILE)
+        snapshots = [_read_snapshot(path) for path in
+                     [archive_path] + [os.path.join(self.directory, name) for name in dead]]
+        _write_snapshot(archive_path, _merge_snapshots(snapshot for snapshot in snapshots if snapshot is not None))
+        for name in dead:
+            os.remove(os.path.join(self.directory, name))
+
+
+@contextmanager
+def _directory_lock(directory):
+    """Serializes the scrapes of the workers sharing the directory"""
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(directory, '.lock'), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _is_alive(filename):
+    """Files are named <pid>-<random>.json; the directory is local, so the pid can be checked"""
+    pid = filename.split('-', 1)[0]
+    if not pid.isdigit() or int(pid) == os.getpid():
+        return True
+    try:
+        os.kill(int(pid), 0)  # signal 0: only checks the process exists
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # exists, owned by another user
+    return True
+
+
+def _read_snapshot(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_snapshot(path, snapshot):
+    """Atomic: readers never see half a file"""
+    with open(path + '.tmp', 'w') as f:
+        json.dump(snapshot, f)
+    os.replace(path + '.tmp', path)
+
+
+registry = MetricsRegistry()
+
+
+def inc(name, amount=1, **labels):
+    registry.inc(name, amount, **labels)
+
+
+def observe(name, value, **labels):
+    registry.observe(name, value, **labels)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}'
+
+
+def _format_number(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _merge(snapshots):
+    """Sum snapshots into ({(name, labels): value}, {(name, labels): histogram})"""
+    counters, histograms = {}, {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, data in snapshot['histograms']:
+            key = (name, tuple(map(tuple, labels)))
+            total = histograms.setdefault(key, {'buckets': [0] * len(data['buckets']), 'sum': 0.0, 'count': 0})
+            total['buckets'] = [a + b for a, b in zip(total['buckets'], data['buckets'])]
+            total['sum'] += data['sum']
+            total['count'] += data['count']
+    return counters, histograms
+
+
+def _merge_snapshots(snapshots):
+    counters, histograms = _merge(snapshots)
+    return {
+        'counters': [[name, list(labels), value] for (name, labels), value in counters.items()],
+        'histograms': [[name, list(labels), data] for (name, labels), data in histograms.items()],
+    }
+
+
+def render(snapshots, gauges=()):
+    """Prometheus text exposition format (version 0.0.4)"""
+    counters, histograms = _merge(snapshots)
+
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        if kind == 'counter':
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f'{name}{_format_labels(labels)} {_format_number(value)}')
+            continue
+        for (metric, labels), data in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(list(buckets) + [math.inf], data['buckets']):
+                cumulative += count
+                le = _format_number(bound)
+                lines.append(f'{name}_bucket{_format_labels(labels, [("le", le)])} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {_format_number(data["sum"])}')
+            lines.append(f'{name}_count{_format_labels(labels)} {data["count"]}')
+
+    for name, help_text, value in gauges:
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} gauge')
+        lines.append(f'{name} {_format_number(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+def _current_gauges():
+    """Read from the database at scrape time, so every worker reports the same value"""
+    from app.models import db, Course
+    active = db.session.scalar(db.select(db.func.count(Course.id)).where(Course.status == 'active'))
+    return [('presence_active_courses', 'Attendance sessions currently open', active or 0)]
+
+
+def metrics_view():
+    # Outside debug the endpoint needs METRICS_TOKEN: it shows the traffic and costs a query per scrape
+    token = current_app.config.get('METRICS_TOKEN')
+    if not token and not current_app.debug:
+        abort(404)
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        abort(401)
+    body = render(registry.collect(), _current_gauges())
+    return Response(body, content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def init_metrics(app):
+    """Record every request and expose /metrics"""
+    if not app.config.get('METRICS_ENABLED'):
+        return
+
+    directory = app.config.get('METRICS_DIR')
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        registry.directory = directory
+        registry.flush_interval = app.config['METRICS_FLUSH_INTERVAL']
+        atexit.register(registry.flush)
+
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
+    if not app.config.get('METRICS_TOKEN') and not app.debug:
+        app.logger.warning("METRICS_TOKEN is not set: /metrics answers 404 outside debug mode")
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_started_at = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        started_at = g.pop('metrics_started_at', None)
+        if started_at is None or request.endpoint == 'metrics':
+            return response
+        # Unmatched URLs share one label, so scanners cannot blow up the number of series
+        endpoint = request.endpoint or '<unmatched>'
+        inc('presence_http_requests_total', endpoint=endpoint, method=request.method, status=response.status_code)
+        observe('presence_http_request_duration_seconds', time.perf_counter() - started_at, endpoint=endpoint)
+
+        stats = g.get('query_stats')
+        if stats is not None:
+            observe('presence_http_request_db_seconds', stats.duration, endpoint=endpoint)
+            inc('presence_http_request_queries_total', stats.count, endpoint=endpoint)
+
+        size = response.calculate_content_length()
+        if size is not None:
+            observe('presence_http_response_size_bytes', size, endpoint=endpoint)
+        return response
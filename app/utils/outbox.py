@@ -0,0 +1,183 @@
+import smtplib
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timedelta
+from threading import Thread, Event, Lock
+from flask_mail import Message
+from app import mail
+from app.models import db, EmailOutbox
+from app.utils.metrics import inc
+
+# Errors after which the SMTP connection can no longer be used
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError)
+
+_wakeup = Event()
+
+
+class RateLimiter:
+    """Spread sends evenly so the process never exceeds `rate` messages per second"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.lock = Lock()
+        self.next_slot = time.monotonic()
+
+    def wait(self):
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + 1.0 / self.rate
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def notify_email_workers():
+    """Wake the workers up instead of waiting for the next poll"""
+    _wakeup.set()
+
+
+def _claimable(now, stale_seconds):
+    return db.or_(
+        db.and_(EmailOutbox.status == 'pending', EmailOutbox.next_attempt_at <= now),
+        # Messages left 'sending' by a worker that died
+        db.and_(EmailOutbox.status == 'sending',
+                EmailOutbox.claimed_at < now - timedelta(seconds=stale_seconds))
+    )
+
+
+def claim_messages(worker_id, batch_size, stale_seconds=600):
+    """Reserve up to batch_size due messages for this worker"""
+    now = datetime.utcnow()
+    ids = [message_id for (message_id,) in db.session.query(EmailOutbox.id).filter(
+        _claimable(now, stale_seconds)
+    ).order_by(EmailOutbox.id).limit(batch_size).all()]
+
+    if not ids:
+        return []
+
+    EmailOutbox.query.filter(
+        EmailOutbox.id.in_(ids),
+        _claimable(now, stale_seconds)
+    ).update({
+        EmailOutbox.status: 'sending',
+        EmailOutbox.claimed_by: worker_id,
+        EmailOutbox.claimed_at: now
+    }, synchronize_session=False)
+    db.session.commit()
+
+    return EmailOutbox.query.filter_by(
+        claimed_by=worker_id,
+        status='sending'
+    ).order_by(EmailOutbox.id).all()
+
+
+def _build_message(message):
+    return Message(
+        subject=message.subject,
+        recipients=[message.recipient],
+        html=message.html_body,
+        body=message.text_body or message.html_body
+    )
+
+
+def _record_failure(message, error, max_attempts, backoff_seconds):
+    message.attempts += 1
+    message.last_error = str(error)[:1000]
+    message.claimed_by = None
+    if message.attempts >= max_attempts:
+        message.status = 'failed'
+        inc('presence_emails_total', event='failed')
+    else:
+        inc('presence_emails_total', event='retry')
+        # Exponential backoff: backoff, 2x backoff, 4x backoff...
+        message.status = 'pending'
+        message.next_attempt_at = datetime.utcnow() + timedelta(
+            seconds=backoff_seconds * 2 ** (message.attempts - 1)
+        )
+
+
+def deliver_pending(worker_id, config, limiter=None):
+    """
+    Send every due message over a single SMTP connection, claiming batches
+    until the outbox is empty. Returns the number of messages sent.
+    """
+    batch_size = config['MAIL_BATCH_SIZE']
+    max_attempts = config['MAIL_MAX_ATTEMPTS']
+    backoff = config['MAIL_RETRY_BACKOFF']
+    limiter = limiter or RateLimiter(config.get('MAIL_RATE_LIMIT'))
+
+    queue = deque(claim_messages(worker_id, batch_size))
+    if not queue:
+        return 0
+
+    sent = 0
+    try:
+        with mail.connect() as connection:
+            while queue:
+                message = queue[0]
+                limiter.wait()
+                try:
+                    connection.send(_build_message(message))
+                    message.status = 'sent'
+                    message.sent_at = datetime.utcnow()
+                    message.claimed_by = None
+                    sent += 1
+                    inc('presence_emails_total', event='sent')
+                except CONNECTION_ERRORS:
+                    raise
+                except Exception as e:
+                    # Rejected message (bad recipient...), the connection is still usable
+                    _record_failure(message, e, max_attempts, backoff)
+                queue.popleft()
+                db.session.commit()
+
+                if not queue:
+                    queue.extend(claim_messages(worker_id, batch_size))
+    except Exception as e:
+        db.session.rollback()
+        for message in queue:
+            _record_failure(message, e, max_attempts, backoff)
+        db.session.commit()
+        if not sent:
+            raise
+
+    return sent
+
+
+def drain_email_outbox(config):
+    """Deliver everything that is due from the current thread (scripts, tests)"""
+    return deliver_pending(uuid.uuid4().hex, config)
+
+
+def start_email_workers(app):
+    """Start MAIL_WORKERS threads, each holding its own SMTP connection while there is work"""
+    workers = app.config.get('MAIL_WORKERS') or 0
+    if app.config.get('TESTING') or workers < 1:
+        return None
+
+    stop_event = Event()
+    limiter = RateLimiter(app.config.get('MAIL_RATE_LIMIT'))
+
+    def run():
+        worker_id = uuid.uuid4().hex
+        while not stop_event.is_set():
+            sent = 0
+            with app.app_context():
+                try:
+                    sent = deliver_pending(worker_id, app.config, limiter)
+                except Exception:
+                    db.session.rollback()
+                    app.logger.exception("Email worker failed to deliver the outbox")
+                finally:
+                    db.session.remove()
+
+            if not sent:
+                _wakeup.wait(app.config['MAIL_OUTBOX_POLL_INTERVAL'])
+                _wakeup.clear()
+
+    for index in range(workers):
+        Thread(target=run, name=f'email-worker-{index}', daemon=True).start()
+    return stop_event
@@ -0,0 +1,60 @@
+import hashlib
+import hmac
+from flask import current_app
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+from app.models import db, User
+
+# Link purposes, each signed with its own salt
+CREATE = 'create'
+RESET = 'reset'
+
+
+def _serializer(purpose):
+    return URLSafeTimedSerializer(current_app.config['SECRET_KEY'], salt=f'password-{purpose}')
+
+
+def password_fingerprint(user):
+    """Short digest of the password hash: it changes as soon as the password does"""
+    return hashlib.sha256((user.password_hash or '').encode()).hexdigest()[:16]
+
+
+def uses_signed_links():
+    return current_app.config.get('PASSWORD_LINK_MODE') == 'signed'
+
+
+def make_signed_token(user, purpose):
+    """Signed, timestamped token over (user_id, password fingerprint); nothing is stored"""
+    return _serializer(purpose).dumps([user.id, password_fingerprint(user)])
+
+
+def generate_password_token(user, purpose):
+    """
+    Token for a password creation/reset link.
+    In 'signed' mode no database write is needed; otherwise the token is
+    stored on the user (the caller commits).
+    """
+    if uses_signed_links():
+        return make_signed_token(user, purpose)
+    return user.generate_token()
+
+
+def verify_password_token(token, purpose):
+    """
+    Return the user a password link belongs to, or None if it is invalid or expired.
+    Both kinds of links are accepted so that switching PASSWORD_LINK_MODE does
+    not break the emails already sent (stored tokens never contain a dot).
+    """
+    if '.' not in token:
+        user = User.query.filter_by(token=token).first()
+        return user if user and user.verify_token() else None
+
+    max_age = current_app.config['PASSWORD_TOKEN_EXPIRY'].total_seconds()
+    try:
+        user_id, fingerprint = _serializer(purpose).loads(token, max_age=max_age)
+    except (BadSignature, ValueError, TypeError):
+        return None
+
+    user = db.session.get(User, user_id)
+    if not user or not hmac.compare_digest(fingerprint, password_fingerprint(user)):
+        return None
+    return user
@@ -1,4 +1,3 @@
-import qrcode
 from io import BytesIO
 import base64
 from datetime import datetime
@@ -15,6 +14,8 @@ def generate_qr_code(data, size=10):
     Returns:
         Base64 encoded PNG image string
     """
+    import qrcode  # pulls in PIL: only loaded when a QR code is drawn
+
     qr = qrcode.QRCode(
         version=1,
         error_correction=qrcode.constants.ERROR_CORRECT_L,
@@ -0,0 +1,144 @@
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Collectors receiving the statements run in this context: the request's and any assert_max_queries
+_collectors = ContextVar('query_collectors', default=())
+_installed = False
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER_LIST = re.compile(r'\(\s*(?:\?|%s|%\(\w+\)s)(?:\s*,\s*(?:\?|%s|%\(\w+\)s))*\s*\)')
+_SPACES = re.compile(r'\s+')
+_SELECT_LIST = re.compile(r'^SELECT .+? FROM ', re.DOTALL)
+
+
+def fingerprint(statement):
+    """The statement with its literals and IN lists blanked out, so the same query in a loop matches itself"""
+    statement = _STRING.sub('?', statement)
+    statement = _NUMBER.sub('?', statement)
+    statement = _PLACEHOLDER_LIST.sub('(?)', statement)
+    return _SPACES.sub(' ', statement).strip()
+
+
+def _shorten(sql, length=200):
+    """For the log: the FROM/WHERE part tells the queries apart, not the column list"""
+    return _SELECT_LIST.sub('SELECT … FROM ', sql)[:length]
+
+
+class QueryStats:
+    """Statements, total SQL time and repetitions seen by one request or one assert_max_queries block"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = []
+        self.fingerprints = Counter()
+
+    def record(self, statement, duration):
+        self.count += 1
+        self.duration += duration
+        self.statements.append(statement)
+        self.fingerprints[fingerprint(statement)] += 1
+
+    def repeated(self, threshold):
+        """(fingerprint, count) of the statements run more than `threshold` times, most repeated first"""
+        return [(sql, count) for sql, count in self.fingerprints.most_common() if count > threshold]
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _collectors.get():
+        conn.info.setdefault('query_started_at', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    collectors = _collectors.get()
+    started = conn.info.get('query_started_at')
+    if not collectors or not started:
+        return
+    duration = time.perf_counter() - started.pop()
+    for stats in collectors:
+        stats.record(statement, duration)
+
+
+def _install_listeners():
+    """Listen on every engine (primary and replica binds) once per process"""
+    global _installed
+    if _installed:
+        return
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    _installed = True
+
+
+@contextmanager
+def collect_queries():
+    """Record the statements run in the block: `with collect_queries() as stats: ...`"""
+    _install_listeners()
+    stats = QueryStats()
+    token = _collectors.set(_collectors.get() + (stats,))
+    try:
+        yield stats
+    finally:
+        _collectors.reset(token)
+
+
+@contextmanager
+def assert_max_queries(max_count, max_repeats=None):
+    """
+    Fail when the block runs more than `max_count` statements, or the same
+    statement more than `max_repeats` times (an N+1 loop):
+
+        with assert_max_queries(10, max_repeats=2):
+            client.get('/teacher/course/1')
+    """
+    with collect_queries() as stats:
+        yield stats
+
+    problems = []
+    if stats.count > max_count:
+        problems.append(f"{stats.count} queries run, at most {max_count} expected")
+    if max_repeats is not None:
+        problems.extend(f"{count}x {sql}" for sql, count in stats.repeated(max_repeats))
+    if problems:
+        listing = '\n'.join(f"  {index}. {sql}" for index, sql in enumerate(stats.statements, 1))
+        raise AssertionError('\n'.join(problems) + f"\nStatements:\n{listing}")
+
+
+def init_query_stats(app):
+    """Count the queries of every request and log the ones above the QUERY_* thresholds"""
+    if not app.config.get('QUERY_STATS_ENABLED'):
+        return
+    _install_listeners()
+
+    @app.before_request
+    def start_query_stats():
+        g.query_stats = QueryStats()
+        g.query_stats_token = _collectors.set(_collectors.get() + (g.query_stats,))
+
+    @app.teardown_request
+    def stop_query_stats(exc=None):
+        stats = g.pop('query_stats', None)
+        token = g.pop('query_stats_token', None)
+        if stats is None:
+            return
+        try:
+            _collectors.reset(token)
+        except ValueError:
+            pass  # set in another context (streamed response)
+
+        repeated = stats.repeated(app.config['QUERY_REPEAT_WARN_THRESHOLD'])
+        too_many = stats.count > app.config['QUERY_COUNT_WARN_THRESHOLD']
+        too_slow = stats.duration * 1000 > app.config['QUERY_TIME_WARN_MS']
+        if not (repeated or too_many or too_slow):
+            return
+        message = (f"{request.method} {request.path} ({request.endpoint}): "
+                   f"{stats.count} queries in {stats.duration * 1000:.1f} ms")
+        for sql, count in repeated[:3]:
+            message += f"\n  repeated {count}x: {_shorten(sql)}"
+        app.logger.warning(message)
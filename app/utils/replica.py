@@ -0,0 +1,122 @@
+import time
+from datetime import datetime
+from functools import wraps
+from threading import Thread, Event, Lock
+from flask import current_app, g, has_app_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy.exc import SQLAlchemyError
+
+# Bind key of the replica engine in SQLALCHEMY_BINDS
+REPLICA_BIND = 'replica'
+
+
+class RoutingSession(Session):
+    """
+    db.session class that sends the reads of @read_replica views to the replica.
+    Flushes and INSERT/UPDATE/DELETE statements always go to the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing and not getattr(clause, 'is_dml', False)
+                and has_app_context() and g.get('use_read_replica')):
+            engine = self._db.engines.get(REPLICA_BIND)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+class ReplicaHealth:
+    """Last verdict on the replica lag, shared by the request threads of the process"""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.checked_at = 0
+        self.usable = False
+
+    def check(self, engine, max_lag):
+        from app.models import ReplicaHeartbeat
+        try:
+            with engine.connect() as connection:
+                beat_at = connection.execute(
+                    ReplicaHeartbeat.__table__.select().with_only_columns(ReplicaHeartbeat.beat_at)
+                ).scalar()
+        except SQLAlchemyError as e:
+            current_app.logger.warning(f"Read replica unreachable, reading from the primary: {e}")
+            return False
+        if beat_at is None:
+            return False
+        return (datetime.utcnow() - beat_at).total_seconds() <= max_lag
+
+    def is_usable(self, engine, config):
+        with self.lock:
+            if time.monotonic() - self.checked_at < config['REPLICA_CHECK_INTERVAL']:
+                return self.usable
+            # The heartbeat itself is up to one interval old on a perfectly synced replica
+            max_lag = config['REPLICA_MAX_LAG_SECONDS'] + config['REPLICA_HEARTBEAT_INTERVAL']
+            self.usable = self.check(engine, max_lag)
+            self.checked_at = time.monotonic()
+            return self.usable
+
+
+replica_health = ReplicaHealth()
+
+
+def replica_available():
+    """True when a replica is configured, reachable and no more stale than allowed"""
+    from app.models import db
+    engine = db.engines.get(REPLICA_BIND)
+    if engine is None:
+        return False
+    return replica_health.is_usable(engine, current_app.config)
+
+
+def read_replica(f):
+    """Decorator for read-only views: their queries go to the replica when it is fresh enough"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not replica_available():
+            return f(*args, **kwargs)
+        g.use_read_replica = True
+        try:
+            return f(*args, **kwargs)
+        finally:
+            g.use_read_replica = False
+    return decorated_function
+
+
+def beat():
+    """Write the current time on the primary; the replica shows how far behind it is"""
+    from app.models import db, ReplicaHeartbeat
+    now = datetime.utcnow()
+    updated = db.session.execute(
+        db.update(ReplicaHeartbeat).where(ReplicaHeartbeat.id == 1).values(beat_at=now)
+    ).rowcount
+    if not updated:
+        db.session.add(ReplicaHeartbeat(id=1, beat_at=now))
+    db.session.commit()
+
+
+def start_replica_heartbeat(app):
+    """Background thread refreshing the heartbeat while a replica is configured"""
+    if app.config.get('TESTING') or REPLICA_BIND not in (app.config.get('SQLALCHEMY_BINDS') or {}):
+        return None
+
+    from app.models import db
+    stop_event = Event()
+
+    def run():
+        interval = app.config['REPLICA_HEARTBEAT_INTERVAL']
+        while True:
+            with app.app_context():
+                try:
+                    beat()
+                except Exception:
+                    db.session.rollback()
+                    app.logger.exception("Replica heartbeat failed")
+                finally:
+                    db.session.remove()
+            if stop_event.wait(interval):
+                break
+
+    Thread(target=run, name='replica-heartbeat', daemon=True).start()
+    return stop_event
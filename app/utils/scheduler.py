@@ -0,0 +1,89 @@
+from datetime import datetime, timedelta
+from threading import Thread, Event
+from zoneinfo import ZoneInfo
+from app.models import (db, Course, AcademicYear, Semester, Subject,
+                        start_course_session)
+
+
+def close_overdue_courses(now, max_duration_minutes):
+    """Complete every active session that has been running longer than allowed"""
+    cutoff = now - timedelta(minutes=max_duration_minutes)
+    return Course.query.filter(
+        Course.status == 'active',
+        Course.started_at < cutoff
+    ).update({
+        Course.status: 'completed',
+        Course.ended_at: now,
+        Course.qr_token: None
+    }, synchronize_session=False)
+
+
+def local_now(timezone=None):
+    """Naive wall-clock time, the basis of Course.scheduled_date (UTC is used for the other timestamps)"""
+    if timezone:
+        return datetime.now(ZoneInfo(timezone)).replace(tzinfo=None)
+    return datetime.now()
+
+
+def open_scheduled_courses(now, window_minutes, scheduled_now=None):
+    """
+    Start pending sessions whose scheduled_date has just been reached.
+    Sessions scheduled more than `window_minutes` ago are left to the teacher.
+    `now` (UTC) is the start time recorded; scheduled dates are compared with
+    `scheduled_now`, the wall-clock time (defaults to local_now()).
+    """
+    scheduled_now = scheduled_now or local_now()
+    due = db.session.query(Course.id, AcademicYear.track_id).join(
+        Subject, Subject.id == Course.subject_id
+    ).join(
+        Semester, Semester.id == Subject.semester_id
+    ).join(
+        AcademicYear, AcademicYear.id == Semester.academic_year_id
+    ).filter(
+        Course.status == 'pending',
+        Course.scheduled_date <= scheduled_now,
+        Course.scheduled_date > scheduled_now - timedelta(minutes=window_minutes)
+    ).all()
+
+    # One guarded UPDATE per session: a course opened meanwhile by the teacher
+    # or by the scheduler of another worker is skipped, not populated twice
+    return sum(start_course_session(course_id, track_id, now) for course_id, track_id in due)
+
+
+def run_course_scheduler_tick(config):
+    """Apply the automatic session transitions once. Returns (opened, closed)."""
+    now = datetime.utcnow()
+
+    closed = close_overdue_courses(now, config['COURSE_MAX_DURATION_MINUTES'])
+    opened = 0
+    if config.get('COURSE_AUTO_START'):
+        opened = open_scheduled_courses(now, config['COURSE_AUTO_START_WINDOW_MINUTES'],
+                                        local_now(config.get('COURSE_SCHEDULE_TIMEZONE')))
+
+    db.session.commit()
+    return opened, closed
+
+
+def start_course_scheduler(app):
+    """Start the background thread that auto-closes (and optionally auto-opens) sessions"""
+    if app.config.get('TESTING') or not app.config.get('COURSE_SCHEDULER_ENABLED'):
+        return None
+
+    stop_event = Event()
+
+    def run():
+        interval = app.config['COURSE_SCHEDULER_INTERVAL']
+        while not stop_event.wait(interval):
+            with app.app_context():
+                try:
+                    opened, closed = run_course_scheduler_tick(app.config)
+                    if opened or closed:
+                        app.logger.info(f"Course scheduler: {opened} session(s) started, {closed} closed")
+                except Exception:
+                    db.session.rollback()
+                    app.logger.exception("Course scheduler tick failed")
+                finally:
+                    db.session.remove()
+
+    Thread(target=run, name='course-scheduler', daemon=True).start()
+    return stop_event
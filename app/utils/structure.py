@@ -0,0 +1,93 @@
+from app.models import db, Track, AcademicYear, Semester, Subject, SubjectCodeSequence
+from app.utils.subject_codes import format_subject_code
+
+
+def _bulk_insert(model, rows, parent_column, parent_ids):
+    """
+    Insert rows with one executemany INSERT and return their ids in the same order.
+    The parents are brand new, so every child they own was inserted here and
+    auto-increment ids follow the insertion order (no RETURNING needed on MySQL).
+    """
+    if not rows:
+        return []
+    db.session.execute(db.insert(model), rows)
+    return [row_id for (row_id,) in db.session.execute(
+        db.select(model.id).where(parent_column.in_(parent_ids)).order_by(model.id)
+    )]
+
+
+def generate_academic_structure(track):
+    """Create the years and semesters of the track's level in two bulk INSERTs (caller commits)"""
+    structure = Track.get_academic_structure(track.level)
+    per_year = structure['semesters_per_year']
+
+    year_ids = _bulk_insert(AcademicYear, [
+        {'name': year_name, 'order': i, 'track_id': track.id}
+        for i, (code, year_name) in enumerate(structure['years'], 1)
+    ], AcademicYear.track_id, [track.id])
+
+    semesters = [
+        {'name': f'Semestre {(i - 1) * per_year + j}', 'order': j, 'academic_year_id': year_id}
+        for i, year_id in enumerate(year_ids, 1)
+        for j in range(1, per_year + 1)
+    ]
+    db.session.execute(db.insert(Semester), semesters)
+
+    return len(year_ids), len(semesters)
+
+
+def clone_track_structure(source, target):
+    """
+    Copy the years, semesters and subjects of `source` into the new track
+    `target`, with the planned CM/TD/TP volumes of every subject.
+    Subject codes get the target's prefix (INFO-L1-01 -> DATA-L1-01).
+    Three SELECTs and four bulk INSERTs whatever the size of the track (caller commits).
+    Returns (years, semesters, subjects) counts.
+    """
+    years = AcademicYear.query.filter_by(
+        track_id=source.id
+    ).order_by(AcademicYear.id).all()
+
+    semesters = Semester.query.join(AcademicYear).filter(
+        AcademicYear.track_id == source.id
+    ).order_by(Semester.id).all()
+
+    subjects = Subject.query.join(Semester).join(AcademicYear).filter(
+        AcademicYear.track_id == source.id
+    ).order_by(Subject.id).all()
+
+    new_year_ids = _bulk_insert(AcademicYear, [
+        {'name': year.name, 'order': year.order, 'track_id': target.id}
+        for year in years
+    ], AcademicYear.track_id, [target.id])
+    year_map = dict(zip([year.id for year in years], new_year_ids))
+
+    new_semester_ids = _bulk_insert(Semester, [
+        {'name': semester.name, 'order': semester.order,
+         'academic_year_id': year_map[semester.academic_year_id]}
+        for semester in semesters
+    ], Semester.academic_year_id, new_year_ids)
+    semester_map = dict(zip([semester.id for semester in semesters], new_semester_ids))
+
+    # Codes are renumbered with the target's prefix, in the order of the source
+    # subjects, and each year's sequence continues after the last number used
+    years_by_id = {year.id: year for year in years}
+    semester_years = {semester.id: semester.academic_year_id for semester in semesters}
+    numbers = {year.id: 0 for year in years}
+    rows = []
+    for subject in subjects:
+        year = years_by_id[semester_years[subject.semester_id]]
+        numbers[year.id] += 1
+        rows.append({
+            'name': subject.name, 'code': format_subject_code(target, year, numbers[year.id]),
+            'description': subject.description, 'semester_id': semester_map[subject.semester_id],
+            'total_cm': subject.total_cm, 'total_td': subject.total_td, 'total_tp': subject.total_tp
+        })
+    if rows:
+        db.session.execute(db.insert(Subject), rows)
+        db.session.execute(db.insert(SubjectCodeSequence), [
+            {'track_id': target.id, 'academic_year_id': year_map[year_id], 'last_value': number}
+            for year_id, number in numbers.items() if number
+        ])
+
+    return len(years), len(semesters), len(subjects)
@@ -0,0 +1,70 @@
+from sqlalchemy.exc import IntegrityError
+from app.models import db, Semester, Subject, SubjectCodeSequence
+
+# Words skipped when picking the track abbreviation
+GENERIC_TRACK_WORDS = ['GENIE', 'MASTER', 'LICENCE', 'DOCTORAT']
+
+
+def subject_code_prefix(track, year):
+    """'INFO-L1' style prefix: track abbreviation + level initial + year order"""
+    # 1. Track Abbreviation (First 4 chars of valid word, or GENI default)
+    track_words = track.name.upper().split()
+    abbrev = track_words[0][:4] if track_words else 'GENI'
+    for word in track_words:
+        if word not in GENERIC_TRACK_WORDS:
+            abbrev = word[:4]
+            break
+
+    # 2. Level (L1, L2, M1...)
+    level_initial = track.level[0].upper() if track.level else 'L'
+    return f"{abbrev}-{level_initial}{year.order}"
+
+
+def format_subject_code(track, year, number):
+    return f"{subject_code_prefix(track, year)}-{number:02d}"
+
+
+def _count_year_subjects(year_id):
+    """Number of subjects already in the year, in one aggregate query"""
+    return db.session.scalar(
+        db.select(db.func.count(Subject.id)).join(Semester).where(Semester.academic_year_id == year_id)
+    ) or 0
+
+
+def _sequence_filter(track, year):
+    return (SubjectCodeSequence.track_id == track.id,
+            SubjectCodeSequence.academic_year_id == year.id)
+
+
+def peek_subject_code(track, year):
+    """Code the next subject of the year would get, without reserving it (form pre-fill)"""
+    last_value = db.session.scalar(db.select(SubjectCodeSequence.last_value).where(*_sequence_filter(track, year)))
+    if last_value is None:
+        last_value = _count_year_subjects(year.id)
+    return format_subject_code(track, year, last_value + 1)
+
+
+def allocate_subject_code(track, year):
+    """
+    Reserve the next subject code of the year.
+    The counter row is incremented with a single UPDATE, which locks it until the
+    caller commits, so two admins creating subjects at the same time never get the
+    same number. The row is created on first use, seeded from the subjects already
+    in the year; if another request creates it first, the UPDATE is simply retried.
+    """
+    increment = db.update(SubjectCodeSequence).where(*_sequence_filter(track, year)).values(
+        last_value=SubjectCodeSequence.last_value + 1
+    )
+    while not db.session.execute(increment).rowcount:
+        first_value = _count_year_subjects(year.id) + 1
+        try:
+            with db.session.begin_nested():
+                db.session.execute(db.insert(SubjectCodeSequence).values(
+                    track_id=track.id, academic_year_id=year.id, last_value=first_value
+                ))
+            break
+        except IntegrityError:
+            continue
+
+    number = db.session.scalar(db.select(SubjectCodeSequence.last_value).where(*_sequence_filter(track, year)))
+    return format_subject_code(track, year, number)
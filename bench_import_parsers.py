@@ -0,0 +1,80 @@
+"""Benchmark des lecteurs d'import : XLSX (openpyxl) contre CSV/TSV en streaming"""
+import csv
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from app.utils.importer import iter_import_rows, parse_user_row
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+HEADER = ['Email', 'Prénom', 'Nom', 'Matricule']
+
+
+def fake_rows():
+    for i in range(ROWS):
+        yield [f'etudiant{i}@uir.ac.ma', 'Zoé', f'Nom{i}', f'M{i:06d}']
+
+
+def write_xlsx(path):
+    import openpyxl
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(HEADER)
+    for row in fake_rows():
+        sheet.append(row)
+    workbook.save(path)
+
+
+def write_csv(path, delimiter, encoding):
+    with open(path, 'w', newline='', encoding=encoding) as handle:
+        writer = csv.writer(handle, delimiter=delimiter)
+        writer.writerow(HEADER)
+        writer.writerows(fake_rows())
+
+
+def measure(path):
+    """Parse every row like the import pipeline does; returns (rows, seconds, peak MB)"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    count = 0
+    with open(path, 'rb') as stream:
+        for _, row in iter_import_rows(stream, path):
+            parse_user_row(row)
+            count += 1
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return count, elapsed, peak / (1024 * 1024)
+
+
+if __name__ == '__main__':
+    print("=" * 80)
+    print(f"BENCHMARK DES LECTEURS D'IMPORT ({ROWS} lignes)")
+    print("=" * 80)
+    print()
+
+    folder = tempfile.mkdtemp()
+    files = [
+        ('XLSX', os.path.join(folder, 'etudiants.xlsx'), lambda p: write_xlsx(p)),
+        ('CSV utf-8 (,)', os.path.join(folder, 'etudiants.csv'), lambda p: write_csv(p, ',', 'utf-8')),
+        ('CSV cp1252 (;)', os.path.join(folder, 'etudiants_excel.csv'), lambda p: write_csv(p, ';', 'cp1252')),
+        ('TSV utf-8-sig', os.path.join(folder, 'etudiants.tsv'), lambda p: write_csv(p, '\t', 'utf-8-sig')),
+    ]
+
+    try:
+        for label, path, writer in files:
+            writer(path)
+            count, elapsed, peak = measure(path)
+            size = os.path.getsize(path) / (1024 * 1024)
+            print(f"📄 {label:<16} {size:6.1f} Mo  {count} lignes  "
+                  f"{elapsed:6.2f} s  pic mémoire {peak:6.1f} Mo")
+    finally:
+        for _, path, _ in files:
+            if os.path.exists(path):
+                os.remove(path)
+        os.rmdir(folder)
+
+    print()
+    print("=" * 80)
@@ -0,0 +1,61 @@
+"""Benchmark du hachage des mots de passe : connexions par seconde, dans le thread ou via le pool de processus"""
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from app.utils import hashing
+
+LOGINS = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+THREADS = 16  # request threads hitting the login route at the same time
+METHODS = ['scrypt:32768:8:1', 'scrypt:16384:8:1', 'pbkdf2:sha256:600000', 'pbkdf2:sha256:1000000']
+CORES = os.cpu_count() or 1
+
+
+def inline_rate(password_hash):
+    """Verifications per second in the calling thread (one core)"""
+    count = max(5, LOGINS // 10)
+    start = time.perf_counter()
+    for _ in range(count):
+        check_password_hash(password_hash, 'motdepasse123')
+    return count / (time.perf_counter() - start)
+
+
+def pool_rate(app, password_hash):
+    """Verifications per second when THREADS request threads share the pool"""
+    with app.app_context():
+        start = time.perf_counter()
+        with ThreadPoolExecutor(THREADS) as threads:
+            results = list(threads.map(
+                lambda _: hashing.verify_password(password_hash, 'motdepasse123'), range(LOGINS)
+            ))
+        elapsed = time.perf_counter() - start
+    assert all(results)
+    return LOGINS / elapsed
+
+
+if __name__ == '__main__':
+    print("=" * 80)
+    print(f"BENCHMARK DU HACHAGE DES MOTS DE PASSE ({LOGINS} connexions, {THREADS} threads, {CORES} cœur(s))")
+    print("=" * 80)
+    print()
+
+    app = Flask(__name__)
+    app.config['PASSWORD_HASH_WORKERS'] = CORES
+    hashing.start_password_hasher(app)
+
+    try:
+        for method in METHODS:
+            password_hash = generate_password_hash('motdepasse123', method)
+            inline = inline_rate(password_hash)
+            pooled = pool_rate(app, password_hash)
+            print(f"🔐 {method:<24} thread : {inline:7.1f} /s   "
+                  f"pool : {pooled:7.1f} /s   soit {pooled / CORES:7.1f} /s/cœur")
+    finally:
+        hashing.stop_password_hasher()
+
+    print()
+    print("💡 Choisir PASSWORD_HASH_METHOD pour que 1000 connexions tiennent dans la fenêtre voulue")
+    print("=" * 80)
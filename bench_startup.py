@@ -0,0 +1,85 @@
+"""Benchmark du démarrage à froid : import du paquet app puis create_app / create_db_app, dans des processus neufs"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+RUNS = int(sys.argv[1]) if len(sys.argv) > 1 and sys.argv[1].isdigit() else 10
+FACTORIES = ['create_app', 'create_db_app']
+
+
+def child(factory_name):
+    """One cold start; prints its timings as JSON (the background threads are daemons, the hashing pool stops at exit)"""
+    start = time.perf_counter()
+    import app
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    imported = time.perf_counter()
+
+    statements = []
+    event.listen(Engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+    getattr(app, factory_name)()
+    built = time.perf_counter()
+
+    print(json.dumps({
+        'import': imported - start,
+        'factory': built - imported,
+        'queries': len(statements),
+        'modules': len(sys.modules),
+    }), flush=True)
+
+
+def measure(factory_name, env):
+    results = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        output = subprocess.run(
+            [sys.executable, __file__, '--child', factory_name],
+            env=env, capture_output=True, text=True, check=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        result['process'] = time.perf_counter() - start
+        results.append(result)
+    return results
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2 and sys.argv[1] == '--child':
+        child(sys.argv[2])
+        sys.exit(0)
+
+    folder = tempfile.mkdtemp()
+    database = os.path.join(folder, 'bench_startup.db')
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{database}')
+
+    print("=" * 80)
+    print(f"BENCHMARK DU DÉMARRAGE À FROID ({RUNS} processus par fabrique)")
+    print("=" * 80)
+    print()
+
+    try:
+        # Schema created once, so the runs measure a normal boot and not the first migration
+        subprocess.run([sys.executable, 'migrate.py'], env=env, capture_output=True, check=True)
+
+        for factory_name in FACTORIES:
+            results = measure(factory_name, env)
+            print(f"⚡ {factory_name:<14} import {median([r['import'] for r in results]) * 1000:7.1f} ms   "
+                  f"fabrique {median([r['factory'] for r in results]) * 1000:7.1f} ms   "
+                  f"processus {median([r['process'] for r in results]) * 1000:7.1f} ms   "
+                  f"requêtes {median([r['queries'] for r in results])}   "
+                  f"modules {median([r['modules'] for r in results])}")
+    finally:
+        for name in os.listdir(folder):
+            os.remove(os.path.join(folder, name))
+        os.rmdir(folder)
+
+    print()
+    print("ℹ️  médianes ; « processus » inclut le démarrage de l'interpréteur")
+    print("=" * 80)
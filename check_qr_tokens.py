@@ -1,9 +1,9 @@
 """Script de diagnostic pour les tokens QR"""
-from app import create_app
+from app import create_db_app
 from app.models import db, Course, AttendanceToken
 from datetime import datetime
 
-app = create_app()
+app = create_db_app()
 
 with app.app_context():
     print("=" * 80)
@@ -0,0 +1,117 @@
+"""
+Vérifie avec EXPLAIN que chaque requête fréquente utilise l'index prévu pour elle.
+SQLite : sur une base temporaire construite par les migrations (aussi lancé par tests/test_query_plans.py).
+MySQL : sur la base configurée, une fois migrée.
+"""
+import os
+import shutil
+import sys
+import tempfile
+from datetime import datetime
+
+from sqlalchemy import create_engine
+
+from app import create_db_app
+from app.models import db, Course, Attendance, AttendanceToken, User
+from app.migrations import upgrade, current_version, latest_version
+
+# (label, table, index the planner must pick, statement)
+HOT_QUERIES = [
+    ("Séances d'une matière par statut", 'courses', 'ix_courses_subject_status',
+     db.select(Course.id).where(Course.subject_id == 1, Course.status == 'completed')),
+    ("Séances d'un enseignant par matière et type", 'courses', 'ix_courses_teacher_subject_type',
+     db.select(db.func.count(Course.id)).where(
+         Course.teacher_id == 1, Course.subject_id == 1, Course.course_type == 'CM')),
+    ("Présences d'une séance par statut", 'attendances', 'ix_attendances_course_status',
+     db.select(db.func.count(Attendance.id)).where(
+         Attendance.course_id == 1, Attendance.status == 'present')),
+    ("Présences d'un étudiant", 'attendances', 'ix_attendances_student',
+     db.select(Attendance.id).where(Attendance.student_id == 1)),
+    ("Dernier jeton QR d'une séance", 'attendance_tokens', 'ix_attendance_tokens_course_created',
+     db.select(AttendanceToken.id).where(AttendanceToken.course_id == 1)
+     .order_by(AttendanceToken.created_at.desc()).limit(1)),
+    ("Utilisateurs par rôle", 'users', 'ix_users_role',
+     db.select(User.id).where(User.role == 'teacher')),
+    ("Séances à ouvrir par le planificateur", 'courses', 'ix_courses_status_scheduled_date',
+     db.select(Course.id).where(Course.status == 'pending', Course.scheduled_date <= datetime(2024, 1, 1))),
+    ("Séances à fermer par le planificateur", 'courses', 'ix_courses_status_started_at',
+     db.select(Course.id).where(Course.status == 'active', Course.started_at < datetime(2024, 1, 1))),
+]
+
+
+def sqlite_plan(connection, sql, table, index):
+    """Returns (the table is searched through `index`, plan text)"""
+    details = [row[-1] for row in connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {sql}')]
+    table_steps = [detail for detail in details if f' {table} ' in f' {detail} ']
+    uses_index = bool(table_steps) and all(f'INDEX {index} ' in f'{step} ' for step in table_steps)
+    return uses_index, ' | '.join(details)
+
+
+def mysql_plan(connection, sql, table, index):
+    rows = connection.exec_driver_sql(f'EXPLAIN {sql}').mappings().all()
+    table_rows = [row for row in rows if row['table'] == table]
+    uses_index = bool(table_rows) and all(row['key'] == index for row in table_rows)
+    return uses_index, ' | '.join(f"{row['table']}: {row['type']} key={row['key']}" for row in rows)
+
+
+def check_query_plans(connection, log=print):
+    """EXPLAIN every hot query on the connection; returns the labels of those not using their index"""
+    explain = {'sqlite': sqlite_plan, 'mysql': mysql_plan}[connection.dialect.name]
+    failures = []
+    for label, table, index, statement in HOT_QUERIES:
+        sql = str(statement.compile(dialect=connection.dialect, compile_kwargs={'literal_binds': True}))
+        uses_index, plan = explain(connection, sql, table, index)
+        log(f"{'✅' if uses_index else '❌'} {label} ({index})")
+        log(f"   {plan}")
+        if not uses_index:
+            failures.append(label)
+    return failures
+
+
+def migrated_sqlite_engine(folder):
+    """Empty SQLite database built by the migrations, so the check covers the indexes they create"""
+    engine = create_engine(f"sqlite:///{os.path.join(folder, 'plans.db')}")
+    upgrade(engine, log=lambda message: None)
+    return engine
+
+
+if __name__ == '__main__':
+    app = create_db_app()
+
+    with app.app_context():
+        dialect = db.engine.dialect.name
+        print("=" * 80)
+        print(f"PLANS D'EXÉCUTION DES REQUÊTES FRÉQUENTES ({dialect})")
+        print("=" * 80)
+        print()
+
+        if dialect == 'mysql':
+            # The planner depends on the server: check the configured database, once migrated
+            if current_version(db.engine) < latest_version():
+                print("❌ Schéma pas à jour : lancer migrate.py avant la vérification")
+                sys.exit(2)
+            engine = db.engine
+        elif dialect == 'sqlite':
+            print("ℹ️  Base SQLite temporaire créée par les migrations")
+            folder = tempfile.mkdtemp()
+            engine = migrated_sqlite_engine(folder)
+        else:
+            print(f"❌ Dialecte non pris en charge : {dialect}")
+            sys.exit(2)
+
+        with engine.connect() as connection:
+            failures = check_query_plans(connection)
+
+        if dialect == 'sqlite':
+            engine.dispose()
+            shutil.rmtree(folder)
+
+        print()
+        if failures:
+            print(f"❌ {len(failures)} requête(s) sans leur index : vérifier les migrations (app/migrations)")
+            print("   (sur MySQL, une table presque vide peut être lue en entier : vérifier sur une base peuplée)")
+        else:
+            print("✅ Toutes les requêtes fréquentes utilisent leur index")
+        print("=" * 80)
+
+    sys.exit(1 if failures else 0)
@@ -1,9 +1,9 @@
 """Script pour vérifier les tokens des étudiants"""
-from app import create_app
+from app import create_db_app
 from app.models import db, User
 from datetime import datetime
 
-app = create_app()
+app = create_db_app()
 
 with app.app_context():
     students = User.query.filter_by(role='student').all()
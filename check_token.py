@@ -1,8 +1,8 @@
-from app import create_app
+from app import create_db_app
 from app.models import User
 import datetime
 
-app = create_app()
+app = create_db_app()
 
 with app.app_context():
     student = User.query.filter_by(role='student').order_by(User.created_at.desc()).first()
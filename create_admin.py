@@ -1,9 +1,9 @@
 """Script to create a super admin user"""
-from app import create_app
+from app import create_db_app
 from app.models import db, User
 from werkzeug.security import generate_password_hash
 
-app = create_app()
+app = create_db_app()
 
 with app.app_context():
     # Check if user already exists
@@ -1,8 +1,8 @@
-from app import create_app
+from app import create_db_app
 from app.models import User
 import datetime
 
-app = create_app()
+app = create_db_app()
 
 with app.app_context():
     # 1. Get the latest student to retrieve the REAL token
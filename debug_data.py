@@ -1,7 +1,7 @@
-from app import create_app, db
+from app import create_db_app, db
 from app.models import User, TeacherSubjectAssignment, Subject, Semester, AcademicYear, Track
 
-app = create_app()
+app = create_db_app()
 
 with app.app_context():
     # Get the logged in teacher (assuming it's the first one or a specific email if known, but I'll list all teachers with assignments)
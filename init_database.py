@@ -1,26 +1,28 @@
 """Script d'initialisation de la base de données"""
-import pymysql
-from app import create_app
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+from app import create_db_app
+from app.config import Config
 from app.models import db
+from app.migrations import upgrade, current_version
+from app.cli import bootstrap_admin
 
 def create_database():
-    """Crée la base de données si elle n'existe pas"""
+    """Crée la base de données MySQL configurée si elle n'existe pas (rien à faire pour SQLite)"""
+    url = make_url(Config.SQLALCHEMY_DATABASE_URI)
+    if url.get_backend_name() != 'mysql':
+        print(f"✓ Base {url.get_backend_name()} : créée à la première connexion")
+        return True
+
     try:
-        # Connexion à MySQL sans spécifier la base de données
-        connection = pymysql.connect(
-            host='localhost',
-            port=3306,
-            user='root',
-            password='MYSQL123'
-        )
-        
-        with connection.cursor() as cursor:
-            # Créer la base de données si elle n'existe pas
-            cursor.execute("CREATE DATABASE IF NOT EXISTS presences_univ CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci")
-            print("✓ Base de données 'presences_univ' créée ou déjà existante")
-        
-        connection.commit()
-        connection.close()
+        # Connexion au serveur sans spécifier la base de données
+        engine = create_engine(url.set(database=None))
+        with engine.begin() as connection:
+            connection.execute(text(
+                f"CREATE DATABASE IF NOT EXISTS `{url.database}` CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci"
+            ))
+        engine.dispose()
+        print(f"✓ Base de données '{url.database}' créée ou déjà existante")
         return True
         
     except Exception as e:
@@ -28,22 +30,14 @@ def create_database():
         return False
 
 def init_tables():
-    """Initialise toutes les tables de la base de données"""
+    """Crée les tables en appliquant toutes les migrations, puis le compte administrateur"""
     try:
-        app = create_app()
+        app = create_db_app()
         with app.app_context():
-            # Créer toutes les tables
-            db.create_all()
-            print("✓ Toutes les tables ont été créées avec succès")
-            
-            # Afficher les tables créées
-            from app.models import User, Department, Track, AcademicYear, Subject, Course, Attendance
-            tables = [
-                'users', 'departments', 'tracks', 'academic_years', 
-                'subjects', 'courses', 'sessions', 'attendances',
-                'teacher_subjects', 'track_admins', 'department_admins'
-            ]
-            print(f"\nTables créées: {', '.join(tables)}")
+            applied = upgrade(db.engine)
+            print(f"✓ {len(applied)} migration(s) appliquée(s), schéma en version {current_version(db.engine)}")
+            admin, created = bootstrap_admin()
+            print(f"✓ Administrateur {admin.email} {'créé' if created else 'déjà présent'}")
             
         return True
         
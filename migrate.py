@@ -1,29 +1,43 @@
-"""Database migration script - add level column to tracks"""
-import pymysql
-
-# Connect directly to MySQL
-connection = pymysql.connect(
-    host='localhost',
-    port=3306,
-    user='root',
-    password='MYSQL123',
-    database='presences_univ'
-)
-
-try:
-    with connection.cursor() as cursor:
-        # Add level column to tracks table
-        try:
-            cursor.execute("ALTER TABLE tracks ADD COLUMN level VARCHAR(20) NOT NULL DEFAULT 'licence'")
-            print("✓ Added level column to tracks table")
-        except pymysql.err.OperationalError as e:
-            if '1060' in str(e):  # Column already exists
-                print("- level column already exists in tracks")
-            else:
-                print(f"! tracks level error: {e}")
-    
-    connection.commit()
-    print("\n✓ Migration completed successfully!")
-    
-finally:
-    connection.close()
+"""Script de migration : applique les migrations versionnées (app/migrations) sur la base configurée
+
+    python migrate.py            applique toutes les migrations en attente
+    python migrate.py --status   affiche la version actuelle et les migrations en attente
+    python migrate.py --to 5     s'arrête à la version 5
+"""
+import argparse
+
+from app import create_db_app
+from app.models import db
+from app.migrations import MIGRATIONS, upgrade, current_version, latest_version
+
+parser = argparse.ArgumentParser(description='Migrations du schéma')
+parser.add_argument('--status', action='store_true', help='affiche la version sans rien appliquer')
+parser.add_argument('--to', type=int, dest='target', help='version cible')
+args = parser.parse_args()
+
+app = create_db_app()
+
+with app.app_context():
+    print("=" * 80)
+    print("MIGRATIONS DU SCHÉMA")
+    print("=" * 80)
+    print()
+
+    version = current_version(db.engine)
+    print(f"Version actuelle : {version} / {latest_version()}")
+    pending = [(number, name) for number, name, _ in MIGRATIONS if number > version]
+
+    if args.status:
+        for number, name in pending:
+            print(f"  ⏳ {number:03d} {name}")
+        if not pending:
+            print("✅ Schéma à jour")
+    elif not pending:
+        print("✅ Schéma à jour, rien à appliquer")
+    else:
+        print()
+        applied = upgrade(db.engine, target=args.target)
+        print()
+        print(f"✅ {len(applied)} migration(s) appliquée(s), version {current_version(db.engine)}")
+
+    print("=" * 80)
@@ -0,0 +1,16 @@
+"""Script pour recalculer les compteurs de présence stockés sur les séances (colonnes créées par migrate.py)"""
+from app import create_db_app
+from app.models import db, recalculate_course_counters
+
+app = create_db_app()
+
+with app.app_context():
+    print("=" * 80)
+    print("RECALCUL DES COMPTEURS DE PRÉSENCE PAR SÉANCE")
+    print("=" * 80)
+    print()
+
+    updated = recalculate_course_counters()
+
+    print(f"✅ {updated} séance(s) recalculée(s)")
+    print("=" * 80)
@@ -1,7 +1,8 @@
 """Script pour régénérer les tokens pour les étudiants sans mot de passe"""
 from app import create_app
 from app.models import db, User
-from app.utils.email import send_password_creation_email
+from app.utils.email import send_password_creation_emails
+from app.utils.outbox import drain_email_outbox
 
 app = create_app()
 
@@ -22,25 +23,19 @@ with app.app_context():
     else:
         print(f"📊 {len(students_without_password)} étudiant(s) sans mot de passe trouvé(s)\n")
         
-        success_count = 0
-        error_count = 0
-        
-        for student in students_without_password:
-            try:
-                print(f"🔄 Traitement de {student.full_name} ({student.email})...")
-                
-                # Générer un nouveau token et envoyer l'email
-                send_password_creation_email(student)
-                
-                success_count += 1
-                print(f"   ✅ Token régénéré et email envoyé")
-                
-            except Exception as e:
-                error_count += 1
-                print(f"   ❌ Erreur: {str(e)}")
+        # Tokens et emails générés en une seule transaction
+        try:
+            queued = send_password_creation_emails(students_without_password)
+            print(f"🔄 {queued} token(s) régénéré(s), emails mis en file d'attente")
             
-            print()
+            # Envoyer immédiatement la file d'attente depuis ce script
+            sent = drain_email_outbox(app.config)
+            print(f"   ✅ {sent} email(s) envoyé(s)")
+        except Exception as e:
+            print(f"   ❌ Erreur: {str(e)}")
+        
+        print()
         
         print("=" * 80)
-        print(f"✅ Terminé : {success_count} succès, {error_count} erreur(s)")
+        print("✅ Terminé (les emails non envoyés seront réessayés par l'application)")
         print("=" * 80)
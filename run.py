@@ -1,3 +1,9 @@
+import os
+
+if __name__ == '__main__':
+    # Development server: pending migrations are applied at startup (SCHEMA_AUTO_UPGRADE)
+    os.environ.setdefault('FLASK_DEBUG', '1')
+
 from app import create_app
 
 app = create_app()
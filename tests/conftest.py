@@ -0,0 +1,42 @@
+import pytest
+from app import create_app
+from app.config import Config
+from app.models import db
+
+
+@pytest.fixture
+def make_app(tmp_path):
+    """
+    create_app on a fresh SQLite file (migrated at startup). Keyword
+    arguments override the configuration: make_app(MAIL_PORT=2525).
+    """
+    apps = []
+
+    def factory(**overrides):
+        settings = dict(
+            SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'primary.db'}",
+            TESTING=True,
+            WTF_CSRF_ENABLED=False,
+            SCHEMA_AUTO_UPGRADE=True,
+            PASSWORD_HASH_WORKERS=0,
+            METRICS_DIR=None,
+        )
+        settings.update(overrides)
+        app = create_app(type('TestConfig', (Config,), settings))
+        apps.append(app)
+        return app
+
+    yield factory
+
+    for app in apps:
+        with app.app_context():
+            db.session.remove()
+            for engine in db.engines.values():
+                engine.dispose()
+
+
+@pytest.fixture
+def app(make_app):
+    app = make_app()
+    with app.app_context():
+        yield app
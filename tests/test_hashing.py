@@ -0,0 +1,56 @@
+import multiprocessing
+
+import pytest
+from flask import Flask
+from werkzeug.security import generate_password_hash
+
+from app.utils import hashing
+from app.utils.hashing import hash_password, needs_rehash, start_password_hasher, verify_password
+
+FAST_METHOD = 'pbkdf2:sha256:1000'
+
+
+@pytest.fixture
+def hasher(monkeypatch):
+    """A pool of one hashing process, as in production"""
+    monkeypatch.setattr(hashing, '_workers', 0)
+    monkeypatch.setattr(hashing, '_queue_size', 0)
+    app = Flask(__name__)
+    app.config.update(PASSWORD_HASH_WORKERS=1, PASSWORD_HASH_METHOD=FAST_METHOD)
+    start_password_hasher(app)
+    with app.app_context():
+        yield app
+    hashing.stop_password_hasher()
+
+
+def verify_in_child(password_hash, results):
+    results.put((hashing._pool is None, verify_password(password_hash, 'motdepasse')))
+
+
+def test_forked_process_starts_its_own_pool(hasher):
+    password_hash = hash_password('motdepasse')
+    assert hashing._pool is not None
+
+    # gunicorn --preload: the worker is forked from a process whose pool is running
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    child = context.Process(target=verify_in_child, args=(password_hash, results))
+    child.start()
+    child.join(timeout=30)
+    if child.is_alive():
+        child.kill()
+        pytest.fail("the hash in the forked process hung")
+
+    assert child.exitcode == 0
+    assert results.get(timeout=5) == (True, True)
+
+
+def test_needs_rehash_compares_the_parameters(app):
+    app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256'
+    assert not needs_rehash(generate_password_hash('motdepasse', 'pbkdf2:sha256'))
+    assert needs_rehash(generate_password_hash('motdepasse', FAST_METHOD))
+    assert needs_rehash(generate_password_hash('motdepasse', 'scrypt:16384:8:1'))
+
+    app.config['PASSWORD_HASH_METHOD'] = 'scrypt'
+    assert not needs_rehash('scrypt:32768:8:1$salt$hash')
+    assert needs_rehash('scrypt:16384:8:1$salt$hash')
@@ -0,0 +1,43 @@
+import io
+
+from werkzeug.datastructures import FileStorage
+
+from app.models import db, AcademicYear, Department, ImportJob, Track, User
+from app.utils import import_jobs
+from app.utils.import_jobs import create_import_job, run_import_job
+
+
+def test_sync_reports_its_progress_while_running(app, tmp_path, monkeypatch):
+    app.config['IMPORT_UPLOAD_FOLDER'] = str(tmp_path)
+    department = Department(name='Informatique')
+    track = Track(name='Genie Informatique', department=department)
+    year = AcademicYear(name='L1', order=1, track=track)
+    admin = User(email='admin@uir.ac.ma', first_name='Admin', last_name='UIR', role='admin')
+    db.session.add_all([department, track, year, admin])
+    db.session.commit()
+
+    lines = ['Email,Prénom,Nom,Matricule'] + [f'user{i}@uir.ac.ma,Prénom,Nom,M{i}' for i in range(5)]
+    upload = FileStorage(io.BytesIO('\n'.join(lines).encode()), filename='roster.csv')
+    job = create_import_job(upload, admin, role='student', track_id=track.id,
+                            department_id=department.id, current_year_id=year.id, mode='sync')
+    job_id = job.id
+
+    # What another process sees of the job while the rows are read
+    seen = []
+    iter_rows = import_jobs.iter_import_rows
+
+    def watched_rows(stream, filename):
+        for row_num, row in iter_rows(stream, filename):
+            with db.engine.connect() as connection:
+                seen.append(connection.execute(db.select(ImportJob.last_row, ImportJob.updated_at)
+                                               .where(ImportJob.id == job_id)).one())
+            yield row_num, row
+
+    monkeypatch.setattr(import_jobs, 'SYNC_HEARTBEAT_INTERVAL', 0)
+    monkeypatch.setattr(import_jobs, 'iter_import_rows', watched_rows)
+    run_import_job(job_id)
+
+    assert [last_row for last_row, _ in seen] == [1, 2, 3, 4, 5]
+    assert seen[-1].updated_at > seen[0].updated_at
+    job = db.session.get(ImportJob, job_id)
+    assert (job.status, job.imported_count, job.last_row) == ('completed', 5, 6)
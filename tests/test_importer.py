@@ -0,0 +1,104 @@
+import pytest
+from app.models import db, AcademicYear, Department, Track, User, student_tracks
+from app.utils.importer import sync_students
+
+
+@pytest.fixture
+def tracks(app):
+    department = Department(name='Informatique')
+    info = Track(name='Genie Informatique', department=department)
+    data = Track(name='Data Science', department=department)
+    l1, l2 = AcademicYear(name='L1', order=1, track=info), AcademicYear(name='L2', order=2, track=info)
+    db.session.add_all([department, info, data, l1, l2])
+    db.session.commit()
+    return info, data, l1, l2
+
+
+def add_student(email, matricule, year, *tracks):
+    student = User(email=email, first_name='Prénom', last_name='Nom', matricule=matricule,
+                   role='student', current_year_id=year.id, department_id=tracks[0].department_id)
+    student.enrolled_tracks = list(tracks)
+    db.session.add(student)
+    db.session.commit()
+    return student
+
+
+def rows(*lines):
+    return [(row_num, line) for row_num, line in enumerate(lines, start=2)]
+
+
+def track_ids(student):
+    return sorted(db.session.execute(
+        db.select(student_tracks.c.track_id).where(student_tracks.c.student_id == student.id)).scalars())
+
+
+def test_sync_keeps_enrollments_in_other_tracks(tracks):
+    info, data, l1, l2 = tracks
+    student = add_student('a@uir.ac.ma', 'M1', l1, info, data)
+
+    result = sync_students(rows(['a@uir.ac.ma', 'Ali', 'Nom', 'M1']), info.id,
+                           department_id=info.department_id, current_year_id=l1.id)
+    db.session.commit()
+
+    assert (result.updated, result.removed) == (1, 0)
+    assert track_ids(student) == sorted([info.id, data.id])
+
+    # Enrolled elsewhere only: the track is added, the other one kept
+    other = add_student('b@uir.ac.ma', 'M2', l1, data)
+    sync_students(rows(['a@uir.ac.ma', 'Ali', 'Nom', 'M1'], ['b@uir.ac.ma', 'Prénom', 'Nom', 'M2']),
+                  info.id, current_year_id=l1.id)
+    db.session.commit()
+    assert track_ids(other) == sorted([info.id, data.id])
+
+
+def test_sync_removes_only_students_of_the_imported_year(tracks):
+    info, data, l1, l2 = tracks
+    kept = add_student('a@uir.ac.ma', 'M1', l1, info)
+    absent = add_student('b@uir.ac.ma', 'M2', l1, info, data)
+    other_year = add_student('c@uir.ac.ma', 'M3', l2, info)
+
+    result = sync_students(rows(['a@uir.ac.ma', 'Prénom', 'Nom', 'M1']), info.id, current_year_id=l1.id)
+    db.session.commit()
+
+    assert (result.unchanged, result.removed) == (1, 1)
+    assert track_ids(kept) == [info.id]
+    assert track_ids(absent) == [data.id]
+    assert track_ids(other_year) == [info.id]
+
+    # Without a year nothing is removed
+    result = sync_students(rows(['a@uir.ac.ma', 'Prénom', 'Nom', 'M1']), info.id)
+    db.session.commit()
+    assert result.removed == 0
+    assert track_ids(other_year) == [info.id]
+
+
+def test_sync_swaps_matricules(tracks):
+    info, data, l1, l2 = tracks
+    first = add_student('a@uir.ac.ma', 'M1', l1, info)
+    second = add_student('b@uir.ac.ma', 'M2', l1, info)
+    add_student('c@uir.ac.ma', 'M3', l2, info)
+
+    result = sync_students(rows(['a@uir.ac.ma', 'Prénom', 'Nom', 'M2'],
+                                ['b@uir.ac.ma', 'Prénom', 'Nom', 'M1'],
+                                ['d@uir.ac.ma', 'Prénom', 'Nom', 'M3']), info.id, current_year_id=l1.id)
+    db.session.commit()
+
+    assert result.updated == 2
+    assert result.errors == ["Ligne 4: matricule déjà existant (M3)"]
+    db.session.expire_all()
+    assert (first.matricule, second.matricule) == ('M2', 'M1')
+
+
+def test_sync_refuses_a_matricule_kept_by_another_student(tracks):
+    info, data, l1, l2 = tracks
+    first = add_student('a@uir.ac.ma', 'M1', l1, info)
+    add_student('b@uir.ac.ma', 'M2', l2, info)
+
+    result = sync_students(rows(['a@uir.ac.ma', 'Prénom', 'Nom', 'M2']), info.id, current_year_id=l1.id)
+    db.session.commit()
+
+    assert result.errors == ["Ligne 2: matricule déjà existant (M2)"]
+    assert (result.updated, result.removed) == (0, 0)
+    db.session.expire_all()
+    assert first.matricule == 'M1'
+    assert track_ids(first) == [info.id]
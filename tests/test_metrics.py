@@ -0,0 +1,76 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+from app.utils.metrics import ARCHIVE_FILE, registry, render
+
+
+@pytest.fixture
+def metrics_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(registry, 'directory', str(tmp_path))
+    monkeypatch.setattr(registry, 'counters', {})
+    monkeypatch.setattr(registry, 'histograms', {})
+    return tmp_path
+
+
+def exited_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+def write_worker_file(directory, pid, value):
+    snapshot = {
+        'counters': [['presence_scans_total', [['result', 'ok']], value]],
+        'histograms': [['presence_http_request_duration_seconds', [['endpoint', 'index']],
+                        {'buckets': [value] + [0] * 11, 'sum': 0.001 * value, 'count': value}]],
+    }
+    (directory / f'{pid}-deadbeef.json').write_text(json.dumps(snapshot))
+
+
+def test_metrics_needs_a_token_outside_debug(make_app):
+    client = make_app(METRICS_ENABLED=True, METRICS_TOKEN=None).test_client()
+    assert client.get('/metrics').status_code == 404
+
+    client = make_app(METRICS_ENABLED=True, METRICS_TOKEN='secret').test_client()
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+    response = client.get('/metrics', headers={'Authorization': 'Bearer secret'})
+    assert response.status_code == 200
+    assert 'presence_active_courses' in response.text
+
+
+def test_metrics_is_open_in_debug_without_token(make_app):
+    app = make_app(METRICS_ENABLED=True, METRICS_TOKEN=None)
+    app.debug = True
+    assert app.test_client().get('/metrics').status_code == 200
+
+
+def test_files_of_exited_workers_are_folded_into_the_archive(metrics_dir):
+    first, second = exited_pid(), exited_pid()
+    write_worker_file(metrics_dir, first, 2)
+    write_worker_file(metrics_dir, second, 3)
+    registry.inc('presence_scans_total', result='ok')
+    expected = render([{
+        'counters': [['presence_scans_total', [['result', 'ok']], 6]],
+        'histograms': [['presence_http_request_duration_seconds', [['endpoint', 'index']],
+                        {'buckets': [5] + [0] * 11, 'sum': 0.005, 'count': 5}]],
+    }])
+
+    assert render(registry.collect()) == expected
+    assert sorted(os.listdir(metrics_dir)) == sorted(['.lock', ARCHIVE_FILE, registry.filename])
+
+    # A later exited worker is added to the archive, the totals never go down
+    write_worker_file(metrics_dir, exited_pid(), 1)
+    assert 'presence_scans_total{result="ok"} 7' in render(registry.collect())
+    assert len(os.listdir(metrics_dir)) == 3
+
+
+def test_files_of_live_workers_are_kept(metrics_dir):
+    write_worker_file(metrics_dir, os.getppid(), 4)
+
+    assert 'presence_scans_total{result="ok"} 4' in render(registry.collect())
+    assert f'{os.getppid()}-deadbeef.json' in os.listdir(metrics_dir)
+    assert ARCHIVE_FILE not in os.listdir(metrics_dir)
@@ -0,0 +1,38 @@
+import multiprocessing
+
+import pytest
+from sqlalchemy import create_engine
+from app.migrations import check_schema_version, current_version, latest_version, upgrade
+
+
+def _upgrade(url):
+    engine = create_engine(url)
+    upgrade(engine, log=lambda message: None)
+    engine.dispose()
+
+
+def test_concurrent_upgrades_apply_each_migration_once(tmp_path):
+    """Workers booting together on an empty database: one migrates, the others wait for it"""
+    url = f"sqlite:///{tmp_path / 'race.db'}"
+    context = multiprocessing.get_context('fork')
+    processes = [context.Process(target=_upgrade, args=(url,)) for _ in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(60)
+
+    assert [process.exitcode for process in processes] == [0, 0, 0, 0]
+    assert current_version(create_engine(url)) == latest_version()
+
+
+def test_startup_refuses_an_outdated_schema_without_auto_upgrade(make_app, tmp_path):
+    app = make_app()
+    engine = create_engine(f"sqlite:///{tmp_path / 'empty.db'}")
+
+    app.config['SCHEMA_AUTO_UPGRADE'] = False
+    with pytest.raises(RuntimeError, match='migrate.py'):
+        check_schema_version(app, engine)
+
+    app.config['SCHEMA_AUTO_UPGRADE'] = True
+    assert check_schema_version(app, engine) == latest_version()
+    assert check_schema_version(app, engine) == latest_version()
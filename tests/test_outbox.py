@@ -0,0 +1,200 @@
+import socketserver
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+from app.models import db, EmailOutbox
+from app.utils.email import send_email
+from app.utils.outbox import RateLimiter, claim_messages, deliver_pending
+
+BACKOFF = 30
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP for smtplib: records the messages, refuses the recipients in server.rejected"""
+
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        server = self.server
+        recipients = []
+        self.reply('220 stub ESMTP')
+        for raw in self.rfile:
+            command = raw.decode().strip()
+            verb = command.split(' ', 1)[0].upper()
+            if verb == 'EHLO':
+                self.reply('250-stub')
+                self.reply('250 8BITMIME')
+            elif verb in ('HELO', 'NOOP'):
+                self.reply('250 OK')
+            elif verb in ('MAIL', 'RSET'):
+                recipients = []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                address = command.split(':', 1)[1].strip().strip('<>')
+                if address in server.rejected:
+                    self.reply('550 No such user')
+                else:
+                    recipients.append(address)
+                    self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                for line in self.rfile:
+                    if line in (b'.\r\n', b'.\n'):
+                        break
+                with server.lock:
+                    server.received.extend(recipients)
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Not implemented')
+
+
+class StubSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), SMTPHandler)
+        self.lock = threading.Lock()
+        self.received = []
+        self.rejected = set()
+
+
+@pytest.fixture
+def smtp_server():
+    server = StubSMTPServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def app(make_app, smtp_server):
+    app = make_app(
+        MAIL_SERVER='127.0.0.1',
+        MAIL_PORT=smtp_server.server_address[1],
+        MAIL_USE_TLS=False,
+        MAIL_USERNAME=None,
+        MAIL_PASSWORD=None,
+        MAIL_DEFAULT_SENDER=('UIR Présence', 'presence@uir.ac.ma'),
+        MAIL_SUPPRESS_SEND=False,
+        MAIL_RATE_LIMIT=0,
+        MAIL_MAX_ATTEMPTS=3,
+        MAIL_RETRY_BACKOFF=BACKOFF,
+    )
+    with app.app_context():
+        yield app
+
+
+def queue(*recipients):
+    return [send_email('Test', recipient, '<p>Bonjour</p>').id for recipient in recipients]
+
+
+def deliver(app, worker_id='worker'):
+    return deliver_pending(worker_id, app.config, RateLimiter(0))
+
+
+def make_due(message_id):
+    db.session.execute(db.update(EmailOutbox).where(EmailOutbox.id == message_id)
+                       .values(next_attempt_at=datetime.utcnow() - timedelta(seconds=1)))
+    db.session.commit()
+
+
+def test_deliver_pending_sends_due_messages(app, smtp_server):
+    ids = queue('a@uir.ac.ma', 'b@uir.ac.ma', 'c@uir.ac.ma')
+
+    assert deliver(app) == 3
+
+    assert sorted(smtp_server.received) == ['a@uir.ac.ma', 'b@uir.ac.ma', 'c@uir.ac.ma']
+    for message in EmailOutbox.query.filter(EmailOutbox.id.in_(ids)):
+        assert message.status == 'sent'
+        assert message.sent_at is not None
+        assert message.claimed_by is None
+    assert deliver(app) == 0
+
+
+def test_refused_message_is_retried_with_exponential_backoff(app, smtp_server):
+    smtp_server.rejected.add('bad@uir.ac.ma')
+    bad, good = queue('bad@uir.ac.ma', 'good@uir.ac.ma')
+
+    before = datetime.utcnow()
+    assert deliver(app) == 1
+
+    message = db.session.get(EmailOutbox, bad)
+    assert message.status == 'pending'
+    assert message.attempts == 1
+    assert message.last_error
+    assert before + timedelta(seconds=BACKOFF - 1) <= message.next_attempt_at <= datetime.utcnow() + timedelta(seconds=BACKOFF)
+    assert db.session.get(EmailOutbox, good).status == 'sent'
+
+    # Not due yet: nothing is claimed
+    assert deliver(app) == 0
+    assert db.session.get(EmailOutbox, bad).attempts == 1
+
+    make_due(bad)
+    before = datetime.utcnow()
+    deliver(app)
+    message = db.session.get(EmailOutbox, bad)
+    assert message.attempts == 2
+    assert message.next_attempt_at >= before + timedelta(seconds=2 * BACKOFF - 1)
+
+
+def test_message_fails_after_max_attempts(app, smtp_server):
+    smtp_server.rejected.add('bad@uir.ac.ma')
+    bad, = queue('bad@uir.ac.ma')
+
+    for _ in range(app.config['MAIL_MAX_ATTEMPTS']):
+        make_due(bad)
+        deliver(app)
+
+    message = db.session.get(EmailOutbox, bad)
+    assert message.status == 'failed'
+    assert message.attempts == app.config['MAIL_MAX_ATTEMPTS']
+
+    make_due(bad)
+    assert claim_messages('other', 10) == []
+    assert smtp_server.received == []
+
+
+def test_claimed_messages_are_not_claimed_again(app):
+    ids = queue(*[f'user{i}@uir.ac.ma' for i in range(5)])
+
+    first = [message.id for message in claim_messages('first', 2)]
+    second = [message.id for message in claim_messages('second', 10)]
+
+    assert len(first) == 2
+    assert not set(first) & set(second)
+    assert sorted(first + second) == sorted(ids)
+    assert claim_messages('third', 10) == []
+
+
+def test_concurrent_workers_send_each_message_once(app, smtp_server):
+    recipients = [f'user{i}@uir.ac.ma' for i in range(60)]
+    queue(*recipients)
+    app.config['MAIL_BATCH_SIZE'] = 2  # small batches, so the workers claim in turns
+    errors = []
+
+    def worker(worker_id):
+        with app.app_context():
+            try:
+                deliver(app, worker_id)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                db.session.remove()
+
+    threads = [threading.Thread(target=worker, args=(f'worker-{i}',)) for i in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert sorted(smtp_server.received) == sorted(recipients)
+    assert EmailOutbox.query.filter_by(status='sent').count() == len(recipients)
@@ -0,0 +1,17 @@
+import pytest
+from check_query_plans import HOT_QUERIES, check_query_plans, migrated_sqlite_engine
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = migrated_sqlite_engine(tmp_path)
+    yield engine
+    engine.dispose()
+
+
+def test_hot_queries_use_the_indexes_created_by_the_migrations(engine):
+    with engine.connect() as connection:
+        failures = check_query_plans(connection, log=lambda message: None)
+
+    assert failures == []
+    assert len(HOT_QUERIES) == 8
@@ -0,0 +1,83 @@
+from datetime import datetime, timedelta
+
+import pytest
+from app.models import db, Department, ReplicaHeartbeat
+from app.utils.replica import REPLICA_BIND, read_replica, replica_health
+
+MAX_LAG = 30
+
+
+@pytest.fixture
+def app(make_app, tmp_path):
+    """Primary and replica are two SQLite files; the replica is filled by hand instead of replication"""
+    app = make_app(
+        DATABASE_REPLICA_URL=f"sqlite:///{tmp_path / 'replica.db'}",
+        REPLICA_MAX_LAG_SECONDS=MAX_LAG,
+        REPLICA_HEARTBEAT_INTERVAL=5,
+    )
+    with app.app_context():
+        db.metadata.create_all(db.engines[REPLICA_BIND])
+        db.session.add(Department(name='primary'))
+        db.session.commit()
+        with db.engines[REPLICA_BIND].begin() as connection:
+            connection.execute(db.insert(Department).values(name='replica'))
+        replica_health.checked_at = 0  # no verdict cached from another test
+        yield app
+
+
+def set_replica_heartbeat(age_seconds):
+    with db.engines[REPLICA_BIND].begin() as connection:
+        connection.execute(db.delete(ReplicaHeartbeat))
+        connection.execute(db.insert(ReplicaHeartbeat).values(
+            id=1, beat_at=datetime.utcnow() - timedelta(seconds=age_seconds)))
+
+
+def department_names(engine):
+    with engine.connect() as connection:
+        return sorted(connection.execute(db.select(Department.name)).scalars())
+
+
+@read_replica
+def list_departments():
+    return [department.name for department in Department.query.order_by(Department.name)]
+
+
+def test_reads_go_to_a_fresh_replica(app):
+    set_replica_heartbeat(age_seconds=1)
+
+    with app.test_request_context():
+        assert list_departments() == ['replica']
+        # Outside the decorated view the primary is used again
+        assert [department.name for department in Department.query] == ['primary']
+
+
+def test_reads_fall_back_to_the_primary_when_the_replica_lags(app):
+    set_replica_heartbeat(age_seconds=MAX_LAG + app.config['REPLICA_HEARTBEAT_INTERVAL'] + 10)
+
+    with app.test_request_context():
+        assert list_departments() == ['primary']
+
+
+def test_reads_fall_back_to_the_primary_without_heartbeat(app):
+    with app.test_request_context():
+        assert list_departments() == ['primary']
+
+
+def test_writes_and_flushes_go_to_the_primary(app):
+    set_replica_heartbeat(age_seconds=1)
+
+    @read_replica
+    def write_in_replica_view():
+        db.session.add(Department(name='added'))
+        db.session.flush()
+        db.session.execute(db.update(Department).where(Department.name == 'primary').values(description='updated'))
+        db.session.commit()
+
+    with app.test_request_context():
+        write_in_replica_view()
+
+    assert department_names(db.engines[None]) == ['added', 'primary']
+    assert department_names(db.engines[REPLICA_BIND]) == ['replica']
+    with db.engines[None].connect() as connection:
+        assert connection.execute(
+            db.select(Department.description).where(Department.name == 'primary')).scalar() == 'updated'
@@ -0,0 +1,48 @@
+from datetime import datetime, timedelta
+
+from app.models import db, AcademicYear, Course, Department, Semester, Subject, Track, User
+from app.utils.scheduler import local_now, run_course_scheduler_tick
+
+TIMEZONE = 'Asia/Tokyo'  # far from UTC, so a mix-up of the two shows
+
+
+def add_course(**values):
+    department = Department.query.first() or Department(name='Informatique')
+    track = Track.query.first() or Track(name='Genie Informatique', department=department)
+    year = AcademicYear.query.first() or AcademicYear(name='L1', order=1, track=track)
+    semester = Semester.query.first() or Semester(name='Semestre 1', order=1, academic_year=year)
+    subject = Subject.query.first() or Subject(name='Algorithmique', code='INFO-L1-01', semester=semester)
+    teacher = User.query.first() or User(email='prof@uir.ac.ma', first_name='Prof', last_name='Nom', role='teacher')
+    course = Course(subject=subject, teacher=teacher, course_type='CM', **values)
+    db.session.add(course)
+    db.session.commit()
+    return course.id
+
+
+def test_planned_sessions_open_at_their_wall_clock_time(app):
+    app.config.update(COURSE_AUTO_START=True, COURSE_SCHEDULE_TIMEZONE=TIMEZONE)
+    wall_clock = local_now(TIMEZONE)
+    due = add_course(status='pending', scheduled_date=wall_clock - timedelta(minutes=1))
+    later = add_course(status='pending', scheduled_date=wall_clock + timedelta(minutes=30))
+    # Due if the planned time were read as UTC, but nine hours ago in wall-clock time
+    utc_reading = add_course(status='pending', scheduled_date=datetime.utcnow() - timedelta(minutes=1))
+
+    before = datetime.utcnow()
+    assert run_course_scheduler_tick(app.config) == (1, 0)
+
+    course = db.session.get(Course, due)
+    assert course.status == 'active'
+    assert before <= course.started_at <= datetime.utcnow()  # recorded in UTC like the other timestamps
+    assert db.session.get(Course, later).status == 'pending'
+    assert db.session.get(Course, utc_reading).status == 'pending'
+
+
+def test_sessions_running_too_long_are_closed(app):
+    now = datetime.utcnow()
+    overdue = add_course(status='active', started_at=now - timedelta(minutes=app.config['COURSE_MAX_DURATION_MINUTES'] + 1))
+    running = add_course(status='active', started_at=now - timedelta(minutes=5))
+
+    assert run_course_scheduler_tick(app.config) == (0, 1)
+
+    assert db.session.get(Course, overdue).status == 'completed'
+    assert db.session.get(Course, running).status == 'active'
@@ -0,0 +1,32 @@
+from app.models import db, AcademicYear, Department, Semester, Subject, Track
+from app.utils.structure import clone_track_structure, generate_academic_structure
+from app.utils.subject_codes import allocate_subject_code
+
+
+def subject_codes(track):
+    return [code for (code,) in db.session.execute(
+        db.select(Subject.code).join(Semester).join(AcademicYear)
+        .where(AcademicYear.track_id == track.id).order_by(Subject.id))]
+
+
+def test_cloned_subjects_get_the_target_prefix(app):
+    department = Department(name='Informatique')
+    source = Track(name='Genie Informatique', department=department)
+    target = Track(name='Data Science', department=department)
+    db.session.add_all([department, source, target])
+    db.session.flush()
+    generate_academic_structure(source)
+    l1, l2 = AcademicYear.query.filter_by(track_id=source.id).order_by(AcademicYear.order)[:2]
+    for year, count in ((l1, 2), (l2, 1)):
+        for _ in range(count):
+            db.session.add(Subject(name='Matière', code=allocate_subject_code(source, year),
+                                   semester=year.semesters[0]))
+    db.session.commit()
+    assert subject_codes(source) == ['INFO-L1-01', 'INFO-L1-02', 'INFO-L2-01']
+
+    assert clone_track_structure(source, target) == (3, 6, 3)
+    db.session.commit()
+
+    assert subject_codes(target) == ['DATA-L1-01', 'DATA-L1-02', 'DATA-L2-01']
+    target_l1 = AcademicYear.query.filter_by(track_id=target.id, order=1).one()
+    assert allocate_subject_code(target, target_l1) == 'DATA-L1-03'